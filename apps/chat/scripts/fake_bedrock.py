@@ -0,0 +1,97 @@
+"""
+Deterministic stand-in for the boto3 bedrock-runtime client, used by the load benchmark.
+
+Embeddings are normalized bags of hashed words, so related texts are close in vector space and
+the similarity-based features behave realistically. Completions echo a fixed-size answer and
+can be streamed. Latencies are configurable and every call is counted. With max_input_chars,
+longer texts are rejected like inputs over the Titan token limit.
+"""
+import hashlib
+import io
+import json
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+import numpy as np
+from botocore.exceptions import ClientError
+
+class FakeBedrockRuntimeClient:
+    def __init__(self, embedding_latency_ms: float = 30.0, llm_latency_ms: float = 800.0, llm_first_token_ms: float = 300.0, response_words: int = 60, max_input_chars: Optional[int] = None):
+        self.max_input_chars = max_input_chars
+        self.embedding_latency_ms = embedding_latency_ms
+        self.llm_latency_ms = llm_latency_ms
+        self.llm_first_token_ms = llm_first_token_ms
+        self.response_words = response_words
+        self._lock = threading.Lock()
+        self.calls: Dict[str, int] = {"embedding": 0, "llm": 0, "llm_stream": 0}
+
+    def _count(self, kind: str):
+        with self._lock:
+            self.calls[kind] += 1
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls = {kind: 0 for kind in self.calls}
+
+    @staticmethod
+    def embed(text: str, dimension: int) -> np.ndarray:
+        vector = np.zeros(dimension, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            seed = int.from_bytes(hashlib.sha256(word.encode("utf-8")).digest()[:8], "little")
+            vector += np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _completion_text(self, body: dict) -> str:
+        messages = body.get("messages") or [{"content": ""}]
+        last = messages[-1].get("content")
+        prompt = last if isinstance(last, str) else " ".join(block.get("text", "") for block in last if isinstance(block, dict))
+        words = (re.findall(r"\w+", prompt) or ["ok"]) * self.response_words
+        return "Answer: " + " ".join(words[:self.response_words])
+
+    def invoke_model(self, body, modelId, accept=None, contentType=None, **kwargs):
+        request = json.loads(body)
+        if "inputText" in request:
+            self._count("embedding")
+            time.sleep(self.embedding_latency_ms / 1000)
+            if self.max_input_chars is not None and len(request["inputText"]) > self.max_input_chars:
+                raise ClientError({"Error": {"Code": "ValidationException", "Message": "Too many input tokens"}}, "InvokeModel")
+            embedding = self.embed(request["inputText"], request.get("dimensions", 512))
+            payload = {"embedding": embedding.tolist(), "inputTextTokenCount": len(request["inputText"].split())}
+            return {"body": io.BytesIO(json.dumps(payload).encode("utf-8")), "ResponseMetadata": {"HTTPHeaders": {}}}
+
+        self._count("llm")
+        time.sleep(self.llm_latency_ms / 1000)
+        text = self._completion_text(request)
+        input_tokens, output_tokens = len(body) // 4, len(text) // 4
+        payload = {
+            "id": "fake",
+            "type": "message",
+            "role": "assistant",
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+        }
+        headers = {"x-amzn-bedrock-input-token-count": str(input_tokens), "x-amzn-bedrock-output-token-count": str(output_tokens)}
+        return {"body": io.BytesIO(json.dumps(payload).encode("utf-8")), "ResponseMetadata": {"HTTPHeaders": headers}}
+
+    def invoke_model_with_response_stream(self, body, modelId, accept=None, contentType=None, **kwargs):
+        self._count("llm_stream")
+        request = json.loads(body)
+        text = self._completion_text(request)
+        words = text.split(" ")
+        per_word_s = max(0.0, self.llm_latency_ms - self.llm_first_token_ms) / 1000 / max(len(words), 1)
+
+        def events():
+            time.sleep(self.llm_first_token_ms / 1000)
+            yield {"chunk": {"bytes": json.dumps({"type": "message_start", "message": {"usage": {"input_tokens": len(body) // 4}}}).encode()}}
+            for index, word in enumerate(words):
+                delta = {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": word if index == 0 else f" {word}"}}
+                yield {"chunk": {"bytes": json.dumps(delta).encode()}}
+                time.sleep(per_word_s)
+            yield {"chunk": {"bytes": json.dumps({"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": len(text) // 4}}).encode()}}
+            yield {"chunk": {"bytes": json.dumps({"type": "message_stop", "amazon-bedrock-invocationMetrics": {"inputTokenCount": len(body) // 4, "outputTokenCount": len(text) // 4}}).encode()}}
+
+        return {"body": events(), "ResponseMetadata": {"HTTPHeaders": {}}}
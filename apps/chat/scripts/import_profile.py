@@ -0,0 +1,80 @@
+"""
+Profiles the cold import of the Lambda handler module and enforces startup budgets.
+
+Runs `python -X importtime -c "import chat"` in a fresh interpreter, prints the slowest imports
+by cumulative time, and measures the resident memory of a fresh process after the import.
+Exits with status 1 when either budget is exceeded, so it can gate CI:
+
+    python scripts/import_profile.py --top 25 --budget-ms 400 --budget-rss-mb 80
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+from config import IMPORT_TIME_BUDGET_MS, IMPORT_RSS_BUDGET_MB
+
+# Linux carries ru_maxrss across exec, so a probe started from a large process (pytest) would
+# report its parent's peak; VmHWM starts afresh with the new image and is also in kilobytes.
+RSS_PROBE = (
+    "import resource, {module}\n"
+    "try:\n"
+    "    print(next(int(line.split()[1]) for line in open('/proc/self/status') if line.startswith('VmHWM:')))\n"
+    "except OSError:\n"
+    "    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)\n"
+)
+
+def profile_import(module: str):
+    """Returns [(cumulative_us, self_us, name)] for every import done while importing module."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        entries.append((int(cumulative_us), int(self_us), name[1:].rstrip()))
+    return entries
+
+def measure_rss_mb(module: str) -> float:
+    """Peak resident memory of a fresh interpreter after importing module, in MB."""
+    result = subprocess.run(
+        [sys.executable, "-c", RSS_PROBE.format(module=module)],
+        cwd=SRC_DIR, capture_output=True, text=True, check=True
+    )
+    max_rss = int(result.stdout.strip().splitlines()[-1])
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux.
+    return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="chat")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_TIME_BUDGET_MS)
+    parser.add_argument("--budget-rss-mb", type=float, default=IMPORT_RSS_BUDGET_MB)
+    args = parser.parse_args()
+
+    entries = profile_import(args.module)
+    total_ms = max(cumulative for cumulative, _, name in entries if name == args.module) / 1000
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative, self_us, name in sorted(entries, reverse=True)[:args.top]:
+        print(f"{cumulative / 1000:14.1f} {self_us / 1000:9.1f}  {name}")
+
+    rss_mb = measure_rss_mb(args.module)
+    print(f"\nTotal import time: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    print(f"Resident memory after import: {rss_mb:.1f} MB (budget {args.budget_rss_mb:.0f} MB)")
+
+    over_budget = total_ms > args.budget_ms or rss_mb > args.budget_rss_mb
+    if over_budget:
+        print("Startup budget exceeded.")
+    sys.exit(1 if over_budget else 0)
+
+if __name__ == "__main__":
+    main()
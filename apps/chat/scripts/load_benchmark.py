@@ -0,0 +1,263 @@
+"""
+Load benchmark for the chat turn, runnable without AWS.
+
+Bedrock is replaced by FakeBedrockRuntimeClient (configurable latency, deterministic outputs)
+injected where get_bedrock_client() is used. The database is either the in-memory stand-in
+(--db memory) or the Postgres configured for the app (--db postgres, schema migrated first).
+Virtual users run their turns sequentially on --concurrency threads against conversations
+seeded with --corpus-size messages each.
+
+Reports latency percentiles, throughput, and Bedrock calls and database round trips per turn,
+and writes them to bench_results/<commit>-<label>.json so runs can be compared across commits:
+
+    python scripts/load_benchmark.py --concurrency 16 --users 64 --turns 5 --corpus-size 200
+    python scripts/load_benchmark.py --mode async --concurrency 64 --users 64
+    python scripts/load_benchmark.py --mode stream --baseline scripts/bench_results/abc1234-default.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, "..", "src"))
+sys.path.insert(0, SCRIPTS_DIR)
+
+# Model IDs only select the request format; nothing is sent to AWS.
+os.environ.setdefault("AWS_BEDROCK_LLM_ID", "anthropic.claude-3-haiku-20240307-v1:0")
+os.environ.setdefault("AWS_BEDROCK_EMBEDDING_MODEL_ID", "amazon.titan-embed-text-v2:0")
+os.environ.setdefault("AWS_CURRENT_REGION", "us-east-1")
+os.environ.setdefault("AWS_BEDROCK_REGION", "us-east-1")
+
+import chat
+import db_handler
+import utils
+from bedrock_client import ManagedBedrockClient, get_bedrock_metrics
+from config import AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION
+from embedding_vector_handler import get_embedding_cache_metrics
+from fake_bedrock import FakeBedrockRuntimeClient
+
+RESULTS_DIR = os.path.join(SCRIPTS_DIR, "bench_results")
+
+QUESTIONS = [
+    "What did we decide about the project deadline?",
+    "Can you summarize the main points so far?",
+    "How do I configure the database connection pool?",
+    "What is the difference between HNSW and IVFFlat indexes?",
+    "Remind me what topic {n} was about.",
+    "Which option did I prefer for topic {n}?",
+]
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+class PostgresRoundTrips:
+    """Counts statements on the app's pooled connections by swapping in a counting cursor class."""
+
+    def __init__(self):
+        import psycopg2.extensions
+
+        self.round_trips = 0
+        self.connections_borrowed = 0
+        lock = threading.Lock()
+        counter = self
+
+        class CountingCursor(psycopg2.extensions.cursor):
+            def execute(self, query, vars=None):
+                with lock:
+                    counter.round_trips += 1
+                return super().execute(query, vars)
+
+        original_open = utils._open_connection
+
+        def open_counting_connection(rds_config):
+            conn = original_open(rds_config)
+            conn.cursor_factory = CountingCursor
+            return conn
+
+        utils._open_connection = open_counting_connection
+
+    def reset_counters(self):
+        self.round_trips = 0
+
+    def seed_conversation(self, user_id: str, message_count: int, bedrock_client) -> int:
+        with utils.get_db_connection() as conn:
+            conversation_id = db_handler.create_conversation(conn, user_id)
+            messages = []
+            for index in range(message_count):
+                role = db_handler.USER_ROLE if index % 2 == 0 else db_handler.ASSISTANT_ROLE
+                content = f"Seeded message {index} about topic {index % 17} for {user_id}."
+                messages.append((role, content, bedrock_client.embed(content, AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION)))
+            for start in range(0, len(messages), 500):
+                db_handler.save_messages(conn, conversation_id, messages[start:start + 500])
+        return conversation_id
+
+def run_turn(args, user_id: str, conversation_id: int, question: str):
+    """Runs one turn and returns (seconds, seconds_to_first_token or None, ok)."""
+    started = time.perf_counter()
+    if args.mode == "stream":
+        first_token = None
+        ok = True
+        for event in chat.stream_chat_turn(question, user_id, conversation_id=conversation_id, tenant_id=args.tenant_id):
+            if event["type"] == "token" and first_token is None:
+                first_token = time.perf_counter() - started
+            elif event["type"] == "error":
+                ok = False
+        return time.perf_counter() - started, first_token, ok
+    result = chat.lambda_handler(
+        {"input": question, "user_id": user_id, "conversation_id": conversation_id, "tenant_id": args.tenant_id}, None
+    )
+    return time.perf_counter() - started, None, not isinstance(result.get("response"), dict)
+
+def run_user(args, user_id: str, conversation_id: int, rng: random.Random):
+    samples = []
+    for _ in range(args.turns):
+        question = rng.choice(QUESTIONS).format(n=rng.randrange(17))
+        samples.append(run_turn(args, user_id, conversation_id, question))
+    return samples
+
+async def run_users_async(args, users, conversations):
+    """Runs every user as a coroutine against async_handler, at most --concurrency turns in flight."""
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run_async_user(user_id: str, rng: random.Random):
+        samples = []
+        for _ in range(args.turns):
+            question = rng.choice(QUESTIONS).format(n=rng.randrange(17))
+            async with semaphore:
+                started = time.perf_counter()
+                result = await chat.async_handler(
+                    {"input": question, "user_id": user_id, "conversation_id": conversations[user_id], "tenant_id": args.tenant_id}
+                )
+                samples.append((time.perf_counter() - started, None, not isinstance(result.get("response"), dict)))
+        return samples
+
+    per_user = await asyncio.gather(*(run_async_user(user_id, random.Random(f"{args.seed}-{user_id}")) for user_id in users))
+    return [sample for samples in per_user for sample in samples]
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPTS_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(result: dict, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline.get('commit')} ({baseline_path}):")
+    for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_tps", "bedrock_calls_per_turn", "db_round_trips_per_turn"):
+        before, after = baseline["results"].get(key), result["results"].get(key)
+        if before:
+            print(f"  {key:<26} {before:>10.2f} -> {after:>10.2f} ({(after - before) / before * 100:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", choices=["memory", "postgres"], default="memory")
+    parser.add_argument("--mode", choices=["handler", "stream", "async"], default="handler")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=32)
+    parser.add_argument("--turns", type=int, default=5, help="Turns per user, i.e. how much each conversation grows")
+    parser.add_argument("--corpus-size", type=int, default=100, help="Messages seeded into each user's conversation")
+    parser.add_argument("--embedding-latency-ms", type=float, default=30.0)
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0)
+    parser.add_argument("--llm-first-token-ms", type=float, default=300.0)
+    parser.add_argument("--db-latency-ms", type=float, default=1.0, help="Simulated round-trip time of the in-memory store")
+    parser.add_argument("--tenant-id", default="bench")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--label", default="default")
+    parser.add_argument("--baseline", help="Earlier result file to compare against")
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+
+    bedrock = FakeBedrockRuntimeClient(args.embedding_latency_ms, args.llm_latency_ms, args.llm_first_token_ms)
+    # The fake sits behind the same rate-limiting and circuit-breaking layer as the real client.
+    managed_bedrock = ManagedBedrockClient(bedrock)
+    utils.get_bedrock_client = lambda: managed_bedrock
+    chat.get_bedrock_client = lambda: managed_bedrock
+
+    if args.db == "memory":
+        from memory_store import InMemoryStore
+
+        store = InMemoryStore(round_trip_latency_ms=args.db_latency_ms)
+        store.install(chat)
+    else:
+        store = PostgresRoundTrips()
+        if args.mode != "async":
+            # Threaded turns are not gated like async_handler's, and each can hold two connections
+            # at once (its own and get_relevant_context's); async turns queue for half the pool.
+            pool = utils.get_connection_pool()
+            pool.max_size = max(pool.max_size, 2 * args.concurrency + 1)
+
+    users = [f"bench-user-{index}" for index in range(args.users)]
+    conversations = {user_id: store.seed_conversation(user_id, args.corpus_size, bedrock) for user_id in users}
+    chat.get_async_graph() if args.mode == "async" else chat.get_graph()
+    bedrock.reset_counters()
+    store.reset_counters()
+
+    started = time.perf_counter()
+    if args.mode == "async":
+        samples = asyncio.run(run_users_async(args, users, conversations))
+    else:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            futures = [
+                executor.submit(run_user, args, user_id, conversations[user_id], random.Random(f"{args.seed}-{user_id}"))
+                for user_id in users
+            ]
+            samples = [sample for future in futures for sample in future.result()]
+    elapsed = time.perf_counter() - started
+    # Write-behind work runs on the background worker; wait for it so its calls are counted.
+    utils.run_in_background(lambda: None).result()
+
+    latencies_ms = [seconds * 1000 for seconds, _, _ in samples]
+    first_tokens_ms = [first * 1000 for _, first, _ in samples if first is not None]
+    turns = len(samples)
+    result = {
+        "commit": git_commit(),
+        "label": args.label,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "config": vars(args),
+        "results": {
+            "turns": turns,
+            "errors": sum(1 for _, _, ok in samples if not ok),
+            "p50_ms": percentile(latencies_ms, 50),
+            "p95_ms": percentile(latencies_ms, 95),
+            "p99_ms": percentile(latencies_ms, 99),
+            "mean_ms": statistics.fmean(latencies_ms) if latencies_ms else 0.0,
+            "first_token_p50_ms": percentile(first_tokens_ms, 50) if first_tokens_ms else None,
+            "first_token_p95_ms": percentile(first_tokens_ms, 95) if first_tokens_ms else None,
+            "throughput_tps": turns / elapsed if elapsed else 0.0,
+            "bedrock_calls": dict(bedrock.calls),
+            "bedrock_calls_per_turn": sum(bedrock.calls.values()) / turns if turns else 0.0,
+            "db_round_trips_per_turn": store.round_trips / turns if turns else 0.0,
+            "embedding_cache": get_embedding_cache_metrics(),
+            "bedrock_client": get_bedrock_metrics(),
+        },
+    }
+    print(json.dumps(result["results"], indent=2))
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{result['commit']}-{args.label}.json")
+        with open(path, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved {path}")
+    if args.baseline:
+        compare(result, args.baseline)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+In-memory stand-in for the Postgres-backed functions of db_handler, semantic_cache and retrieval, used by
+the load benchmark when no database is available.
+
+Each replaced function counts as one database round trip, matching the statements the real
+implementation issues. An optional
+per-round-trip latency models the network distance to RDS.
+"""
+import contextlib
+import itertools
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import db_handler
+import retrieval
+import semantic_cache
+from config import (
+    AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION,
+    SEMANTIC_CACHE_SIMILARITY_THRESHOLD,
+    EMBEDDING_BACKFILL_MAX_ATTEMPTS,
+    EMBEDDING_BACKFILL_RETRY_SECONDS,
+    RETRIEVAL_CANDIDATES,
+    RETRIEVAL_RRF_K,
+    RETRIEVAL_TOP_N,
+)
+from embedding_vector_handler import embed_text
+
+class InMemoryStore:
+    def __init__(self, round_trip_latency_ms: float = 0.0):
+        self.round_trip_latency_ms = round_trip_latency_ms
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.conversations: Dict[int, Dict] = {}
+        self.messages: List[Dict] = []
+        self.summaries: Dict[int, Dict] = {}
+        self.cache_entries: List[Dict] = []
+        self.round_trips = 0
+        self.connections_borrowed = 0
+
+    def _round_trip(self, count: int = 1):
+        with self._lock:
+            self.round_trips += count
+        if self.round_trip_latency_ms:
+            time.sleep(count * self.round_trip_latency_ms / 1000)
+
+    def reset_counters(self):
+        with self._lock:
+            self.round_trips = 0
+            self.connections_borrowed = 0
+
+    def seed_conversation(self, user_id: str, message_count: int, bedrock_client) -> int:
+        """Creates a conversation with message_count alternating messages, without counting round trips."""
+        with self._lock:
+            conversation_id = next(self._ids)
+            self.conversations[conversation_id] = {"user_id": user_id, "created_at": time.time()}
+        for index in range(message_count):
+            role = db_handler.USER_ROLE if index % 2 == 0 else db_handler.ASSISTANT_ROLE
+            content = f"Seeded message {index} about topic {index % 17} for {user_id}."
+            self._insert(conversation_id, role, content, bedrock_client.embed(content, AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION))
+        return conversation_id
+
+    def _insert(self, conversation_id: int, role: str, content: str, embedding: Optional[np.ndarray]):
+        message_type = db_handler.MESSAGE_TYPE_HUMAN if role == db_handler.USER_ROLE else db_handler.MESSAGE_TYPE_AI
+        with self._lock:
+            self.messages.append({
+                "id": next(self._ids), "conversation_id": conversation_id, "role": role,
+                "content": content, "type": message_type, "embedding": embedding, "timestamp": time.time(),
+                "embedding_attempts": 0, "embedding_claimed_at": None,
+            })
+
+    def _conversation_messages(self, conversation_id: int) -> List[Dict]:
+        with self._lock:
+            return [message for message in self.messages if message["conversation_id"] == conversation_id]
+
+    # Replacements for db_handler
+
+    def create_conversation(self, conn, user_id):
+        self._round_trip()
+        with self._lock:
+            conversation_id = next(self._ids)
+            self.conversations[conversation_id] = {"user_id": user_id, "created_at": time.time()}
+        return conversation_id
+
+    def _conversation_row(self, conversation_id: int) -> Dict:
+        messages = self._conversation_messages(conversation_id)
+        conversation = self.conversations[conversation_id]
+        last_active_at = messages[-1]["timestamp"] if messages else conversation["created_at"]
+        return {"conversation_id": conversation_id, "user_id": conversation["user_id"], "archived": False, "last_active_at": last_active_at}
+
+    def get_latest_conversation(self, conn, user_id):
+        self._round_trip()
+        with self._lock:
+            owned = [conversation_id for conversation_id, conversation in self.conversations.items() if conversation["user_id"] == user_id]
+        return self._conversation_row(max(owned)) if owned else None
+
+    def get_conversation(self, conn, conversation_id):
+        self._round_trip()
+        with self._lock:
+            exists = conversation_id in self.conversations
+        return self._conversation_row(conversation_id) if exists else None
+
+    def save_message(self, conn, bedrock_client, conversation_id, role, content, embedding=None):
+        if embedding is None:
+            embedding = embed_text(bedrock_client, content, dimension=AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION)
+        self._round_trip()
+        self._insert(conversation_id, role, content, embedding)
+        return True
+
+    def save_messages(self, conn, conversation_id, messages):
+        self._round_trip()
+        for role, content, embedding in messages:
+            self._insert(conversation_id, role, content, embedding)
+        return True
+
+    def claim_messages_to_embed(self, conn, batch_size):
+        self._round_trip()
+        now = time.time()
+        with self._lock:
+            pending = sorted(
+                (
+                    message for message in self.messages
+                    if message["embedding"] is None and message["embedding_attempts"] < EMBEDDING_BACKFILL_MAX_ATTEMPTS
+                    and (message["embedding_claimed_at"] is None or message["embedding_claimed_at"] < now - EMBEDDING_BACKFILL_RETRY_SECONDS)
+                ),
+                key=lambda message: (message["embedding_attempts"], message["id"])
+            )[:batch_size]
+            for message in pending:
+                message["embedding_attempts"] += 1
+                message["embedding_claimed_at"] = now
+            return [(message["id"], message["conversation_id"], message["content"], message["embedding_attempts"]) for message in pending]
+
+    def store_message_embeddings(self, conn, updates):
+        self._round_trip()
+        embeddings = {message_id: embedding for message_id, _, embedding in updates}
+        with self._lock:
+            for message in self.messages:
+                if message["id"] in embeddings:
+                    message["embedding"] = embeddings[message["id"]]
+        return True
+
+    def get_conversation_history(self, conn, conversation_id, limit=None):
+        self._round_trip()
+        messages = self._conversation_messages(conversation_id)
+        if limit is not None:
+            messages = messages[-limit:]
+        return [{"id": message["id"], "role": message["role"], "content": message["content"], "type": message["type"]} for message in messages]
+
+    def get_relevant_messages(self, conn, conversation_id, query_text, bedrock_client, top_n=3, query_embedding=None):
+        if query_embedding is None:
+            query_embedding = embed_text(bedrock_client, query_text, dimension=AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION)
+        if query_embedding is None:
+            return []
+        self._round_trip()
+        candidates = [message for message in self._conversation_messages(conversation_id) if message["embedding"] is not None]
+        candidates.sort(key=lambda message: -float(np.dot(message["embedding"], query_embedding)))
+        return [{"role": message["role"], "content": message["content"]} for message in candidates[:top_n]]
+
+    # Replacement for retrieval (messages only: the store has no document corpus)
+
+    def hybrid_search(self, conn, user_id, query_text, query_embedding, top_n=RETRIEVAL_TOP_N, metadata_filter=None, include_documents=True, timeout_ms=None):
+        self._round_trip()
+        with self._lock:
+            owned = {conversation_id for conversation_id, conversation in self.conversations.items() if conversation["user_id"] == user_id}
+            messages = [message for message in self.messages if message["conversation_id"] in owned]
+        query_words = set(query_text.lower().split())
+        by_vector = sorted(
+            (message for message in messages if message["embedding"] is not None),
+            key=lambda message: -float(np.dot(message["embedding"], query_embedding))
+        )[:RETRIEVAL_CANDIDATES]
+        by_text = sorted(
+            (message for message in messages if query_words & set(message["content"].lower().split())),
+            key=lambda message: -len(query_words & set(message["content"].lower().split()))
+        )[:RETRIEVAL_CANDIDATES]
+        results: Dict[int, Dict] = {}
+        for arm, ranked in (("vector_rank", by_vector), ("text_rank", by_text)):
+            for rank, message in enumerate(ranked, start=1):
+                result = results.setdefault(message["id"], {
+                    "source": "message", "id": message["id"], "role": message["role"], "content": message["content"],
+                    "document_source": None, "metadata": None, "score": 0.0, "vector_rank": None, "text_rank": None,
+                })
+                result["score"] += 1.0 / (RETRIEVAL_RRF_K + rank)
+                result[arm] = rank
+        return sorted(results.values(), key=lambda result: -result["score"])[:top_n]
+
+    def get_conversation_summary(self, conn, conversation_id):
+        self._round_trip()
+        with self._lock:
+            stored = self.summaries.get(conversation_id)
+        return dict(stored) if stored else None
+
+    def get_messages_to_summarize(self, conn, conversation_id, after_message_id, before_message_id, limit):
+        self._round_trip()
+        return [
+            {"id": message["id"], "role": message["role"], "content": message["content"]}
+            for message in self._conversation_messages(conversation_id) if after_message_id < message["id"] < before_message_id
+        ][:limit]
+
+    def upsert_conversation_summary(self, conn, conversation_id, summary, last_message_id):
+        self._round_trip()
+        with self._lock:
+            stored = self.summaries.get(conversation_id)
+            if stored is None or stored["last_message_id"] < last_message_id:
+                self.summaries[conversation_id] = {"summary": summary, "last_message_id": last_message_id}
+        return True
+
+    # Replacements for semantic_cache
+
+    def lookup_cached_response(self, conn, tenant_id, context_key, query_embedding):
+        self._round_trip()
+        with self._lock:
+            entries = [entry for entry in self.cache_entries if entry["tenant_id"] == tenant_id and entry["context_hash"] == context_key]
+        if not entries:
+            return None
+        best = max(entries, key=lambda entry: float(np.dot(entry["query_embedding"], query_embedding)))
+        similarity = float(np.dot(best["query_embedding"], query_embedding))
+        if similarity < SEMANTIC_CACHE_SIMILARITY_THRESHOLD:
+            return None
+        return {"id": best["id"], "response": best["response"], "similarity": similarity}
+
+    def record_cache_hit(self, conn, entry_id):
+        self._round_trip()
+
+    def store_cached_response(self, conn, tenant_id, context_key, query_text, query_embedding, response):
+        self._round_trip(2)
+        with self._lock:
+            self.cache_entries.append({
+                "id": next(self._ids), "tenant_id": tenant_id, "context_hash": context_key,
+                "query_embedding": query_embedding, "response": response,
+            })
+        return True
+
+    @contextlib.contextmanager
+    def get_db_connection(self):
+        with self._lock:
+            self.connections_borrowed += 1
+        yield self
+
+    @contextlib.asynccontextmanager
+    async def get_async_db_connection(self):
+        with self.get_db_connection() as conn:
+            yield conn
+
+    def install(self, chat_module, patch=setattr):
+        """
+        Replaces the database functions used by the chat graph with this store's methods.
+        patch(target, name, value) does the replacing; tests pass monkeypatch.setattr.
+        """
+        for name in (
+            "create_conversation", "get_latest_conversation", "get_conversation", "save_message", "save_messages", "claim_messages_to_embed", "store_message_embeddings",
+            "get_conversation_history", "get_relevant_messages", "get_conversation_summary",
+            "get_messages_to_summarize", "upsert_conversation_summary",
+        ):
+            patch(db_handler, name, getattr(self, name))
+        for name in ("lookup_cached_response", "record_cache_hit", "store_cached_response"):
+            patch(semantic_cache, name, getattr(self, name))
+        patch(retrieval, "hybrid_search", self.hybrid_search)
+        patch(chat_module, "get_db_connection", self.get_db_connection)
+        patch(chat_module, "get_async_db_connection", self.get_async_db_connection)
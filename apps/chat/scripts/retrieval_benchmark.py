@@ -0,0 +1,259 @@
+"""
+Measures latency and quality of hybrid retrieval (retrieval.hybrid_search) on a synthetic corpus.
+
+--populate N inserts N documents and N messages spread over --users users. Rows are drawn from
+--topics clusters: each topic has its own vocabulary and centroid vector, every row mixes topic
+words with common words, and every document also carries a unique reference code. Rows are
+marked (source / user_id prefix) so --clean removes exactly them. Populating 1M rows takes a
+while; the ANN and GIN indexes are maintained during the insert.
+
+Each query targets one stored document: its vector is the document's embedding plus noise and
+its text is three of the document's topic words. Reported per run:
+
+- latency percentiles and timeouts of hybrid_search (the production single-round-trip path),
+- recall@k of the ANN document arm against exact search (index scans disabled),
+- hit@k of the target document for the vector arm alone, the text arm alone, and the fusion.
+
+    python scripts/retrieval_benchmark.py --populate 1000000 --users 1000
+    python scripts/retrieval_benchmark.py --queries 200 --top-k 5 --filter
+    python scripts/retrieval_benchmark.py --clean
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import retrieval
+from db_handler import CONVERSATIONS_TABLE, MESSAGES_TABLE, DOCUMENTS_TABLE, VECTOR_DISTANCE_OPERATOR, VECTOR_PARAM_SQL, vector_column_sql, vector_search_settings_sql
+from schema import migrate
+from utils import get_db_connection
+from config import AWS_RDS_PG_VECTOR_DIMENSION, RETRIEVAL_TEXT_SEARCH_CONFIG
+
+BENCH_SOURCE = "retrieval-benchmark"
+BENCH_USER_PREFIX = "retrieval-bench-"
+EXACT_SETTINGS = "SET LOCAL enable_indexscan = off; SET LOCAL enable_bitmapscan = off;"
+COMMON_WORDS = ["report", "status", "update", "question", "meeting", "project", "team", "review", "plan", "issue", "change", "result"]
+SYLLABLES = ["ka", "lo", "mi", "ner", "sto", "val", "qui", "dra", "pen", "tor", "bel", "zu", "fa", "rin", "gos", "hel"]
+
+def topic_vocabulary(rng: np.random.Generator, topics: int, words_per_topic: int):
+    """Pronounceable made-up words, so each topic's vocabulary is disjoint and survives stemming."""
+    vocabulary = []
+    for topic in range(topics):
+        vocabulary.append([
+            "".join(rng.choice(SYLLABLES, size=3)) + f"{topic}x{word}" for word in range(words_per_topic)
+        ])
+    return vocabulary
+
+def reference_code(document_number: int) -> str:
+    return f"ref{document_number:07d}"
+
+def unit_rows(matrix: np.ndarray) -> np.ndarray:
+    return (matrix / np.linalg.norm(matrix, axis=1, keepdims=True)).astype(np.float32)
+
+def synthetic_rows(rng, centroids, vocabulary, count: int, noise: float):
+    """Returns (topics, embeddings, texts) for count rows."""
+    topics = rng.integers(0, len(centroids), size=count)
+    embeddings = unit_rows(centroids[topics] + rng.normal(0, noise / np.sqrt(centroids.shape[1]), size=(count, centroids.shape[1])))
+    texts = [
+        " ".join(list(rng.choice(vocabulary[topic], size=6)) + list(rng.choice(COMMON_WORDS, size=4)))
+        for topic in topics
+    ]
+    return topics, embeddings, texts
+
+def populate(conn, args, rng, centroids, vocabulary):
+    """Inserts args.populate documents and messages in chunks, committing after each chunk."""
+    started = time.perf_counter()
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT COALESCE(MAX(id), 0) FROM {DOCUMENTS_TABLE};")
+        first_number = cur.fetchone()[0] + 1
+        execute_values(
+            cur,
+            f"INSERT INTO {CONVERSATIONS_TABLE} (user_id) VALUES %s;",
+            [(f"{BENCH_USER_PREFIX}{user}",) for user in range(args.users)],
+        )
+        cur.execute(f"SELECT id FROM {CONVERSATIONS_TABLE} WHERE user_id LIKE %s;", (f"{BENCH_USER_PREFIX}%",))
+        conversation_ids = np.array([row[0] for row in cur.fetchall()])
+    conn.commit()
+
+    for offset in range(0, args.populate, args.chunk_size):
+        count = min(args.chunk_size, args.populate - offset)
+        topics, embeddings, texts = synthetic_rows(rng, centroids, vocabulary, count, args.noise)
+        documents = []
+        for index in range(count):
+            content = f"{texts[index]} {reference_code(first_number + offset + index)}"
+            documents.append((
+                content, embeddings[index], BENCH_SOURCE,
+                json.dumps({"topic": int(topics[index]), "tier": int(index % 4)}),
+                hashlib.sha256(content.encode("utf-8")).hexdigest(),
+            ))
+        topics, embeddings, texts = synthetic_rows(rng, centroids, vocabulary, count, args.noise)
+        messages = [
+            (int(rng.choice(conversation_ids)), "user" if index % 2 == 0 else "assistant", texts[index], "text", embeddings[index])
+            for index in range(count)
+        ]
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                f"INSERT INTO {DOCUMENTS_TABLE} (content, embedding, source, metadata, content_hash) VALUES %s ON CONFLICT (content_hash) DO NOTHING;",
+                documents,
+                template="(%s, %s::vector, %s, %s::jsonb, %s)",
+                page_size=1000,
+            )
+            execute_values(
+                cur,
+                f"INSERT INTO {MESSAGES_TABLE} (conversation_id, role, content, type, embedding) VALUES %s;",
+                messages,
+                template="(%s, %s, %s, %s, %s::vector)",
+                page_size=1000,
+            )
+        conn.commit()
+        print(f"inserted {offset + count}/{args.populate} documents and messages ({time.perf_counter() - started:.0f} s)", flush=True)
+    with conn.cursor() as cur:
+        cur.execute(f"ANALYZE {DOCUMENTS_TABLE}; ANALYZE {MESSAGES_TABLE}; ANALYZE {CONVERSATIONS_TABLE};")
+    conn.commit()
+
+def clean(conn):
+    with conn.cursor() as cur:
+        cur.execute(
+            f"DELETE FROM {MESSAGES_TABLE} WHERE conversation_id IN (SELECT id FROM {CONVERSATIONS_TABLE} WHERE user_id LIKE %s);",
+            (f"{BENCH_USER_PREFIX}%",)
+        )
+        cur.execute(f"DELETE FROM {CONVERSATIONS_TABLE} WHERE user_id LIKE %s;", (f"{BENCH_USER_PREFIX}%",))
+        cur.execute(f"DELETE FROM {DOCUMENTS_TABLE} WHERE source = %s;", (BENCH_SOURCE,))
+    conn.commit()
+
+def sample_targets(conn, rng, count: int, noise: float):
+    """Picks count benchmark documents and builds a (document_id, metadata, query_text, query_embedding) for each."""
+    with conn.cursor() as cur:
+        cur.execute(
+            f"SELECT id, content, metadata, embedding FROM {DOCUMENTS_TABLE} WHERE source = %s ORDER BY random() LIMIT %s;",
+            (BENCH_SOURCE, count)
+        )
+        rows = cur.fetchall()
+    conn.rollback()
+    targets = []
+    for document_id, content, metadata, embedding in rows:
+        words = content.split()
+        query_text = " ".join(rng.choice(words[:6], size=3, replace=False))
+        query_embedding = unit_rows(np.asarray(embedding, dtype=np.float32)[None, :] + rng.normal(0, noise / np.sqrt(len(embedding)), size=(1, len(embedding))))[0]
+        targets.append((document_id, metadata, query_text, query_embedding))
+    return targets
+
+def vector_arm(conn, settings: str, query_embedding, top_k: int):
+    with conn.cursor() as cur:
+        cur.execute(
+            f"{settings} SELECT id FROM {DOCUMENTS_TABLE} d WHERE d.embedding IS NOT NULL "
+            f"ORDER BY {vector_column_sql('d.embedding')} {VECTOR_DISTANCE_OPERATOR} {VECTOR_PARAM_SQL} LIMIT %s;",
+            (query_embedding, top_k)
+        )
+        ids = [row[0] for row in cur.fetchall()]
+    conn.rollback()
+    return ids
+
+def text_arm(conn, query_text: str, top_k: int):
+    with conn.cursor() as cur:
+        cur.execute(
+            f"SELECT d.id FROM {DOCUMENTS_TABLE} d, websearch_to_tsquery('{RETRIEVAL_TEXT_SEARCH_CONFIG}'::regconfig, %s) query "
+            f"WHERE d.content_tsv @@ query ORDER BY ts_rank_cd(d.content_tsv, query) DESC LIMIT %s;",
+            (query_text, top_k)
+        )
+        ids = [row[0] for row in cur.fetchall()]
+    conn.rollback()
+    return ids
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--populate", type=int, default=0, help="Documents (and as many messages) to insert before measuring")
+    parser.add_argument("--users", type=int, default=1000, help="Users the populated messages are spread over")
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--words-per-topic", type=int, default=40)
+    parser.add_argument("--noise", type=float, default=0.8, help="Norm of the noise around topic centroids, relative to theirs")
+    parser.add_argument("--query-noise", type=float, default=2.0, help="Norm of the noise around target documents, relative to theirs")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--filter", action="store_true", help="Also measure hybrid_search filtered to the target's metadata topic")
+    parser.add_argument("--timeout-ms", type=int, default=1000, help="Statement timeout for the measured searches")
+    parser.add_argument("--clean", action="store_true", help="Delete the benchmark rows and exit")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+
+    rng = np.random.default_rng(args.seed)
+    with get_db_connection() as conn:
+        if not conn:
+            raise SystemExit("Error connecting to database.")
+        if args.clean:
+            clean(conn)
+            print("Removed benchmark rows.")
+            return
+        migrate(conn)
+        if args.populate:
+            centroids = unit_rows(rng.normal(0, 1, size=(args.topics, AWS_RDS_PG_VECTOR_DIMENSION)))
+            populate(conn, args, rng, centroids, topic_vocabulary(rng, args.topics, args.words_per_topic))
+
+        targets = sample_targets(conn, rng, args.queries, args.query_noise)
+        if not targets:
+            raise SystemExit("No benchmark documents; run with --populate first.")
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT user_id FROM {CONVERSATIONS_TABLE} WHERE user_id LIKE %s;", (f"{BENCH_USER_PREFIX}%",))
+            users = [row[0] for row in cur.fetchall()] or [f"{BENCH_USER_PREFIX}0"]
+        conn.rollback()
+
+        ann_settings = vector_search_settings_sql()
+        recalls, hits = [], {"vector": 0, "text": 0, "hybrid": 0}
+        latencies, filtered_latencies, filtered_hits = [], [], 0
+        for document_id, metadata, query_text, query_embedding in targets:
+            exact = vector_arm(conn, EXACT_SETTINGS, query_embedding, args.top_k)
+            approximate = vector_arm(conn, ann_settings, query_embedding, args.top_k)
+            recalls.append(len(set(exact) & set(approximate)) / max(1, len(exact)))
+            hits["vector"] += document_id in approximate
+            hits["text"] += document_id in text_arm(conn, query_text, args.top_k)
+
+            user_id = users[int(rng.integers(len(users)))]
+            started = time.perf_counter()
+            results = retrieval.hybrid_search(conn, user_id, query_text, query_embedding, top_n=args.top_k, timeout_ms=args.timeout_ms)
+            latencies.append(time.perf_counter() - started)
+            conn.rollback()
+            hits["hybrid"] += any(result["source"] == "document" and result["id"] == document_id for result in results)
+
+            if args.filter:
+                started = time.perf_counter()
+                results = retrieval.hybrid_search(
+                    conn, user_id, query_text, query_embedding, top_n=args.top_k,
+                    metadata_filter={"topic": metadata["topic"]}, timeout_ms=args.timeout_ms,
+                )
+                filtered_latencies.append(time.perf_counter() - started)
+                conn.rollback()
+                filtered_hits += any(result["source"] == "document" and result["id"] == document_id for result in results)
+
+        def latency_line(name, values):
+            return (
+                f"{name:<16} p50={percentile(values, 50) * 1000:7.2f} ms  p95={percentile(values, 95) * 1000:7.2f} ms  "
+                f"p99={percentile(values, 99) * 1000:7.2f} ms"
+            )
+
+        print(f"queries={len(targets)}  top_k={args.top_k}")
+        print(f"ANN document recall@{args.top_k}={statistics.mean(recalls):.3f}")
+        print("  ".join(f"hit@{args.top_k}[{arm}]={count / len(targets):.3f}" for arm, count in hits.items()))
+        print(latency_line("hybrid_search", latencies))
+        if args.filter:
+            print(latency_line("hybrid_filtered", filtered_latencies) + f"  hit@{args.top_k}={filtered_hits / len(targets):.3f}")
+        print(f"timeouts={int(retrieval.get_retrieval_metrics()['timeouts'])}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Measures recall@k and latency of the ANN message search against exact search.
+
+Query vectors are sampled from stored message embeddings. Exact results come from the same
+query with index scans disabled. Usage:
+
+    python scripts/vector_recall_benchmark.py --queries 200 --top-k 10 --ef-search 20,40,80,160
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from db_handler import MESSAGES_TABLE, VECTOR_DISTANCE_OPERATOR, VECTOR_PARAM_SQL, vector_column_sql
+from utils import get_db_connection, pgvector_supports_iterative_scan
+from config import HNSW_ITERATIVE_SCAN
+
+EXACT_SETTINGS = "SET LOCAL enable_indexscan = off; SET LOCAL enable_bitmapscan = off;"
+
+def search(conn, settings: str, embedding: str, conversation_id, top_k: int):
+    """Runs one search in its own transaction and returns (ids, seconds)."""
+    where = "embedding IS NOT NULL" + (" AND conversation_id = %s" if conversation_id is not None else "")
+    params = ((conversation_id,) if conversation_id is not None else ()) + (embedding, top_k)
+    started = time.perf_counter()
+    with conn.cursor() as cur:
+        cur.execute(
+            f"{settings} SELECT id FROM {MESSAGES_TABLE} WHERE {where} "
+            f"ORDER BY {vector_column_sql()} {VECTOR_DISTANCE_OPERATOR} {VECTOR_PARAM_SQL} LIMIT %s;",
+            params
+        )
+        ids = [row[0] for row in cur.fetchall()]
+    elapsed = time.perf_counter() - started
+    conn.rollback()
+    return ids, elapsed
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--ef-search", default="20,40,80,160", help="Comma-separated hnsw.ef_search values to sweep.")
+    parser.add_argument("--scope", choices=["conversation", "global"], default="conversation",
+                        help="Filter by the sampled message's conversation (production path) or search all messages.")
+    args = parser.parse_args()
+
+    with get_db_connection() as conn:
+        if not conn:
+            raise SystemExit("Error connecting to database.")
+        with conn.cursor() as cur:
+            cur.execute(
+                f"SELECT conversation_id, embedding::text FROM {MESSAGES_TABLE} "
+                f"WHERE embedding IS NOT NULL ORDER BY random() LIMIT %s;",
+                (args.queries,)
+            )
+            samples = cur.fetchall()
+        conn.rollback()
+        if not samples:
+            raise SystemExit("No embedded messages to sample queries from.")
+
+        exact = []
+        exact_latencies = []
+        for conversation_id, embedding in samples:
+            scope_id = conversation_id if args.scope == "conversation" else None
+            ids, elapsed = search(conn, EXACT_SETTINGS, embedding, scope_id, args.top_k)
+            exact.append(ids)
+            exact_latencies.append(elapsed)
+        print(f"exact        p50={percentile(exact_latencies, 50) * 1000:7.2f} ms  p95={percentile(exact_latencies, 95) * 1000:7.2f} ms")
+
+        for ef_search in [int(value) for value in args.ef_search.split(",")]:
+            settings = f"SET LOCAL hnsw.ef_search = {ef_search};"
+            if HNSW_ITERATIVE_SCAN != "off" and pgvector_supports_iterative_scan():
+                settings += f" SET LOCAL hnsw.iterative_scan = {HNSW_ITERATIVE_SCAN};"
+            recalls, latencies = [], []
+            for (conversation_id, embedding), expected in zip(samples, exact):
+                scope_id = conversation_id if args.scope == "conversation" else None
+                ids, elapsed = search(conn, settings, embedding, scope_id, args.top_k)
+                latencies.append(elapsed)
+                if expected:
+                    recalls.append(len(set(ids) & set(expected)) / len(expected))
+            print(
+                f"ef_search={ef_search:<4} recall@{args.top_k}={statistics.mean(recalls):.3f}  "
+                f"p50={percentile(latencies, 50) * 1000:7.2f} ms  p95={percentile(latencies, 95) * 1000:7.2f} ms"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import gzip
+import json
+import os
+import logging
+from typing import List, Optional
+
+import numpy as np
+import psycopg2
+from botocore.exceptions import BotoCoreError, ClientError
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from db_handler import CONVERSATIONS_TABLE, MESSAGES_TABLE
+from tracing import traced, set_attributes
+from utils import get_aws_session, get_db_connection
+from config import (
+    AWS_CURRENT_REGION,
+    ARCHIVE_AFTER_DAYS,
+    ARCHIVE_LOCATION,
+    ARCHIVE_S3_ENDPOINT_URL,
+    ARCHIVE_BATCH_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+class LocalArchiveStore:
+    """Stores archives as files under a local directory."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def put(self, key: str, data: bytes):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written to a temporary name first so a crash never leaves a truncated archive behind.
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+
+    def get(self, key: str) -> bytes:
+        with open(os.path.join(self.root, key), "rb") as f:
+            return f.read()
+
+class S3ArchiveStore:
+    """Stores archives as objects in an S3 bucket or an S3-compatible store (endpoint_url)."""
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = get_aws_session(region_name=AWS_CURRENT_REGION).client("s3", endpoint_url=endpoint_url)
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put(self, key: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data, ContentEncoding="gzip")
+
+    def get(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))["Body"].read()
+
+_archive_store = None
+
+def get_archive_store():
+    """Returns the store for ARCHIVE_LOCATION: s3://bucket/prefix, or a local directory."""
+    global _archive_store
+    if _archive_store is None:
+        if ARCHIVE_LOCATION.startswith("s3://"):
+            bucket, _, prefix = ARCHIVE_LOCATION[len("s3://"):].partition("/")
+            _archive_store = S3ArchiveStore(bucket, prefix, ARCHIVE_S3_ENDPOINT_URL)
+        else:
+            _archive_store = LocalArchiveStore(ARCHIVE_LOCATION)
+    return _archive_store
+
+def archive_key(conversation_id: int) -> str:
+    return f"conversations/{conversation_id}.jsonl.gz"
+
+def find_cold_conversations(conn: psycopg2.extensions.connection, older_than_days: int, limit: int) -> List[int]:
+    """Returns up to limit unarchived conversations that have messages but none newer than older_than_days."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(f"""
+                    SELECT c.id FROM {CONVERSATIONS_TABLE} c
+                    WHERE c.archived_at IS NULL
+                      AND c.created_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+                      AND EXISTS (SELECT 1 FROM {MESSAGES_TABLE} m WHERE m.conversation_id = c.id)
+                      AND NOT EXISTS (
+                          SELECT 1 FROM {MESSAGES_TABLE} m
+                          WHERE m.conversation_id = c.id AND m.timestamp >= CURRENT_TIMESTAMP - make_interval(days => %s)
+                      )
+                    ORDER BY c.id
+                    LIMIT %s;
+                """),
+                (older_than_days, older_than_days, limit)
+            )
+            return [row[0] for row in cur.fetchall()]
+    except psycopg2.Error as e:
+        conn.rollback()
+        logger.error(f"Error finding cold conversations: {e}")
+        return []
+
+@traced("archive.archive_conversation")
+def archive_conversation(conn: psycopg2.extensions.connection, conversation_id: int, store=None) -> bool:
+    """
+    Writes the messages of a conversation to the archive store as gzip JSONL, then deletes them
+    from the messages table and marks the conversation archived. The conversation row is locked
+    throughout, which blocks concurrent message inserts (their foreign key check needs it), so no
+    message can be written between the export and the delete. Summaries stay in the database.
+    """
+    store = store or get_archive_store()
+    key = archive_key(conversation_id)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(f"SELECT archived_at FROM {CONVERSATIONS_TABLE} WHERE id = %s FOR UPDATE;"),
+                (conversation_id,)
+            )
+            row = cur.fetchone()
+            if row is None or row[0] is not None:
+                conn.rollback()
+                return False
+            cur.execute(
+                sql.SQL(f"SELECT id, role, content, type, embedding::text, timestamp FROM {MESSAGES_TABLE} WHERE conversation_id = %s ORDER BY id;"),
+                (conversation_id,)
+            )
+            lines = [
+                json.dumps({
+                    "id": message_id, "role": role, "content": content, "type": message_type,
+                    "embedding": json.loads(embedding) if embedding else None, "timestamp": timestamp.isoformat(),
+                })
+                for message_id, role, content, message_type, embedding, timestamp in cur.fetchall()
+            ]
+            store.put(key, gzip.compress(("\n".join(lines) + "\n").encode("utf-8")))
+            cur.execute(sql.SQL(f"DELETE FROM {MESSAGES_TABLE} WHERE conversation_id = %s;"), (conversation_id,))
+            cur.execute(
+                sql.SQL(f"UPDATE {CONVERSATIONS_TABLE} SET archived_at = CURRENT_TIMESTAMP, archive_key = %s WHERE id = %s;"),
+                (key, conversation_id)
+            )
+        conn.commit()
+        set_attributes(rows=len(lines))
+        logger.info(f"Archived {len(lines)} messages of conversation {conversation_id} to {key}.")
+        return True
+    except (psycopg2.Error, OSError, BotoCoreError, ClientError) as e:
+        conn.rollback()
+        logger.error(f"Error archiving conversation {conversation_id}: {e}")
+        return False
+
+@traced("archive.rehydrate_conversation")
+def rehydrate_conversation(conn: psycopg2.extensions.connection, conversation_id: int, store=None) -> bool:
+    """
+    Restores an archived conversation's messages, with their original IDs and timestamps, and
+    clears its archived mark. Returns True if the conversation is (now) in the messages table.
+    """
+    store = store or get_archive_store()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(f"SELECT archive_key FROM {CONVERSATIONS_TABLE} WHERE id = %s AND archived_at IS NOT NULL FOR UPDATE;"),
+                (conversation_id,)
+            )
+            row = cur.fetchone()
+            if row is None:
+                conn.rollback()
+                return True
+            messages = [json.loads(line) for line in gzip.decompress(store.get(row[0])).decode("utf-8").splitlines() if line]
+            rows = [
+                (
+                    message["id"], conversation_id, message["role"], message["content"], message["type"],
+                    np.asarray(message["embedding"], dtype=np.float32) if message["embedding"] is not None else None,
+                    message["timestamp"],
+                )
+                for message in messages
+            ]
+            execute_values(
+                cur,
+                f"INSERT INTO {MESSAGES_TABLE} (id, conversation_id, role, content, type, embedding, timestamp) VALUES %s ON CONFLICT DO NOTHING;",
+                rows,
+                template="(%s, %s, %s, %s, %s, %s::vector, %s)",
+            )
+            cur.execute(
+                sql.SQL(f"UPDATE {CONVERSATIONS_TABLE} SET archived_at = NULL, archive_key = NULL WHERE id = %s;"),
+                (conversation_id,)
+            )
+        conn.commit()
+        set_attributes(rows=len(rows))
+        logger.info(f"Rehydrated {len(rows)} messages of conversation {conversation_id}.")
+        return True
+    except (psycopg2.Error, OSError, ValueError, BotoCoreError, ClientError) as e:
+        conn.rollback()
+        logger.error(f"Error rehydrating conversation {conversation_id}: {e}")
+        return False
+
+def run_retention(conn: psycopg2.extensions.connection, older_than_days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE, store=None) -> int:
+    """Archives cold conversations batch by batch until none are left. Returns how many were archived."""
+    store = store or get_archive_store()
+    archived = 0
+    while True:
+        batch = find_cold_conversations(conn, older_than_days, batch_size)
+        succeeded = sum(archive_conversation(conn, conversation_id, store) for conversation_id in batch)
+        archived += succeeded
+        if len(batch) < batch_size or not succeeded:
+            return archived
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Archive cold conversations or rehydrate an archived one.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    archive_parser = subcommands.add_parser("archive", help="Archive conversations inactive for --older-than-days")
+    archive_parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    archive_parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    rehydrate_parser = subcommands.add_parser("rehydrate", help="Restore an archived conversation")
+    rehydrate_parser.add_argument("conversation_id", type=int)
+    args = parser.parse_args()
+
+    with get_db_connection() as conn:
+        if not conn:
+            raise SystemExit("Error connecting to database.")
+        if args.command == "archive":
+            print(f"Archived {run_retention(conn, args.older_than_days, args.batch_size)} conversation(s).")
+        elif not rehydrate_conversation(conn, args.conversation_id):
+            raise SystemExit(f"Could not rehydrate conversation {args.conversation_id}.")
+        else:
+            print(f"Conversation {args.conversation_id} is available.")
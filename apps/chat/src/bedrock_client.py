@@ -0,0 +1,216 @@
+import threading
+import time
+import logging
+from typing import Dict, Optional
+
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from tracing import set_attributes
+from config import (
+    BEDROCK_MAX_POOL_CONNECTIONS,
+    BEDROCK_CONNECT_TIMEOUT_SECONDS,
+    BEDROCK_READ_TIMEOUT_SECONDS,
+    BEDROCK_MAX_ATTEMPTS,
+    BEDROCK_MODEL_RATE_LIMITS,
+    BEDROCK_DEFAULT_RATE_LIMIT,
+    BEDROCK_LIMITER_MAX_WAIT_SECONDS,
+    BEDROCK_CIRCUIT_FAILURE_THRESHOLD,
+    BEDROCK_CIRCUIT_RESET_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+THROTTLING_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException", "ModelNotReadyException"}
+# Errors that count against the circuit breaker; client errors such as validation failures do not.
+UNAVAILABLE_ERROR_CODES = THROTTLING_ERROR_CODES | {"InternalServerException", "ModelTimeoutException"}
+
+def build_bedrock_config() -> Config:
+    """
+    Connection and retry settings for bedrock-runtime clients: a pool sized for the number of
+    concurrent turns, TCP keep-alive, and botocore's adaptive retry mode, which backs off with
+    jitter and rate-limits the client itself once throttling is observed.
+    """
+    return Config(
+        max_pool_connections=BEDROCK_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        connect_timeout=BEDROCK_CONNECT_TIMEOUT_SECONDS,
+        read_timeout=BEDROCK_READ_TIMEOUT_SECONDS,
+        retries={"mode": "adaptive", "total_max_attempts": BEDROCK_MAX_ATTEMPTS},
+    )
+
+def parse_rate_limits(spec: str) -> Dict[str, float]:
+    """Parses 'model-id=requests_per_second,...' into a dict, skipping malformed entries."""
+    limits = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        model_id, _, rate = entry.rpartition("=")
+        try:
+            limits[model_id.strip()] = float(rate)
+        except ValueError:
+            logger.warning(f"Ignoring malformed Bedrock rate limit '{entry}'.")
+    return limits
+
+class TokenBucket:
+    """Allows rate requests per second on average with bursts of up to capacity requests."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait: float) -> Optional[float]:
+        """Takes a token, waiting up to max_wait seconds. Returns the seconds waited, or None on timeout."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            wait = max(0.0, (1.0 - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            # The token is reserved now, so concurrent callers queue up behind this one.
+            self._tokens -= 1.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive throttling or availability errors and rejects calls
+    for reset_seconds. Then a single probe call is let through: success closes the circuit,
+    failure opens it again, and a probe that is not sent is released for the next caller.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.reset_seconds:
+                return False
+            self._probing = True
+            return True
+
+    def release(self):
+        """Gives back a probe slot taken by allow() when the call is not sent after all."""
+        with self._lock:
+            self._probing = False
+
+    def on_success(self):
+        with self._lock:
+            self._failures, self._opened_at, self._probing = 0, None, False
+
+    def on_failure(self) -> bool:
+        """Records a failure and returns True if it opened the circuit."""
+        with self._lock:
+            self._failures += 1
+            reopen = self._probing
+            self._probing = False
+            if reopen or (self._opened_at is None and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+# Limiters, breakers and metrics are per model ID and shared by every client in the process,
+# so the chat path and ingestion draw from the same quota.
+_model_state_lock = threading.Lock()
+_buckets: Dict[str, Optional[TokenBucket]] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+_metrics: Dict[str, Dict[str, float]] = {}
+_rate_limits = parse_rate_limits(BEDROCK_MODEL_RATE_LIMITS)
+
+def _model_state(model_id: str):
+    with _model_state_lock:
+        if model_id not in _breakers:
+            rate = _rate_limits.get(model_id, BEDROCK_DEFAULT_RATE_LIMIT)
+            _buckets[model_id] = TokenBucket(rate) if rate > 0 else None
+            _breakers[model_id] = CircuitBreaker(BEDROCK_CIRCUIT_FAILURE_THRESHOLD, BEDROCK_CIRCUIT_RESET_SECONDS)
+            _metrics[model_id] = {
+                "calls": 0, "errors": 0, "throttles": 0, "retries": 0,
+                "rate_limited": 0, "circuit_rejections": 0, "circuit_opened": 0, "limiter_wait_ms_total": 0.0,
+            }
+        return _buckets[model_id], _breakers[model_id], _metrics[model_id]
+
+def _record(metrics: Dict[str, float], **increments):
+    with _model_state_lock:
+        for key, value in increments.items():
+            metrics[key] += value
+
+def get_bedrock_metrics() -> Dict[str, Dict[str, float]]:
+    """Returns a snapshot of the per-model call, throttle, retry, limiter and circuit counters."""
+    with _model_state_lock:
+        return {model_id: dict(metrics) for model_id, metrics in _metrics.items()}
+
+def _rejection(code: str, message: str, operation: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+class ManagedBedrockClient:
+    """
+    Wraps a bedrock-runtime client so model invocations go through the per-model token bucket
+    and circuit breaker and are counted. Calls that would wait longer than
+    BEDROCK_LIMITER_MAX_WAIT_SECONDS for a token, or that hit an open circuit, fail fast with a
+    ThrottlingException / ServiceUnavailableException ClientError instead of queueing retries.
+    Every other attribute is delegated to the wrapped client.
+    """
+
+    _MANAGED_OPERATIONS = ("invoke_model", "invoke_model_with_response_stream", "converse", "converse_stream")
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name in self._MANAGED_OPERATIONS:
+            return lambda **kwargs: self._call(name, attribute, kwargs)
+        return attribute
+
+    def _call(self, operation: str, method, kwargs):
+        model_id = kwargs.get("modelId", "unknown")
+        bucket, breaker, metrics = _model_state(model_id)
+
+        if not breaker.allow():
+            _record(metrics, circuit_rejections=1)
+            raise _rejection("ServiceUnavailableException", f"Circuit open for {model_id}", operation)
+        if bucket is not None:
+            waited = bucket.acquire(BEDROCK_LIMITER_MAX_WAIT_SECONDS)
+            if waited is None:
+                # allow() may have admitted this call as the half-open probe; let a later call probe.
+                breaker.release()
+                _record(metrics, rate_limited=1)
+                raise _rejection("ThrottlingException", f"Client-side rate limit for {model_id}", operation)
+            if waited:
+                _record(metrics, limiter_wait_ms_total=waited * 1000)
+                set_attributes(limiter_wait_ms=round(waited * 1000, 1))
+
+        try:
+            response = method(**kwargs)
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            retries = e.response.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+            _record(metrics, calls=1, errors=1, retries=retries, throttles=int(code in THROTTLING_ERROR_CODES))
+            if code in UNAVAILABLE_ERROR_CODES:
+                if breaker.on_failure():
+                    _record(metrics, circuit_opened=1)
+                    logger.warning(f"Opened Bedrock circuit for {model_id} after {code}.")
+            else:
+                breaker.on_success()
+            raise
+        except Exception:
+            _record(metrics, calls=1, errors=1)
+            breaker.on_failure()
+            raise
+
+        retries = response.get("ResponseMetadata", {}).get("RetryAttempts", 0) if isinstance(response, dict) else 0
+        _record(metrics, calls=1, retries=retries)
+        if retries:
+            set_attributes(retries=retries)
+        breaker.on_success()
+        return response
@@ -1,133 +1,368 @@
-import os
-import boto3
+import asyncio
+import functools
+import json
 import logging
-from langchain_aws import ChatBedrock
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.chat_history import BaseChatMessageHistory
-from langchain.memory import ConversationBufferMemory
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.messages import get_buffer_string, BaseMessage
-from langgraph.graph import StateGraph, END
-from typing import Dict, TypedDict, Annotated, List, Optional
-from langgraph.graph.message import add_messages
-from langgraph.checkpoint.memory import MemorySaver
-
-from db_handler import create_conversation, save_message, get_conversation_history, get_relevant_messages
-from utils import get_bedrock_client, get_db_connection
-from config import AWS_BEDROCK_LLM_ID
-
-logger = logging.getLogger(__name__)
-
-bedrock_client = get_bedrock_client()
-if not bedrock_client:
-    raise Exception("Failed to initialize Bedrock client. Check logs for details.")
-
-llm = ChatBedrock(
-    client=bedrock_client,
-    model_id=AWS_BEDROCK_LLM_ID,
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import TypedDict, List, Optional
+
+import tracing
+from utils import lazy_import, get_aws_session, get_bedrock_client, get_db_connection, get_async_db_connection, get_pool_metrics, run_blocking, run_in_background, trim_to_token_budget
+from config import (
+    AWS_CURRENT_REGION,
+    AWS_BEDROCK_LLM_ID,
+    AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION,
+    WRITE_BEHIND_ENABLED,
+    EMBEDDING_BACKFILL_BATCH_SIZE,
+    EMBEDDING_BACKFILL_MAX_BATCHES,
+    EMBEDDING_BACKFILL_MAX_ATTEMPTS,
+    HISTORY_MAX_MESSAGES,
+    HISTORY_MAX_TOKENS,
+    CONVERSATION_SUMMARY_ENABLED,
+    SUMMARY_TRIGGER_MESSAGES,
+    SUMMARY_MAX_BATCH_MESSAGES,
+    SUMMARY_MAX_WORDS,
+    STREAM_FLUSH_INTERVAL_MS,
+    CHAT_EAGER_INIT,
+    SEMANTIC_CACHE_ENABLED,
+    DB_POOL_MAX_SIZE,
+    BATCH_MAX_CONCURRENCY,
+    RETRIEVAL_MODE,
 )
 
-# Define the prompt template with memory placeholder
-prompt_template_with_memory = ChatPromptTemplate.from_messages(
-    [
-        ("system", "You are a helpful chatbot. Answer the user's question based on the current input and the following relevant parts of the conversation history: {relevant_history}"),
-        MessagesPlaceholder(variable_name="history"),
-        ("human", "{input}"),
-    ]
-)
+# psycopg2, numpy and boto3 load on first attribute access, not at cold-start import.
+db_handler = lazy_import("db_handler")
+embedding_vector_handler = lazy_import("embedding_vector_handler")
+semantic_cache = lazy_import("semantic_cache")
+conversation_resolver = lazy_import("conversation_resolver")
+bedrock_client = lazy_import("bedrock_client")
+retrieval = lazy_import("retrieval")
 
-prompt_template_without_memory = ChatPromptTemplate.from_messages(
-    [
-        ("system", "You are a helpful chatbot. Answer the user's question based on the conversation history."),
-        MessagesPlaceholder(variable_name="history"),
-        ("human", "{input}"),
-    ]
-)
+logger = logging.getLogger(__name__)
+
+# Prompt texts; the LangChain templates are built on first use by get_prompt_templates()
+SYSTEM_PROMPT_WITH_MEMORY = "You are a helpful chatbot. Answer the user's question based on the current input and the following relevant parts of the conversation history: {relevant_history}"
+SYSTEM_PROMPT_WITHOUT_MEMORY = "You are a helpful chatbot. Answer the user's question based on the conversation history."
+SYSTEM_PROMPT_WITH_SUMMARY = "You are a helpful chatbot. Answer the user's question based on the current input, the following summary of the earlier conversation: {summary}\n\nand the following relevant parts of the conversation history: {relevant_history}"
+# Incremental summarization: only the new lines are sent, never the full transcript
+SUMMARY_SYSTEM_PROMPT = "You maintain a running summary of a conversation between a user and a chatbot. Extend the current summary with the new lines, keeping facts, names, preferences and open questions. Reply with the new summary only, in at most {max_words} words."
+SUMMARY_HUMAN_PROMPT = "Current summary:\n{summary}\n\nNew lines:\n{new_lines}"
+
+# Clients, prompts and the compiled graph are created lazily, once per process.
+_lazy_init_lock = threading.RLock()
+_bedrock_client = None
+_llm = None
+_prompt_templates = None
+_graph = None
+_async_graph = None
+# Per event loop: asyncio semaphores are bound to the loop they first wait on.
+_async_turn_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+def get_shared_bedrock_client():
+    """Returns the process-wide Bedrock client, creating it on first use."""
+    global _bedrock_client
+    if _bedrock_client is None:
+        with _lazy_init_lock:
+            if _bedrock_client is None:
+                client = get_bedrock_client()
+                if not client:
+                    raise Exception("Failed to initialize Bedrock client. Check logs for details.")
+                _bedrock_client = client
+    return _bedrock_client
+
+def get_llm():
+    """Returns the ChatBedrock model, importing langchain_aws on first use."""
+    global _llm
+    if _llm is None:
+        with _lazy_init_lock:
+            if _llm is None:
+                from langchain_aws import ChatBedrock
+                _llm = ChatBedrock(
+                    client=get_shared_bedrock_client(),
+                    model_id=AWS_BEDROCK_LLM_ID,
+                )
+    return _llm
+
+def get_prompt_templates():
+    """Returns the chat and summary prompt templates, building them on first use."""
+    global _prompt_templates
+    if _prompt_templates is None:
+        with _lazy_init_lock:
+            if _prompt_templates is None:
+                from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+                def chat_template(system_prompt: str):
+                    return ChatPromptTemplate.from_messages(
+                        [
+                            ("system", system_prompt),
+                            MessagesPlaceholder(variable_name="history"),
+                            ("human", "{input}"),
+                        ]
+                    )
+
+                _prompt_templates = {
+                    "with_memory": chat_template(SYSTEM_PROMPT_WITH_MEMORY),
+                    "without_memory": chat_template(SYSTEM_PROMPT_WITHOUT_MEMORY),
+                    "with_summary": chat_template(SYSTEM_PROMPT_WITH_SUMMARY),
+                    "summary": ChatPromptTemplate.from_messages(
+                        [
+                            ("system", SUMMARY_SYSTEM_PROMPT),
+                            ("human", SUMMARY_HUMAN_PROMPT),
+                        ]
+                    ),
+                }
+    return _prompt_templates
 
 # --- Define the LangGraph state as a TypedDict ---
 class ChatState(TypedDict):
     user_id: str
+    tenant_id: str
     user_input: str
     conversation_id: Optional[int]
-    history: List[BaseMessage]
+    new_conversation: bool
+    document_filter: Optional[dict]  # metadata that retrieved documents must contain
+    history: List[object]  # langchain_core BaseMessage
     response: str
     relevant_history: Optional[str]
+    summary: Optional[str]
+    query_embedding: Optional[object]  # float32 NumPy array
+    cache_hit: bool
+    error: Optional[dict]  # set by a failing node; the graph ends and the handlers return it
     db_connection: Optional[object]
 
 # --- Define the nodes in the graph ---
-def assign_user_id(user_id: str):
+def _state_user_id(state: ChatState) -> str:
+    user_id = state.get("user_id")
+    return user_id if isinstance(user_id, str) else user_id.get("user_id")
+
+def assign_user_id(state: ChatState):
     """Assigns the user ID to the state."""
-    logger.debug(f"assign_user_id user_id: {user_id}")
-    return {"user_id": user_id}
+    return {"user_id": _state_user_id(state)}
 
 def should_create_new_conversation(state: ChatState):
-    """Determines if a new conversation should be created."""
-    create = state.get("conversation_id") is None
-    return {"should_create": create}
+    """
+    Resolves the conversation of the turn: the explicit conversation_id if the user owns it,
+    else the user's active conversation. A new one is created only when requested with
+    new_conversation, when the user has none, or after the inactivity timeout.
+    """
+    conn = state.get("db_connection")
+    if not conn:
+        return {"should_create": state.get("conversation_id") is None}
+    resolved = conversation_resolver.resolve_conversation(
+        conn, _state_user_id(state), state.get("conversation_id"), bool(state.get("new_conversation"))
+    )
+    if resolved["source"] == "forbidden":
+        # The graph ends here; the error dict is returned as the response, like the handlers do.
+        error_message = {"error": f"Conversation {state.get('conversation_id')} not found."}
+        return {"conversation_id": None, "response": error_message, "error": error_message}
+    return {"conversation_id": resolved["conversation_id"], "should_create": resolved["conversation_id"] is None}
 
 def create_new_conversation(state: ChatState):
     """Creates a new conversation in the database."""
-    logger.debug(f"create_new_conversation state: {state}")
     conn = state.get("db_connection")
     if not conn:
         error_message = {"error": "Database connection not available."}
         logger.error(error_message)
-        return {"conversation_id": None, "__error__": error_message}
-    user_id = state.get("user_id")
-    user_id_str = user_id if isinstance(user_id, str) else user_id.get("user_id")
-    conversation_id = create_conversation(conn, user_id_str)
+        return {"conversation_id": None, "response": error_message, "error": error_message}
+    user_id_str = _state_user_id(state)
+    conversation_id = db_handler.create_conversation(conn, user_id_str)
+    if conversation_id is not None:
+        conversation_resolver.remember_conversation(user_id_str, conversation_id)
     return {"conversation_id": conversation_id}
 
 def get_history_from_db(state: ChatState):
-    """Retrieves conversation history from the database."""
-    logger.debug(f"get_history_from_db state: {state}")
+    """
+    Retrieves the recent conversation window: the newest HISTORY_MAX_MESSAGES messages,
+    trimmed to HISTORY_MAX_TOKENS. With summaries enabled, messages older than the window that
+    the stored summary does not cover yet are appended to the summary, so no message drops
+    out of the prompt before it has been summarized. Otherwise older turns are only reachable
+    through get_relevant_context.
+    """
     conn = state.get("db_connection")
     conversation_id = state.get("conversation_id")
     if not conn or conversation_id is None:
         logger.warning("Database connection or conversation ID not available for fetching history.")
         return {"history": []}
-    history_db = get_conversation_history(conn, conversation_id)
+    history_db, has_older = _history_window(conn, conversation_id)
+    from langchain_core.messages import BaseMessage
     history = [BaseMessage(role=msg["role"], content=msg["content"], type=msg["type"]) for msg in history_db]
-    return {"history": history}
+    if not CONVERSATION_SUMMARY_ENABLED:
+        return {"history": history}
+    stored_summary = db_handler.get_conversation_summary(conn, conversation_id)
+    summary = stored_summary["summary"] if stored_summary else ""
+    if history_db and has_older:
+        pending = db_handler.get_messages_to_summarize(
+            conn,
+            conversation_id,
+            after_message_id=stored_summary["last_message_id"] if stored_summary else 0,
+            before_message_id=history_db[0]["id"],
+            limit=SUMMARY_MAX_BATCH_MESSAGES,
+        )
+        if pending:
+            pending_lines = "\n".join(f"{msg['role']}: {msg['content']}" for msg in pending)
+            summary = f"{summary or '(none)'}\n\nEarlier messages not yet summarized:\n{pending_lines}"
+    return {"history": history, "summary": summary}
+
+def _history_window(conn, conversation_id: int):
+    """
+    Returns the messages sent to the LLM as history, oldest first, and whether older messages
+    may exist outside that window.
+    """
+    recent = db_handler.get_conversation_history(conn, conversation_id, limit=HISTORY_MAX_MESSAGES)
+    window = trim_to_token_budget(recent, HISTORY_MAX_TOKENS)
+    return window, len(recent) >= HISTORY_MAX_MESSAGES or len(window) < len(recent)
 
 def get_relevant_context(state: ChatState):
-    """Retrieves relevant past messages using similarity search."""
-    logger.debug(f"get_relevant_context state: {state}")
-    conn = state.get("db_connection")
+    """
+    Retrieves relevant past messages using similarity search. With RETRIEVAL_MODE=hybrid it
+    searches all of the user's conversations and the document corpus instead, narrowing
+    documents to the state's document_filter.
+    Runs in parallel with get_history_from_db, so it borrows its own pooled connection:
+    a psycopg2 connection must not be used by two threads at once.
+    """
     conversation_id = state.get("conversation_id")
     user_input = state.get("user_input")
-    if not conn or conversation_id is None or not user_input:
+    if not state.get("db_connection") or conversation_id is None or not user_input:
         logger.warning("Database connection, conversation ID, or user input not available for fetching relevant context.")
         return {"relevant_history": ""}
-    relevant_messages = get_relevant_messages(conn, conversation_id, user_input, bedrock_client)
+    # Embedded once per turn; save_chat_to_db reuses it for the user message.
+    query_embedding = embedding_vector_handler.embed_text(get_shared_bedrock_client(), user_input, dimension=AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION)
+    if query_embedding is None:
+        return {"relevant_history": ""}
+    with get_db_connection() as conn:
+        if not conn:
+            logger.warning("No pooled connection available for fetching relevant context.")
+            return {"relevant_history": "", "query_embedding": query_embedding}
+        if RETRIEVAL_MODE == "hybrid":
+            # Documents come back with role "document".
+            relevant_messages = retrieval.hybrid_search(conn, _state_user_id(state), user_input, query_embedding, metadata_filter=state.get("document_filter"))
+        else:
+            relevant_messages = db_handler.get_relevant_messages(conn, conversation_id, user_input, get_shared_bedrock_client(), query_embedding=query_embedding)
     relevant_history_str = "\n".join([f"{msg['role']}: {msg['content']}" for msg in relevant_messages])
-    return {"relevant_history": relevant_history_str}
-
-def generate_response(state: ChatState):
-    """Generates the chatbot's response, incorporating relevant history."""
-    logger.debug(f"generate_response state: {state}")
-    prompt = (prompt_template_with_memory if state.get("relevant_history") else prompt_template_without_memory).format_messages(
+    return {"relevant_history": relevant_history_str, "query_embedding": query_embedding}
+
+def build_prompt(state: ChatState):
+    """Formats the prompt from the summary, the recent history window and the relevant snippets."""
+    if state.get("summary"):
+        return get_prompt_templates()["with_summary"].format_messages(
+            history=state["history"],
+            input=state["user_input"],
+            summary=state["summary"],
+            relevant_history=state.get("relevant_history") or "",
+        )
+    templates = get_prompt_templates()
+    return (templates["with_memory"] if state.get("relevant_history") else templates["without_memory"]).format_messages(
         history=state["history"],
         input=state["user_input"],
         **( {"relevant_history": state["relevant_history"]} if state.get("relevant_history") else {} )
     )
+
+def _semantic_cache_context(state: ChatState) -> str:
+    history = [message.content for message in state.get("history") or []]
+    scope = None
+    if RETRIEVAL_MODE == "hybrid":
+        # Hybrid retrieval draws on all of the user's conversations and on filtered documents.
+        scope = [_state_user_id(state), json.dumps(state.get("document_filter"), sort_keys=True)]
+    return semantic_cache.context_hash(history, state.get("summary"), state.get("relevant_history"), scope)
+
+def check_semantic_cache(state: ChatState):
+    """Answers from the semantic cache when a similar query was seen with the same prompt context."""
+    conn = state.get("db_connection")
+    query_embedding = state.get("query_embedding")
+    if not SEMANTIC_CACHE_ENABLED or not conn or query_embedding is None:
+        return {"cache_hit": False}
+    entry = semantic_cache.lookup_cached_response(conn, state.get("tenant_id") or "default", _semantic_cache_context(state), query_embedding)
+    if entry is None:
+        return {"cache_hit": False}
+    logger.info(f"Semantic cache hit (similarity {entry['similarity']:.3f}).")
+    run_in_background(_record_semantic_cache_hit, entry["id"])
+    return {"cache_hit": True, "response": entry["response"]}
+
+def _record_semantic_cache_hit(entry_id: int):
+    with get_db_connection() as conn:
+        if conn:
+            semantic_cache.record_cache_hit(conn, entry_id)
+
+def _store_semantic_cache_entry(tenant_id: str, context_key: str, query_text: str, query_embedding, response: str):
+    with get_db_connection() as conn:
+        if conn:
+            semantic_cache.store_cached_response(conn, tenant_id, context_key, query_text, query_embedding, response)
+
+def route_after_cache(state):
+    return "save_to_db" if state.get("cache_hit") else "generate_response"
+
+def route_after_response(state):
+    if state.get("error"):
+        from langgraph.graph import END
+        return END
+    return "save_to_db"
+
+def generate_response(state: ChatState):
+    """Generates the chatbot's response, incorporating the summary and relevant history."""
+    prompt = build_prompt(state)
     try:
-        response = llm.invoke(prompt)
-        return {"response": response.content}
+        with tracing.span("bedrock.llm_invoke", model_id=AWS_BEDROCK_LLM_ID) as llm_span:
+            response = get_llm().invoke(prompt)
+            usage = getattr(response, "usage_metadata", None) or {}
+            llm_span.set(input_tokens=usage.get("input_tokens"), output_tokens=usage.get("output_tokens"))
     except Exception as e:
         error_message = {"error": f"Error generating response: {e}"}
         logger.error(error_message)
-        return {"response": "An error occurred.", "__error__": error_message}
+        # Nothing is saved: the turn fails as a whole and the caller can retry it.
+        return {"response": error_message, "error": error_message}
+    if SEMANTIC_CACHE_ENABLED and state.get("query_embedding") is not None:
+        run_in_background(
+            _store_semantic_cache_entry,
+            state.get("tenant_id") or "default",
+            _semantic_cache_context(state),
+            state["user_input"],
+            state["query_embedding"],
+            response.content,
+        )
+    return {"response": response.content}
 
 def get_user_input(state: ChatState):
     """Gets the user's input."""
     user_input = state.get("user_input")
-    logger.debug(f"get_user_input input: {user_input}")
     return {"user_input": user_input}
 
+def backfill_pending_embeddings():
+    """
+    Drains messages saved without an embedding, a batch at a time. Each batch is claimed and
+    stored on a pooled connection that is given back while the batch is embedded, so the
+    background worker never holds a connection across Bedrock calls.
+    """
+    for _ in range(EMBEDDING_BACKFILL_MAX_BATCHES):
+        with get_db_connection() as conn:
+            if not conn:
+                logger.warning("Database connection not available for embedding backfill.")
+                return
+            pending = db_handler.claim_messages_to_embed(conn, EMBEDDING_BACKFILL_BATCH_SIZE)
+        updates = []
+        for message_id, conversation_id, content, attempts in pending:
+            embedding = embedding_vector_handler.embed_text(get_shared_bedrock_client(), content, dimension=AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION)
+            if embedding is not None:
+                updates.append((message_id, conversation_id, embedding))
+            elif attempts >= EMBEDDING_BACKFILL_MAX_ATTEMPTS:
+                logger.warning(f"Giving up on the embedding of message {message_id} after {attempts} attempts.")
+        if updates:
+            with get_db_connection() as conn:
+                if not conn:
+                    logger.warning("Database connection not available for embedding backfill.")
+                    return
+                db_handler.store_message_embeddings(conn, updates)
+        logger.info(f"Backfilled embeddings for {len(updates)} of {len(pending)} pending messages.")
+        if len(pending) < EMBEDDING_BACKFILL_BATCH_SIZE:
+            break
+
 def save_chat_to_db(state: ChatState):
-    """Saves the user input and chatbot response to the database."""
-    logger.debug(f"save_chat_to_db state: {state}")
+    """
+    Saves the user input and chatbot response to the database.
+    In write-behind mode both messages are inserted in one transaction, the assistant message
+    without an embedding, and the embedding is backfilled on the background worker.
+    """
     conn = state.get("db_connection")
     conversation_id = state.get("conversation_id")
     if not conn or conversation_id is None:
@@ -137,79 +372,503 @@ def save_chat_to_db(state: ChatState):
     user_message = state["user_input"]
     bot_response = state["response"]
 
-    save_message(conn, bedrock_client, conversation_id, "user", user_message)
-    save_message(conn, bedrock_client, conversation_id, "assistant", bot_response)
+    if WRITE_BEHIND_ENABLED:
+        db_handler.save_messages(conn, conversation_id, [
+            ("user", user_message, state.get("query_embedding")),
+            ("assistant", bot_response, None),
+        ])
+        run_in_background(backfill_pending_embeddings)
+    else:
+        db_handler.save_message(conn, get_shared_bedrock_client(), conversation_id, "user", user_message, embedding=state.get("query_embedding"))
+        db_handler.save_message(conn, get_shared_bedrock_client(), conversation_id, "assistant", bot_response)
+    conversation_resolver.touch_conversation(_state_user_id(state), conversation_id)
     return state
 
-# --- Build the LangGraph ---
-builder = StateGraph(ChatState)
-builder.add_node("assign_id", assign_user_id)
-builder.add_node("check_conversation", should_create_new_conversation)
-builder.add_node("create_conversation", create_new_conversation)
-builder.add_node("get_input", get_user_input)
-builder.add_node("get_history", get_history_from_db)
-builder.add_node("get_relevant_context", get_relevant_context)
-builder.add_node("generate_response", generate_response)
-builder.add_node("save_to_db", save_chat_to_db)
-
-builder.set_entry_point("assign_id")
+def refresh_conversation_summary(conversation_id: int):
+    """
+    Folds messages older than the history window actually sent to the LLM (after the
+    HISTORY_MAX_TOKENS trim) into the stored summary, once at least SUMMARY_TRIGGER_MESSAGES
+    of them are pending. Until then get_history_from_db sends them verbatim.
+    The connection is not held during the LLM call.
+    """
+    with get_db_connection() as conn:
+        if not conn:
+            logger.warning("Database connection not available for summarization.")
+            return
+        window, has_older = _history_window(conn, conversation_id)
+        if not window or not has_older:
+            return
+        stored_summary = db_handler.get_conversation_summary(conn, conversation_id)
+        pending = db_handler.get_messages_to_summarize(
+            conn,
+            conversation_id,
+            after_message_id=stored_summary["last_message_id"] if stored_summary else 0,
+            before_message_id=window[0]["id"],
+            limit=SUMMARY_MAX_BATCH_MESSAGES,
+        )
+    if len(pending) < SUMMARY_TRIGGER_MESSAGES:
+        return
+
+    prompt = get_prompt_templates()["summary"].format_messages(
+        summary=stored_summary["summary"] if stored_summary else "(none)",
+        new_lines="\n".join(f"{msg['role']}: {msg['content']}" for msg in pending),
+        max_words=SUMMARY_MAX_WORDS,
+    )
+    try:
+        summary = get_llm().invoke(prompt).content
+    except Exception as e:
+        logger.error(f"Error summarizing conversation {conversation_id}: {e}")
+        return
+
+    with get_db_connection() as conn:
+        if conn:
+            db_handler.upsert_conversation_summary(conn, conversation_id, summary, pending[-1]["id"])
+
+def summarize_conversation(state: ChatState):
+    """Schedules the summary refresh on the background worker, off the request path."""
+    conversation_id = state.get("conversation_id")
+    if CONVERSATION_SUMMARY_ENABLED and conversation_id is not None and not state.get("error"):
+        run_in_background(refresh_conversation_summary, conversation_id)
+    return {}
 
 def route_conversation(state):
-    if "__error__" in state:
+    if state.get("error"):
+        from langgraph.graph import END
         return END  # Terminate the graph if there's an error
     return "create_conversation" if state.get("should_create") else "get_input"
 
-builder.add_edge("assign_id", "check_conversation")
-builder.add_conditional_edges(
-    "check_conversation",
-    route_conversation,
-    {"create_conversation": "create_conversation", "get_input": "get_input", END: END}
-)
-builder.add_edge("create_conversation", "get_input")
-builder.add_edge("get_input", "get_history")
-builder.add_edge("get_history", "get_relevant_context")
-builder.add_edge("get_relevant_context", "generate_response")
-builder.add_edge("generate_response", "save_to_db")
-builder.add_edge("save_to_db", END)
-
-# Compile the graph
-graph = builder.compile()
+# --- Build the LangGraph ---
+def _async_node(fn):
+    """Wraps a sync node so the async graph awaits it on the I/O executor."""
+    @functools.wraps(fn)
+    async def node(state):
+        return await run_blocking(fn, state)
+    return node
+
+def build_graph(async_nodes: bool = False):
+    """
+    Builds and compiles the chat graph. With async_nodes, every node is a coroutine that runs
+    the same node logic on the I/O executor, for use with ainvoke/astream.
+    """
+    from langgraph.graph import StateGraph, END
+
+    builder = StateGraph(ChatState)
+
+    def add_node(name, fn):
+        node = tracing.trace_node(name, fn)
+        builder.add_node(name, _async_node(node) if async_nodes else node)
+
+    add_node("assign_id", assign_user_id)
+    add_node("check_conversation", should_create_new_conversation)
+    add_node("create_conversation", create_new_conversation)
+    add_node("get_input", get_user_input)
+    add_node("get_history", get_history_from_db)
+    add_node("get_relevant_context", get_relevant_context)
+    add_node("check_semantic_cache", check_semantic_cache)
+    add_node("generate_response", generate_response)
+    add_node("save_to_db", save_chat_to_db)
+    add_node("summarize", summarize_conversation)
+
+    builder.set_entry_point("assign_id")
+
+    builder.add_edge("assign_id", "check_conversation")
+    builder.add_conditional_edges(
+        "check_conversation",
+        route_conversation,
+        {"create_conversation": "create_conversation", "get_input": "get_input", END: END}
+    )
+    builder.add_edge("create_conversation", "get_input")
+    # History loading and relevant-context retrieval are independent: fan out from
+    # get_input and join before generate_response. The branches write disjoint state
+    # keys, so the default last-value channels merge them at the join.
+    builder.add_edge("get_input", "get_history")
+    builder.add_edge("get_input", "get_relevant_context")
+    builder.add_edge(["get_history", "get_relevant_context"], "check_semantic_cache")
+    builder.add_conditional_edges(
+        "check_semantic_cache",
+        route_after_cache,
+        {"generate_response": "generate_response", "save_to_db": "save_to_db"}
+    )
+    builder.add_conditional_edges(
+        "generate_response",
+        route_after_response,
+        {"save_to_db": "save_to_db", END: END}
+    )
+    builder.add_edge("save_to_db", "summarize")
+    builder.add_edge("summarize", END)
+
+    return builder.compile()
+
+def _load_lazy_modules():
+    # Every run needs the DB and embedding modules; import them with the graph so the
+    # first turn does not pay for them inside a node.
+    db_handler.MESSAGES_TABLE
+    embedding_vector_handler.embed_text
+    conversation_resolver.resolve_conversation
+    if RETRIEVAL_MODE == "hybrid":
+        retrieval.hybrid_search
+
+def get_graph():
+    """Returns the compiled graph, building it on first use."""
+    global _graph
+    if _graph is None:
+        with _lazy_init_lock:
+            if _graph is None:
+                _graph = build_graph()
+                _load_lazy_modules()
+    return _graph
+
+def get_async_graph():
+    """Returns the compiled graph with async nodes, building it on first use."""
+    global _async_graph
+    if _async_graph is None:
+        with _lazy_init_lock:
+            if _async_graph is None:
+                _async_graph = build_graph(async_nodes=True)
+                _load_lazy_modules()
+    return _async_graph
 
 def lambda_handler(event, context):
     """
     Handles the incoming event and returns the chatbot response with multi-user memory
     saved in the database.
-    For local testing, the 'event' should be a dictionary with 'input' and 'user_id' keys.
+    The database connection is borrowed from a process-level pool, so warm invocations
+    reuse both the connection and the cached RDS secret.
+    For local testing, the 'event' should be a dictionary with 'input' and 'user_id' keys,
+    and optionally 'tenant_id', which scopes the semantic response cache, 'conversation_id'
+    to continue a specific conversation of the user, and 'new_conversation': true to start a
+    new one. Without them the user's active conversation is continued. With RETRIEVAL_MODE=hybrid,
+    'document_filter' (a JSON object) restricts retrieved documents to those whose metadata contains it.
+    The response includes the conversation_id the turn was saved to.
     """
-    user_input = event.get("input")
-    user_id = event.get("user_id", "default_user")
+    try:
+        request = _turn_request(event)
+    except ValueError as e:
+        return {"response": {"error": f"Invalid event: {e}"}}
+
+    with tracing.start_trace("chat_turn", user_id=request["user_id"], input_chars=len(request["user_input"] or "")):
+        return _handle_chat_turn(request)
 
+def _turn_request(event) -> dict:
+    """Extracts the initial graph state of a turn from a handler event. Raises ValueError."""
+    user_input = event.get("input")
+    if user_input is not None and not isinstance(user_input, str):
+        raise ValueError("'input' must be a string")
+    for key, default in (("user_id", "default_user"), ("tenant_id", "default")):
+        if not isinstance(event.get(key, default), str):
+            raise ValueError(f"'{key}' must be a string")
+    conversation_id = event.get("conversation_id")
+    if isinstance(conversation_id, bool) or not isinstance(conversation_id, (int, str, type(None))):
+        raise ValueError("'conversation_id' must be an integer")
+    return {
+        "user_input": user_input,
+        "user_id": event.get("user_id", "default_user"),
+        "tenant_id": event.get("tenant_id", "default"),
+        "conversation_id": int(conversation_id) if conversation_id is not None else None,
+        "new_conversation": bool(event.get("new_conversation", False)),
+        "document_filter": _document_filter(event.get("document_filter")),
+    }
+
+def _document_filter(document_filter) -> Optional[dict]:
+    if document_filter is not None and not isinstance(document_filter, dict):
+        raise ValueError("'document_filter' must be a JSON object")
+    return document_filter or None
+
+def _handle_chat_turn(request: dict):
+    """Runs one chat turn on a pooled connection and shapes the handler response."""
     with get_db_connection() as conn:
+        return _run_chat_turn(conn, request)
+
+def _run_chat_turn(conn, request: dict):
+    """Runs one chat turn on the given connection and shapes the handler response."""
+    if not conn:
+        error_response = {"error": "Failed to connect to the database."}
+        logger.error(error_response)
+        return {"response": error_response}
+
+    initial_state = {**request, "db_connection": conn}
+    try:
+        with tracing.span("graph.invoke"):
+            result = get_graph().invoke(
+                initial_state,
+                {"configurable": {"thread_id": request["user_id"]}}
+            )
+        return _shape_response(result)
+    except Exception as e:
+        error_response = {"error": f"Error during graph invocation: {e}"}
+        logger.error(error_response)
+        return {"response": error_response}
+    finally:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Connection pool metrics: {get_pool_metrics()}")
+            logger.debug(f"Bedrock client metrics: {bedrock_client.get_bedrock_metrics()}")
+
+def _shape_response(result) -> dict:
+    if result.get("error"):
+        return {"response": result["error"]}
+    return {"response": result['response'], "conversation_id": result.get("conversation_id")}
+
+async def async_handler(event, context=None):
+    """
+    Async counterpart of lambda_handler for long-running servers: many turns can be in flight
+    in one process. Runs the same nodes via ainvoke; their blocking psycopg2 and Bedrock calls
+    are offloaded to the I/O executor (ASYNC_IO_MAX_WORKERS threads). Each in-flight turn holds
+    two pooled connections while get_relevant_context runs, so at most _parallel_turn_limit()
+    turns are admitted at once; the others wait for a slot without holding a connection.
+    """
+    try:
+        request = _turn_request(event)
+    except ValueError as e:
+        return {"response": {"error": f"Invalid event: {e}"}}
+
+    with tracing.start_trace("chat_turn", user_id=request["user_id"], input_chars=len(request["user_input"] or "")):
+        return await _ahandle_chat_turn(request)
+
+def _parallel_turn_limit() -> int:
+    """
+    How many turns may run at once in one process. A turn borrows its own connection and then a
+    second one for get_relevant_context, and the background worker (write-behind backfill,
+    summaries) needs one more; admitting more turns would let them all hold one connection
+    while waiting for another until the acquire timeout.
+    """
+    return max(1, (DB_POOL_MAX_SIZE - 1) // 2)
+
+def _get_async_turn_slots() -> asyncio.Semaphore:
+    """Returns the running loop's turn semaphore, sized by _parallel_turn_limit()."""
+    loop = asyncio.get_running_loop()
+    with _lazy_init_lock:
+        slots = _async_turn_slots.get(loop)
+        if slots is None:
+            slots = _async_turn_slots[loop] = asyncio.Semaphore(_parallel_turn_limit())
+        return slots
+
+async def _ahandle_chat_turn(request: dict):
+    async with _get_async_turn_slots(), get_async_db_connection() as conn:
         if not conn:
             error_response = {"error": "Failed to connect to the database."}
             logger.error(error_response)
             return {"response": error_response}
 
-        initial_state = {"user_id": user_id, "user_input": user_input, "db_connection": conn}
+        initial_state = {**request, "db_connection": conn}
         try:
-            result = graph.invoke(
-                initial_state,
-                {"configurable": {"thread_id": user_id}}
-            )
-            if "__error__" in result:
-                return {"response": result["__error__"]}
-            return {"response": result['response']}
+            with tracing.span("graph.ainvoke"):
+                result = await get_async_graph().ainvoke(
+                    initial_state,
+                    {"configurable": {"thread_id": request["user_id"]}}
+                )
+            return _shape_response(result)
         except Exception as e:
             error_response = {"error": f"Error during graph invocation: {e}"}
             logger.error(error_response)
             return {"response": error_response}
 
+def batch_handler(event, context):
+    """
+    Handles many chat turns per invocation: an SQS batch ({"Records": [...]}, each body a
+    lambda_handler event) or {"events": [...]} of lambda_handler events, each with an optional
+    "id". Turns of the same user run in order on one borrowed connection, so writes to a
+    conversation keep their order; different users run in parallel on BATCH_MAX_CONCURRENCY threads,
+    sharing the process-level pool and cached RDS secret.
+    Returns {"batchItemFailures": [{"itemIdentifier": ...}]} for partial batch failure reporting.
+    Once a turn fails, the later turns of its user are reported as failed without being
+    run, so a redelivery replays them in order. Plain event lists also get their "responses".
+    """
+    is_sqs = "Records" in event
+    items = []
+    failures = []
+    for index, record in enumerate(event.get("Records") if is_sqs else event.get("events", [])):
+        item_id = record.get("messageId") if is_sqs else record.get("id", str(index))
+        try:
+            payload = json.loads(record["body"]) if is_sqs else record
+            if not isinstance(payload, dict) or not payload.get("input"):
+                raise ValueError("missing 'input'")
+            request = _turn_request(payload)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error(f"Rejecting malformed batch item {item_id}: {e}")
+            failures.append(item_id)
+            continue
+        items.append((item_id, request))
+
+    groups = {}
+    for item_id, request in items:
+        groups.setdefault(request["user_id"], []).append((item_id, request))
+
+    responses = {}
+    if groups:
+        get_graph()
+        workers = min(BATCH_MAX_CONCURRENCY, _parallel_turn_limit(), len(groups))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as executor:
+            for group_responses in executor.map(_run_conversation_turns, groups.values()):
+                responses.update(group_responses)
+    failures.extend(item_id for item_id, response in responses.items() if isinstance(response.get("response"), dict))
+    logger.info(f"Processed batch of {len(items)} turns of {len(groups)} users, {len(failures)} failed.")
+
+    result = {"batchItemFailures": [{"itemIdentifier": item_id} for item_id in failures]}
+    if not is_sqs:
+        result["responses"] = responses
+    return result
+
+def _run_conversation_turns(turns):
+    """Runs the turns of one user in order on one connection; returns {item_id: response}."""
+    responses = {}
+    failed = False
+    try:
+        with get_db_connection() as conn:
+            for item_id, request in turns:
+                if failed:
+                    responses[item_id] = {"response": {"error": "Skipped after an earlier turn of the user failed."}}
+                    continue
+                with tracing.start_trace("chat_turn", user_id=request["user_id"], input_chars=len(request["user_input"] or ""), batch_item=item_id):
+                    responses[item_id] = _run_chat_turn(conn, request)
+                failed = isinstance(responses[item_id]["response"], dict)
+    except Exception as e:
+        # Only this user's remaining turns fail; the other groups of the batch are unaffected.
+        logger.error(f"Error running the batch turns of user {turns[0][1]['user_id']}: {e}")
+        for item_id, _ in turns:
+            responses.setdefault(item_id, {"response": {"error": f"Error running batch turn: {e}"}})
+    return responses
+
+def _chunk_text(content) -> str:
+    """Extracts the text of a streamed message chunk (a string, or a list of content blocks)."""
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+
+def stream_chat_turn(user_input: str, user_id: str, conversation_id: Optional[int] = None, tenant_id: str = "default", new_conversation: bool = False,
+                     document_filter: Optional[dict] = None):
+    """
+    Runs one chat turn through the graph and yields events as they happen:
+    {"type": "token", "content": ...} for each chunk generated by generate_response, then
+    {"type": "end", ...} with the full response, or {"type": "error", ...}.
+    The full response is persisted by save_to_db once the stream has completed.
+    document_filter narrows the retrieved documents like the lambda_handler event field.
+    """
+    with tracing.start_trace("chat_turn_stream", user_id=user_id, input_chars=len(user_input or "")):
+        yield from _stream_chat_turn(user_input, user_id, conversation_id, tenant_id, new_conversation, document_filter)
+
+def _stream_chat_turn(user_input: str, user_id: str, conversation_id: Optional[int], tenant_id: str, new_conversation: bool, document_filter: Optional[dict]):
+    started_at = time.perf_counter()
+    first_token_at = None
+    try:
+        document_filter = _document_filter(document_filter)
+    except ValueError as e:
+        yield {"type": "error", "error": f"Invalid request: {e}"}
+        return
+    with get_db_connection() as conn:
+        if not conn:
+            error_response = {"error": "Failed to connect to the database."}
+            logger.error(error_response)
+            yield {"type": "error", **error_response}
+            return
+
+        initial_state = {"user_id": user_id, "tenant_id": tenant_id, "user_input": user_input, "conversation_id": conversation_id, "new_conversation": new_conversation,
+                         "document_filter": document_filter, "db_connection": conn}
+        result = {}
+        try:
+            for mode, payload in get_graph().stream(
+                initial_state,
+                {"configurable": {"thread_id": user_id}},
+                stream_mode=["messages", "values"],
+            ):
+                if mode == "values":
+                    result = payload
+                    continue
+                chunk, metadata = payload
+                if metadata.get("langgraph_node") != "generate_response":
+                    continue
+                text = _chunk_text(chunk.content)
+                if not text:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    logger.info(f"Time to first token: {(first_token_at - started_at) * 1000:.0f} ms")
+                yield {"type": "token", "content": text}
+        except Exception as e:
+            error_response = {"error": f"Error during graph streaming: {e}"}
+            logger.error(error_response)
+            yield {"type": "error", **error_response}
+            return
+
+    if isinstance(result.get("response"), dict):
+        yield {"type": "error", **result["response"]}
+        return
+
+    if first_token_at is None and result.get("cache_hit") and result.get("response"):
+        # Semantic cache hits skip generate_response, so the whole answer is one chunk.
+        first_token_at = time.perf_counter()
+        yield {"type": "token", "content": result["response"]}
+
+    tracing.set_attributes(ttft_ms=round((first_token_at - started_at) * 1000) if first_token_at else None)
+    yield {
+        "type": "end",
+        "response": result.get("response"),
+        "conversation_id": result.get("conversation_id"),
+        "ttft_ms": round((first_token_at - started_at) * 1000) if first_token_at else None,
+        "total_ms": round((time.perf_counter() - started_at) * 1000),
+    }
+
+_websocket_management_clients = {}
+
+def _get_websocket_management_client(endpoint_url: str):
+    """Returns a cached API Gateway management client for posting to WebSocket connections."""
+    client = _websocket_management_clients.get(endpoint_url)
+    if client is None:
+        session = get_aws_session(region_name=AWS_CURRENT_REGION)
+        client = session.client(service_name="apigatewaymanagementapi", endpoint_url=endpoint_url)
+        _websocket_management_clients[endpoint_url] = client
+    return client
+
+def websocket_handler(event, context):
+    """
+    Handles API Gateway WebSocket events and streams the chatbot response back to the caller.
+    The message body should be JSON with 'input', 'user_id' and optionally 'conversation_id',
+    'new_conversation' or 'document_filter'.
+    Tokens are coalesced for STREAM_FLUSH_INTERVAL_MS between posts; the first one is sent at once.
+    """
+    request_context = event.get("requestContext", {})
+    if request_context.get("routeKey") in ("$connect", "$disconnect"):
+        return {"statusCode": 200}
+
+    connection_id = request_context.get("connectionId")
+    client = _get_websocket_management_client(f"https://{request_context.get('domainName')}/{request_context.get('stage')}")
+    try:
+        body = json.loads(event.get("body") or "{}")
+    except json.JSONDecodeError:
+        return {"statusCode": 400, "body": "Message body must be JSON."}
+
+    def post(message: dict) -> bool:
+        try:
+            client.post_to_connection(ConnectionId=connection_id, Data=json.dumps(message).encode("utf-8"))
+            return True
+        except client.exceptions.GoneException:
+            logger.warning(f"WebSocket connection {connection_id} is gone; stopping stream.")
+            return False
+
+    buffer, last_flush_at, sent_first = [], time.perf_counter(), False
+    for message in stream_chat_turn(body.get("input"), body.get("user_id", "default_user"), body.get("conversation_id"), body.get("tenant_id", "default"), bool(body.get("new_conversation", False)), body.get("document_filter")):
+        if message["type"] == "token":
+            buffer.append(message["content"])
+            if sent_first and (time.perf_counter() - last_flush_at) * 1000 < STREAM_FLUSH_INTERVAL_MS:
+                continue
+            message = {"type": "token", "content": "".join(buffer)}
+            buffer, last_flush_at, sent_first = [], time.perf_counter(), True
+        elif buffer:
+            if not post({"type": "token", "content": "".join(buffer)}):
+                break
+            buffer = []
+        if not post(message):
+            break
+    return {"statusCode": 200}
+
+if CHAT_EAGER_INIT:
+    # Pay the import and client construction cost during the Lambda init phase instead of the first request.
+    get_graph()
+    get_llm()
+
 if __name__ == "__main__":
     print("Multi-User GenAI Chatbot with Persistent Memory in RDS (Local Testing)")
     print("-----------------------------------------------------------------------")
 
-    conversations = {}
-
     while True:
         user_id = input("Enter User ID: ")
         user_input = input(f"You ({user_id}): ")
@@ -222,23 +881,19 @@ if __name__ == "__main__":
             initial_state = {
                 "user_id": user_id,
                 "user_input": user_input,
-                "conversation_id": conversations.get(user_id),
                 "db_connection": conn
             }
 
             try:
-                result = graph.invoke(
+                result = get_graph().invoke(
                     initial_state,
                     {"configurable": {"thread_id": user_id}}
                 )
-                if "__error__" in result:
-                    print(f"Bot Error: {result['__error__']}")
+                if result.get("error"):
+                    print(f"Bot Error: {result['error']}")
                 else:
                     print(f"Bot: {result['response']}")
 
-                if "conversation_id" in result and result["conversation_id"] is not None and "__error__" not in result:
-                    conversations[user_id] = result["conversation_id"]
-
             except Exception as e:
                 print(f"[ERROR] Error during graph invocation: {e}")
 
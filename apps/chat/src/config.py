@@ -14,5 +14,120 @@ AWS_BEDROCK_LLM_ID = os.getenv("AWS_BEDROCK_LLM_ID")
 AWS_BEDROCK_EMBEDDING_MODEL_ID = os.getenv("AWS_BEDROCK_EMBEDDING_MODEL_ID")
 AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION = int(os.getenv("AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION", "512"))
 
+# Embedding Cache Config (a max size of 0 disables the cache)
+EMBEDDING_CACHE_MAX_SIZE = int(os.getenv("EMBEDDING_CACHE_MAX_SIZE", "1024"))
+EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", "3600"))
+
 # RDS/Vector Config
-AWS_RDS_PG_VECTOR_DIMENSION = int(os.getenv("AWS_RDS_PG_VECTOR_DIMENSION", "512"))
\ No newline at end of file
+AWS_RDS_PG_VECTOR_DIMENSION = int(os.getenv("AWS_RDS_PG_VECTOR_DIMENSION", "512"))
+# Titan embeddings are normalized, so inner product ranks identically to cosine and is the cheapest operator
+VECTOR_DISTANCE_METRIC = os.getenv("VECTOR_DISTANCE_METRIC", "inner_product")  # inner_product | cosine | l2
+VECTOR_INDEX_METHOD = os.getenv("VECTOR_INDEX_METHOD", "hnsw")  # hnsw | ivfflat
+# halfvec indexes embedding::halfvec expressions, halving index memory; the column stays vector
+VECTOR_STORAGE_TYPE = os.getenv("VECTOR_STORAGE_TYPE", "vector")  # vector | halfvec
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))
+# pgvector >= 0.8: keep scanning the index until enough rows pass the conversation filter ("off" to disable;
+# ignored on older pgvector versions)
+HNSW_ITERATIVE_SCAN = os.getenv("HNSW_ITERATIVE_SCAN", "relaxed_order")
+IVFFLAT_LISTS = int(os.getenv("IVFFLAT_LISTS", "100"))
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "10"))
+
+# RDS Connection Pool Config
+AWS_RDS_SECRET_TTL_SECONDS = int(os.getenv("AWS_RDS_SECRET_TTL_SECONDS", "900"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "5"))
+DB_POOL_MAX_CONNECTION_AGE_SECONDS = int(os.getenv("DB_POOL_MAX_CONNECTION_AGE_SECONDS", "1800"))
+DB_POOL_PING_INTERVAL_SECONDS = int(os.getenv("DB_POOL_PING_INTERVAL_SECONDS", "30"))
+DB_POOL_ACQUIRE_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT_SECONDS", "10"))
+
+# Write-behind persistence: save the turn in one INSERT and backfill embeddings off the request path
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() == "true"
+EMBEDDING_BACKFILL_BATCH_SIZE = int(os.getenv("EMBEDDING_BACKFILL_BATCH_SIZE", "32"))
+EMBEDDING_BACKFILL_MAX_BATCHES = int(os.getenv("EMBEDDING_BACKFILL_MAX_BATCHES", "10"))
+# A message whose embedding keeps failing is retried after EMBEDDING_BACKFILL_RETRY_SECONDS, at most this many times
+EMBEDDING_BACKFILL_MAX_ATTEMPTS = int(os.getenv("EMBEDDING_BACKFILL_MAX_ATTEMPTS", "3"))
+EMBEDDING_BACKFILL_RETRY_SECONDS = int(os.getenv("EMBEDDING_BACKFILL_RETRY_SECONDS", "300"))
+
+# Conversation history window sent to the LLM (0 disables the token budget)
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "20"))
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "2000"))
+HISTORY_CHARS_PER_TOKEN = int(os.getenv("HISTORY_CHARS_PER_TOKEN", "4"))
+
+# Rolling conversation summaries (messages older than the history window are folded into a stored summary)
+CONVERSATION_SUMMARY_ENABLED = os.getenv("CONVERSATION_SUMMARY_ENABLED", "false").lower() == "true"
+SUMMARY_TRIGGER_MESSAGES = int(os.getenv("SUMMARY_TRIGGER_MESSAGES", "10"))
+SUMMARY_MAX_BATCH_MESSAGES = int(os.getenv("SUMMARY_MAX_BATCH_MESSAGES", "50"))
+SUMMARY_MAX_WORDS = int(os.getenv("SUMMARY_MAX_WORDS", "250"))
+
+# Streaming (WebSocket) Config: token chunks are coalesced for this long before each post to the client
+STREAM_FLUSH_INTERVAL_MS = int(os.getenv("STREAM_FLUSH_INTERVAL_MS", "50"))
+
+# Bulk document ingestion (ingest.py)
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "256"))
+INGEST_MAX_WORKERS = int(os.getenv("INGEST_MAX_WORKERS", "8"))
+INGEST_INITIAL_RATE = float(os.getenv("INGEST_INITIAL_RATE", "10"))  # embedding requests per second
+INGEST_MAX_RATE = float(os.getenv("INGEST_MAX_RATE", "50"))
+INGEST_MAX_RETRIES = int(os.getenv("INGEST_MAX_RETRIES", "6"))
+
+# Startup: build clients and the graph at import (Lambda init phase) instead of on first use
+CHAT_EAGER_INIT = os.getenv("CHAT_EAGER_INIT", "false").lower() == "true"
+IMPORT_TIME_BUDGET_MS = int(os.getenv("IMPORT_TIME_BUDGET_MS", "400"))
+IMPORT_RSS_BUDGET_MB = int(os.getenv("IMPORT_RSS_BUDGET_MB", "80"))
+
+# Semantic response cache (opt-in): answers repeated questions without calling the LLM
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_SIMILARITY_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "86400"))
+SEMANTIC_CACHE_MAX_ENTRIES_PER_TENANT = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES_PER_TENANT", "10000"))
+
+# Tracing: per-request span trees logged as JSON, plus in-process latency percentiles
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_PERCENTILE_WINDOW = int(os.getenv("TRACE_PERCENTILE_WINDOW", "1024"))
+DEBUG_STATE_SAMPLE_RATE = float(os.getenv("DEBUG_STATE_SAMPLE_RATE", "0.01"))
+
+# Async path (async_handler): threads that run blocking psycopg2 and Bedrock calls
+ASYNC_IO_MAX_WORKERS = int(os.getenv("ASYNC_IO_MAX_WORKERS", "32"))
+
+# Batch handler: conversations processed in parallel per invocation (also capped so turns and the background worker fit in DB_POOL_MAX_SIZE)
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+
+# Conversation resolution: reuse the user's latest conversation until it has been inactive this long (0 = forever)
+CONVERSATION_INACTIVITY_TIMEOUT_SECONDS = int(os.getenv("CONVERSATION_INACTIVITY_TIMEOUT_SECONDS", "1800"))
+CONVERSATION_CACHE_MAX_SIZE = int(os.getenv("CONVERSATION_CACHE_MAX_SIZE", "10000"))
+CONVERSATION_CACHE_TTL_SECONDS = int(os.getenv("CONVERSATION_CACHE_TTL_SECONDS", "300"))
+
+# Bedrock client layer: connection pool, timeouts, adaptive retries (attempts include the first call), per-model rate limits
+# ("model-id=requests_per_second,..."; 0 = unlimited) and circuit breaking
+BEDROCK_MAX_POOL_CONNECTIONS = int(os.getenv("BEDROCK_MAX_POOL_CONNECTIONS", "50"))
+BEDROCK_CONNECT_TIMEOUT_SECONDS = float(os.getenv("BEDROCK_CONNECT_TIMEOUT_SECONDS", "5"))
+BEDROCK_READ_TIMEOUT_SECONDS = float(os.getenv("BEDROCK_READ_TIMEOUT_SECONDS", "120"))
+BEDROCK_MAX_ATTEMPTS = int(os.getenv("BEDROCK_MAX_ATTEMPTS", "4"))
+BEDROCK_MODEL_RATE_LIMITS = os.getenv("BEDROCK_MODEL_RATE_LIMITS", "")
+BEDROCK_DEFAULT_RATE_LIMIT = float(os.getenv("BEDROCK_DEFAULT_RATE_LIMIT", "0"))
+BEDROCK_LIMITER_MAX_WAIT_SECONDS = float(os.getenv("BEDROCK_LIMITER_MAX_WAIT_SECONDS", "5"))
+BEDROCK_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("BEDROCK_CIRCUIT_FAILURE_THRESHOLD", "5"))
+BEDROCK_CIRCUIT_RESET_SECONDS = float(os.getenv("BEDROCK_CIRCUIT_RESET_SECONDS", "30"))
+
+# Hash partitions of the messages table, fixed when migration 8 runs
+MESSAGES_HASH_PARTITIONS = int(os.getenv("MESSAGES_HASH_PARTITIONS", "16"))
+
+# Retention: conversations inactive this long move to gzip JSONL archives at ARCHIVE_LOCATION,
+# a local directory or s3://bucket/prefix (ARCHIVE_S3_ENDPOINT_URL for S3-compatible stores)
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_LOCATION = os.getenv("ARCHIVE_LOCATION", "./archive")
+ARCHIVE_S3_ENDPOINT_URL = os.getenv("ARCHIVE_S3_ENDPOINT_URL")
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "100"))
+
+# Retrieval: "conversation" searches the current conversation only; "hybrid" searches all of the user's active
+# conversations and the documents table, fusing ANN and full-text ranks (reciprocal rank fusion, constant RRF_K)
+# within RETRIEVAL_TIMEOUT_MS. CANDIDATES is the number of rows each ranking contributes to the fusion.
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "conversation")
+RETRIEVAL_TOP_N = int(os.getenv("RETRIEVAL_TOP_N", "5"))
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+RETRIEVAL_RRF_K = int(os.getenv("RETRIEVAL_RRF_K", "60"))
+RETRIEVAL_TIMEOUT_MS = int(os.getenv("RETRIEVAL_TIMEOUT_MS", "200"))
+RETRIEVAL_INCLUDE_DOCUMENTS = os.getenv("RETRIEVAL_INCLUDE_DOCUMENTS", "true").lower() == "true"
+# Text search configuration of the generated tsvector columns, fixed when migration 10 runs
+RETRIEVAL_TEXT_SEARCH_CONFIG = os.getenv("RETRIEVAL_TEXT_SEARCH_CONFIG", "english")
\ No newline at end of file
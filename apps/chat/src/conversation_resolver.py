@@ -0,0 +1,112 @@
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import psycopg2
+
+import archive
+import db_handler
+from tracing import traced, set_attributes
+from config import (
+    CONVERSATION_INACTIVITY_TIMEOUT_SECONDS,
+    CONVERSATION_CACHE_MAX_SIZE,
+    CONVERSATION_CACHE_TTL_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+# In-process LRU cache: user_id -> {"conversation_id", "last_active_at" (epoch), "cached_at" (monotonic)}.
+# Entries are refreshed from the database after CONVERSATION_CACHE_TTL_SECONDS, so conversations
+# started by other processes are picked up eventually.
+_conversation_cache: "OrderedDict[str, Dict]" = OrderedDict()
+_conversation_cache_lock = threading.Lock()
+_conversation_cache_metrics: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+
+def get_conversation_cache_metrics() -> Dict[str, int]:
+    """Returns a snapshot of the conversation cache counters."""
+    with _conversation_cache_lock:
+        return {**_conversation_cache_metrics, "size": len(_conversation_cache)}
+
+def _get_cached(user_id: str) -> Optional[Dict]:
+    with _conversation_cache_lock:
+        entry = _conversation_cache.get(user_id)
+        if entry and time.monotonic() - entry["cached_at"] < CONVERSATION_CACHE_TTL_SECONDS:
+            _conversation_cache.move_to_end(user_id)
+            _conversation_cache_metrics["hits"] += 1
+            return dict(entry)
+        _conversation_cache_metrics["misses"] += 1
+        return None
+
+def remember_conversation(user_id: str, conversation_id: int, last_active_at: Optional[float] = None):
+    """Records the user's active conversation; last_active_at defaults to now."""
+    if CONVERSATION_CACHE_MAX_SIZE <= 0:
+        return
+    with _conversation_cache_lock:
+        _conversation_cache[user_id] = {
+            "conversation_id": conversation_id,
+            "last_active_at": time.time() if last_active_at is None else last_active_at,
+            "cached_at": time.monotonic(),
+        }
+        _conversation_cache.move_to_end(user_id)
+        while len(_conversation_cache) > CONVERSATION_CACHE_MAX_SIZE:
+            _conversation_cache.popitem(last=False)
+            _conversation_cache_metrics["evictions"] += 1
+
+def touch_conversation(user_id: str, conversation_id: int):
+    """Marks a cached conversation as active now, after a turn was saved to it."""
+    with _conversation_cache_lock:
+        entry = _conversation_cache.get(user_id)
+        if entry and entry["conversation_id"] == conversation_id:
+            entry["last_active_at"] = time.time()
+
+def _is_expired(last_active_at: float) -> bool:
+    return CONVERSATION_INACTIVITY_TIMEOUT_SECONDS > 0 and time.time() - last_active_at > CONVERSATION_INACTIVITY_TIMEOUT_SECONDS
+
+@traced("conversation.resolve")
+def resolve_conversation(conn: psycopg2.extensions.connection, user_id: str, conversation_id: Optional[int] = None, new_conversation: bool = False) -> Dict:
+    """
+    Decides which conversation a turn belongs to. Returns {"conversation_id": ..., "source": ...}
+    where a None conversation_id means a new conversation must be created. Sources:
+    "new" (explicitly requested), "explicit" (conversation_id given and owned by the user),
+    "forbidden" (conversation_id given but missing or owned by someone else), "cache" or
+    "lookup" (the user's active conversation), "expired" (inactive longer than
+    CONVERSATION_INACTIVITY_TIMEOUT_SECONDS) and "none" (the user has no conversation yet).
+    An archived conversation continued by its conversation_id is rehydrated first, and reported
+    as "forbidden" if that fails. A latest conversation that is archived has been inactive for
+    ARCHIVE_AFTER_DAYS, so it counts as "expired" (also with the inactivity timeout disabled)
+    and a new one is started instead.
+    """
+    if new_conversation:
+        return _resolved(None, "new")
+
+    cached = _get_cached(user_id)
+    if conversation_id is not None:
+        if cached and cached["conversation_id"] == conversation_id:
+            return _resolved(conversation_id, "explicit")
+        conversation = db_handler.get_conversation(conn, conversation_id)
+        if not conversation or conversation["user_id"] != user_id:
+            logger.warning(f"User {user_id} referenced conversation {conversation_id} they do not own.")
+            return _resolved(None, "forbidden")
+        if conversation["archived"] and not archive.rehydrate_conversation(conn, conversation_id):
+            return _resolved(None, "forbidden")
+        remember_conversation(user_id, conversation_id, conversation["last_active_at"])
+        return _resolved(conversation_id, "explicit")
+
+    source = "cache"
+    if cached is None:
+        source = "lookup"
+        cached = db_handler.get_latest_conversation(conn, user_id)
+        if cached is None:
+            return _resolved(None, "none")
+        if cached["archived"] or _is_expired(cached["last_active_at"]):
+            return _resolved(None, "expired")
+        remember_conversation(user_id, cached["conversation_id"], cached["last_active_at"])
+    elif _is_expired(cached["last_active_at"]):
+        return _resolved(None, "expired")
+    return _resolved(cached["conversation_id"], source)
+
+def _resolved(conversation_id: Optional[int], source: str) -> Dict:
+    set_attributes(source=source)
+    return {"conversation_id": conversation_id, "source": source}
@@ -1,20 +1,70 @@
 import psycopg2
 from psycopg2 import sql
+from psycopg2.extras import execute_values
 import logging
-from typing import List, Dict, Optional
+import numpy as np
+from typing import List, Dict, Optional, Tuple
 
 from embedding_vector_handler import embed_text
-from config import AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION
+from tracing import traced, set_attributes
+from utils import pgvector_supports_iterative_scan
+from config import (
+    AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION,
+    AWS_RDS_PG_VECTOR_DIMENSION,
+    VECTOR_DISTANCE_METRIC,
+    VECTOR_STORAGE_TYPE,
+    VECTOR_INDEX_METHOD,
+    HNSW_EF_SEARCH,
+    HNSW_ITERATIVE_SCAN,
+    IVFFLAT_PROBES,
+    EMBEDDING_BACKFILL_MAX_ATTEMPTS,
+    EMBEDDING_BACKFILL_RETRY_SECONDS,
+)
 
 logger = logging.getLogger(__name__)
 
 CONVERSATIONS_TABLE = "conversations"
 MESSAGES_TABLE = "messages"
+CONVERSATION_SUMMARIES_TABLE = "conversation_summaries"
+DOCUMENTS_TABLE = "documents"
 USER_ROLE = "user"
 ASSISTANT_ROLE = "assistant"
 MESSAGE_TYPE_HUMAN = "human"
 MESSAGE_TYPE_AI = "ai"
 
+# pgvector distance operator and index operator class suffix for each supported metric
+VECTOR_METRICS = {
+    "l2": ("<->", "l2_ops"),
+    "inner_product": ("<#>", "ip_ops"),
+    "cosine": ("<=>", "cosine_ops"),
+}
+VECTOR_DISTANCE_OPERATOR, _operator_class_suffix = VECTOR_METRICS[VECTOR_DISTANCE_METRIC]
+VECTOR_OPERATOR_CLASS = f"{VECTOR_STORAGE_TYPE}_{_operator_class_suffix}"
+
+def vector_column_sql(column: str = "embedding") -> str:
+    """Returns the indexed expression for an embedding column (a halfvec cast when VECTOR_STORAGE_TYPE is halfvec)."""
+    if VECTOR_STORAGE_TYPE == "halfvec":
+        return f"({column}::halfvec({AWS_RDS_PG_VECTOR_DIMENSION}))"
+    return column
+
+# Query vector placeholder, cast to the same type as vector_column_sql()
+VECTOR_PARAM_SQL = f"%s::halfvec({AWS_RDS_PG_VECTOR_DIMENSION})" if VECTOR_STORAGE_TYPE == "halfvec" else "%s::vector"
+
+def vector_search_settings_sql() -> str:
+    """
+    Returns SET LOCAL statements for the ANN query-time parameters. They are sent in the
+    same round trip as the search query and last only for the current transaction.
+    hnsw.iterative_scan is only set when the database's pgvector supports it: older versions
+    reject the reserved hnsw. prefix on PostgreSQL 15+, which would fail every search.
+    """
+    if VECTOR_INDEX_METHOD == "ivfflat":
+        return f"SET LOCAL ivfflat.probes = {int(IVFFLAT_PROBES)};"
+    statements = f"SET LOCAL hnsw.ef_search = {int(HNSW_EF_SEARCH)};"
+    if HNSW_ITERATIVE_SCAN != "off" and pgvector_supports_iterative_scan():
+        statements += f" SET LOCAL hnsw.iterative_scan = {HNSW_ITERATIVE_SCAN};"
+    return statements
+
+@traced("db.create_conversation")
 def create_conversation(conn: psycopg2.extensions.connection, user_id: str) -> Optional[int]:
     """Creates a new conversation and returns its ID."""
     try:
@@ -32,11 +82,53 @@ def create_conversation(conn: psycopg2.extensions.connection, user_id: str) -> O
         logger.error(f"Error creating conversation for user {user_id}: {e}")
         return None
 
-def save_message(conn: psycopg2.extensions.connection, bedrock_client, conversation_id: int, role: str, content: str) -> bool:
-    """Saves a message to the database, including generating and storing its embedding and type."""
+@traced("db.get_latest_conversation")
+def get_latest_conversation(conn: psycopg2.extensions.connection, user_id: str) -> Optional[Dict]:
+    """
+    Returns the user's most recent conversation, whether it is archived, and when it was last
+    active (epoch seconds of its newest message, else of its creation), or None. Served by the (user_id, created_at) and
+    (conversation_id, timestamp) indexes.
+    """
+    return _fetch_conversation(conn, "c.user_id = %s", user_id)
+
+@traced("db.get_conversation")
+def get_conversation(conn: psycopg2.extensions.connection, conversation_id: int) -> Optional[Dict]:
+    """Returns the owner, archived state and last activity of a conversation, or None if it does not exist."""
+    return _fetch_conversation(conn, "c.id = %s", conversation_id)
+
+def _fetch_conversation(conn: psycopg2.extensions.connection, condition: str, value) -> Optional[Dict]:
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(f"""
+                    SELECT c.id, c.user_id, c.archived_at IS NOT NULL, EXTRACT(EPOCH FROM COALESCE(
+                        (SELECT m.timestamp FROM {MESSAGES_TABLE} m WHERE m.conversation_id = c.id ORDER BY m.timestamp DESC, m.id DESC LIMIT 1),
+                        c.created_at
+                    ))
+                    FROM {CONVERSATIONS_TABLE} c
+                    WHERE {condition}
+                    ORDER BY c.created_at DESC, c.id DESC
+                    LIMIT 1;
+                """),
+                (value,)
+            )
+            row = cur.fetchone()
+            return {"conversation_id": row[0], "user_id": row[1], "archived": row[2], "last_active_at": float(row[3])} if row else None
+    except psycopg2.Error as e:
+        conn.rollback()
+        logger.error(f"Error looking up conversation ({condition} {value}): {e}")
+        return None
+
+@traced("db.save_message")
+def save_message(conn: psycopg2.extensions.connection, bedrock_client, conversation_id: int, role: str, content: str, embedding: Optional[np.ndarray] = None) -> bool:
+    """
+    Saves a message to the database, including its embedding and type.
+    The embedding is generated only when a precomputed one is not passed in.
+    """
     message_type = MESSAGE_TYPE_HUMAN if role == USER_ROLE else MESSAGE_TYPE_AI
     try:
-        embedding = embed_text(bedrock_client, content, dimension=AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION)
+        if embedding is None:
+            embedding = embed_text(bedrock_client, content, dimension=AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION)
         if embedding is None:
             logger.warning(f"Could not generate embedding for message: '{content[:50]}...'. Saving without embedding.")
             with conn.cursor() as cur:
@@ -61,41 +153,210 @@ def save_message(conn: psycopg2.extensions.connection, bedrock_client, conversat
         logger.error(f"Error saving message in conversation {conversation_id}: {e}")
         return False
 
-def get_conversation_history(conn: psycopg2.extensions.connection, conversation_id: int) -> List[Dict[str, str]]:
-    """Retrieves the conversation history for a given conversation ID."""
+@traced("db.save_messages")
+def save_messages(conn: psycopg2.extensions.connection, conversation_id: int, messages: List[Tuple[str, str, Optional[np.ndarray]]]) -> bool:
+    """
+    Saves several (role, content, embedding) messages of a conversation in one transaction
+    using a single multi-row INSERT. Messages without an embedding are stored with a NULL
+    embedding for the background backfill to fill in later.
+    """
+    rows = [
+        (conversation_id, role, content, embedding, MESSAGE_TYPE_HUMAN if role == USER_ROLE else MESSAGE_TYPE_AI)
+        for role, content, embedding in messages
+    ]
+    set_attributes(rows=len(rows), payload_chars=sum(len(row[2]) for row in rows))
+    try:
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                f"INSERT INTO {MESSAGES_TABLE} (conversation_id, role, content, embedding, type) VALUES %s;",
+                rows
+            )
+            conn.commit()
+            logger.info(f"Saved {len(rows)} messages in conversation {conversation_id}.")
+            return True
+    except psycopg2.Error as e:
+        conn.rollback()
+        logger.error(f"Error saving messages in conversation {conversation_id}: {e}")
+        return False
+
+@traced("db.claim_messages_to_embed")
+def claim_messages_to_embed(conn: psycopg2.extensions.connection, batch_size: int) -> List[Tuple[int, int, str, int]]:
+    """
+    Claims up to batch_size messages that were saved without an embedding and returns them as
+    (id, conversation_id, content, attempts) tuples. The claim is a short transaction
+    (FOR UPDATE SKIP LOCKED) that counts the attempt and stamps the claim, so the caller can
+    release the connection while it embeds and concurrent workers skip claimed rows for
+    EMBEDDING_BACKFILL_RETRY_SECONDS. Messages that failed EMBEDDING_BACKFILL_MAX_ATTEMPTS times
+    are no longer picked, so they cannot starve newer rows. Unattempted rows come first.
+    """
     try:
         with conn.cursor() as cur:
             cur.execute(
-                sql.SQL(f"SELECT role, content, type FROM {MESSAGES_TABLE} WHERE conversation_id = %s ORDER BY timestamp ASC;"),
-                (conversation_id,)
+                sql.SQL(f"""
+                    UPDATE {MESSAGES_TABLE} AS m
+                    SET embedding_attempts = m.embedding_attempts + 1, embedding_claimed_at = CURRENT_TIMESTAMP
+                    FROM (
+                        SELECT id, conversation_id FROM {MESSAGES_TABLE}
+                        WHERE embedding IS NULL AND embedding_attempts < %s
+                          AND (embedding_claimed_at IS NULL OR embedding_claimed_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+                        ORDER BY embedding_attempts, id
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    ) AS pending
+                    WHERE m.id = pending.id AND m.conversation_id = pending.conversation_id
+                    RETURNING m.id, m.conversation_id, m.content, m.embedding_attempts;
+                """),
+                (EMBEDDING_BACKFILL_MAX_ATTEMPTS, EMBEDDING_BACKFILL_RETRY_SECONDS, batch_size)
             )
-            history = [{"role": row[0], "content": row[1], "type": row[2]} for row in cur.fetchall()]
-            logger.info(f"Retrieved conversation history for ID: {conversation_id}")
+            pending = cur.fetchall()
+        conn.commit()
+        set_attributes(rows=len(pending))
+        return pending
+    except psycopg2.Error as e:
+        conn.rollback()
+        logger.error(f"Error claiming messages to embed: {e}")
+        return []
+
+@traced("db.store_message_embeddings")
+def store_message_embeddings(conn: psycopg2.extensions.connection, updates: List[Tuple[int, int, np.ndarray]]) -> bool:
+    """Stores backfilled embeddings given as (id, conversation_id, embedding) tuples."""
+    try:
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                # Matching on conversation_id too lets each row be found in its own partition.
+                f"UPDATE {MESSAGES_TABLE} AS m SET embedding = v.embedding::vector FROM (VALUES %s) AS v(id, conversation_id, embedding) WHERE m.id = v.id AND m.conversation_id = v.conversation_id;",
+                updates
+            )
+        conn.commit()
+        set_attributes(rows=len(updates))
+        return True
+    except psycopg2.Error as e:
+        conn.rollback()
+        logger.error(f"Error storing message embeddings: {e}")
+        return False
+
+@traced("db.get_conversation_history")
+def get_conversation_history(conn: psycopg2.extensions.connection, conversation_id: int, limit: Optional[int] = None) -> List[Dict[str, str]]:
+    """
+    Retrieves the conversation history for a given conversation ID, oldest first.
+    With a limit, only the newest messages are fetched, using the (conversation_id, timestamp) index.
+    """
+    try:
+        with conn.cursor() as cur:
+            if limit is None:
+                cur.execute(
+                    sql.SQL(f"SELECT id, role, content, type FROM {MESSAGES_TABLE} WHERE conversation_id = %s ORDER BY timestamp ASC, id ASC;"),
+                    (conversation_id,)
+                )
+                rows = cur.fetchall()
+            else:
+                cur.execute(
+                    sql.SQL(f"SELECT id, role, content, type FROM {MESSAGES_TABLE} WHERE conversation_id = %s ORDER BY timestamp DESC, id DESC LIMIT %s;"),
+                    (conversation_id, limit)
+                )
+                rows = cur.fetchall()[::-1]
+            history = [{"id": row[0], "role": row[1], "content": row[2], "type": row[3]} for row in rows]
+            set_attributes(rows=len(history))
+            logger.info(f"Retrieved {len(history)} history messages for ID: {conversation_id}")
             return history
     except psycopg2.Error as e:
         logger.error(f"Error retrieving conversation history for ID {conversation_id}: {e}")
         return []
 
-def get_relevant_messages(conn: psycopg2.extensions.connection, conversation_id: int, query_text: str, bedrock_client, top_n: int = 3) -> List[Dict[str, str]]:
+@traced("db.get_relevant_messages")
+def get_relevant_messages(conn: psycopg2.extensions.connection, conversation_id: int, query_text: str, bedrock_client, top_n: int = 3, query_embedding: Optional[np.ndarray] = None) -> List[Dict[str, str]]:
     """Retrieves relevant past messages from the current conversation using similarity search."""
-    query_embedding = embed_text(bedrock_client, query_text, dimension=AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION)
+    if query_embedding is None:
+        query_embedding = embed_text(bedrock_client, query_text, dimension=AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION)
     if query_embedding is None:
         logger.warning("Could not generate embedding for query. Returning empty relevant messages.")
         return []
     try:
         with conn.cursor() as cur:
-            # Use the vector extension's cosine distance operator (<->) for similarity search
+            # The operator matches the index operator class (VECTOR_DISTANCE_METRIC). Small conversations
+            # are served exactly through the conversation_id index; large ones use the ANN index with
+            # iterative scan so the conversation filter still yields top_n rows.
             query = sql.SQL(f"""
+                {vector_search_settings_sql()}
                 SELECT role, content
                 FROM {MESSAGES_TABLE}
                 WHERE conversation_id = %s AND embedding IS NOT NULL
-                ORDER BY embedding <-> %s::vector
+                ORDER BY {vector_column_sql()} {VECTOR_DISTANCE_OPERATOR} {VECTOR_PARAM_SQL}
                 LIMIT %s
             """)
             cur.execute(query, (conversation_id, query_embedding, top_n))
             relevant_messages = [{"role": row[0], "content": row[1]} for row in cur.fetchall()]
+            set_attributes(rows=len(relevant_messages))
             logger.info(f"Retrieved {len(relevant_messages)} relevant messages for conversation {conversation_id}.")
             return relevant_messages
     except psycopg2.Error as e:
+        conn.rollback()
         logger.error(f"Error searching for relevant messages: {e}")
-        return []
\ No newline at end of file
+        return []
+
+@traced("db.get_conversation_summary")
+def get_conversation_summary(conn: psycopg2.extensions.connection, conversation_id: int) -> Optional[Dict]:
+    """Retrieves the rolling summary of a conversation and the last message it covers."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(f"SELECT summary, last_message_id FROM {CONVERSATION_SUMMARIES_TABLE} WHERE conversation_id = %s;"),
+                (conversation_id,)
+            )
+            row = cur.fetchone()
+            return {"summary": row[0], "last_message_id": row[1]} if row else None
+    except psycopg2.Error as e:
+        conn.rollback()
+        logger.error(f"Error retrieving summary for conversation {conversation_id}: {e}")
+        return None
+
+@traced("db.get_messages_to_summarize")
+def get_messages_to_summarize(conn: psycopg2.extensions.connection, conversation_id: int, after_message_id: int, before_message_id: int, limit: int) -> List[Dict]:
+    """
+    Retrieves up to limit messages between after_message_id (the last one summarized) and
+    before_message_id (the oldest one in the history window sent to the LLM), oldest first.
+    """
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(f"""
+                    SELECT id, role, content
+                    FROM {MESSAGES_TABLE}
+                    WHERE conversation_id = %s AND id > %s AND id < %s
+                    ORDER BY id ASC
+                    LIMIT %s
+                """),
+                (conversation_id, after_message_id, before_message_id, limit)
+            )
+            return [{"id": row[0], "role": row[1], "content": row[2]} for row in cur.fetchall()]
+    except psycopg2.Error as e:
+        conn.rollback()
+        logger.error(f"Error retrieving messages to summarize for conversation {conversation_id}: {e}")
+        return []
+
+@traced("db.upsert_conversation_summary")
+def upsert_conversation_summary(conn: psycopg2.extensions.connection, conversation_id: int, summary: str, last_message_id: int) -> bool:
+    """Stores the rolling summary, never replacing it with one that covers fewer messages."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(f"""
+                    INSERT INTO {CONVERSATION_SUMMARIES_TABLE} (conversation_id, summary, last_message_id)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (conversation_id) DO UPDATE
+                    SET summary = EXCLUDED.summary,
+                        last_message_id = EXCLUDED.last_message_id,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE {CONVERSATION_SUMMARIES_TABLE}.last_message_id < EXCLUDED.last_message_id;
+                """),
+                (conversation_id, summary, last_message_id)
+            )
+            conn.commit()
+            logger.info(f"Updated summary for conversation {conversation_id} up to message {last_message_id}.")
+            return True
+    except psycopg2.Error as e:
+        conn.rollback()
+        logger.error(f"Error saving summary for conversation {conversation_id}: {e}")
+        return False
\ No newline at end of file
@@ -1,40 +1,102 @@
-import os
-import boto3
+import hashlib
 import json
+import threading
+import numpy as np
+import time
 import psycopg2
 from psycopg2 import sql
 import logging
-from typing import List
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 
-from utils import get_bedrock_client
-from config import AWS_BEDROCK_EMBEDDING_MODEL_ID, AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION
+from tracing import traced, set_attributes
+from config import (
+    AWS_BEDROCK_EMBEDDING_MODEL_ID,
+    AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION,
+    EMBEDDING_CACHE_MAX_SIZE,
+    EMBEDDING_CACHE_TTL_SECONDS,
+)
 
 logger = logging.getLogger(__name__)
 
+# In-process LRU cache: (model id, dimension, normalized text hash) -> (embedding, stored_at)
+_embedding_cache: "OrderedDict[Tuple[str, int, str], Tuple[np.ndarray, float]]" = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+_embedding_cache_metrics: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+
+def _embedding_cache_key(text: str, dimension: int) -> Tuple[str, int, str]:
+    normalized = " ".join(text.split())
+    return (AWS_BEDROCK_EMBEDDING_MODEL_ID, dimension, hashlib.sha256(normalized.encode("utf-8")).hexdigest())
+
+def get_embedding_cache_metrics() -> Dict[str, int]:
+    """Returns a snapshot of the embedding cache counters."""
+    with _embedding_cache_lock:
+        return {**_embedding_cache_metrics, "size": len(_embedding_cache)}
+
 def embed_text(bedrock_client, text: str, dimension: int = AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION):
-    """Embeds the input text using the specified Titan model."""
+    """Embeds the input text, serving repeated texts from the in-process LRU cache."""
+    if EMBEDDING_CACHE_MAX_SIZE <= 0:
+        return _invoke_embedding_model(bedrock_client, text, dimension)
+
+    key = _embedding_cache_key(text, dimension)
+    with _embedding_cache_lock:
+        cached = _embedding_cache.get(key)
+        if cached and time.monotonic() - cached[1] < EMBEDDING_CACHE_TTL_SECONDS:
+            _embedding_cache.move_to_end(key)
+            _embedding_cache_metrics["hits"] += 1
+            set_attributes(embedding_cache_hit=True)
+            return cached[0]
+        _embedding_cache_metrics["misses"] += 1
+
+    embedding = _invoke_embedding_model(bedrock_client, text, dimension)
+    if embedding is None:
+        return None
+    # Cached arrays are shared between callers, so they must not be modified in place.
+    embedding.flags.writeable = False
+
+    with _embedding_cache_lock:
+        _embedding_cache[key] = (embedding, time.monotonic())
+        _embedding_cache.move_to_end(key)
+        while len(_embedding_cache) > EMBEDDING_CACHE_MAX_SIZE:
+            _embedding_cache.popitem(last=False)
+            _embedding_cache_metrics["evictions"] += 1
+    return embedding
+
+@traced("bedrock.embed")
+def request_embedding(bedrock_client, text: str, dimension: int = AWS_BEDROCK_EMBEDDING_MODEL_DIMENSION) -> np.ndarray:
+    """Embeds the input text using the specified Titan model, as a float32 NumPy array. Errors are raised."""
+    body = json.dumps({"inputText": text, "dimensions": dimension, "normalize": True})
+    set_attributes(request_bytes=len(body), model_id=AWS_BEDROCK_EMBEDDING_MODEL_ID)
+    response = bedrock_client.invoke_model(
+        body=body,
+        modelId=AWS_BEDROCK_EMBEDDING_MODEL_ID,
+        accept="application/json",
+        contentType="application/json"
+    )
+    response_body = json.loads(response.get("body").read())
+    return np.asarray(response_body["embedding"], dtype=np.float32)
+
+def _invoke_embedding_model(bedrock_client, text: str, dimension: int) -> Optional[np.ndarray]:
+    """Embeds the input text, logging and returning None on failure."""
     try:
-        body = json.dumps({"inputText": text, "dimensions": dimension, "normalize": True})
-        response = bedrock_client.invoke_model(
-            body=body,
-            modelId=AWS_BEDROCK_EMBEDDING_MODEL_ID,
-            accept="application/json",
-            contentType="application/json"
-        )
-        response_body = json.loads(response.get("body").read())
-        embedding = response_body.get("embedding")
+        embedding = request_embedding(bedrock_client, text, dimension)
         logger.debug(f"Successfully embedded text: '{text[:50]}...'")
         return embedding
     except Exception as e:
         logger.error(f"Error embedding text: {e}")
         return None
 
-def insert_embedding(conn, table_name: str, content: str, embedding: List[float], source: str = None, metadata: dict = None):
-    """Inserts the content and its embedding into the specified table."""
+def content_hash(content: str) -> str:
+    """Hash used to deduplicate stored documents; matches encode(sha256(convert_to(content, 'UTF8')), 'hex')."""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+@traced("db.insert_embedding")
+def insert_embedding(conn, table_name: str, content: str, embedding: np.ndarray, source: str = None, metadata: dict = None):
+    """Inserts the content and its embedding into the specified table, skipping content that is already stored."""
     try:
         with conn.cursor() as cur:
-            query = sql.SQL("INSERT INTO {} (content, embedding, source, metadata) VALUES (%s, %s, %s, %s)").format(sql.Identifier(table_name))
-            cur.execute(query, (content, embedding, source, json.dumps(metadata) if metadata else None))
+            query = sql.SQL("INSERT INTO {} (content, embedding, source, metadata, content_hash) VALUES (%s, %s, %s, %s, %s) ON CONFLICT (content_hash) DO NOTHING").format(sql.Identifier(table_name))
+            cur.execute(query, (content, embedding, source, json.dumps(metadata) if metadata else None, content_hash(content)))
             conn.commit()
             logger.info(f"Successfully inserted embedding for content: '{content[:50]}...' into table '{table_name}'.")
             return True
@@ -43,16 +105,22 @@ def insert_embedding(conn, table_name: str, content: str, embedding: List[float]
         logger.error(f"Error inserting embedding: {e}")
         return False
 
-def process_and_store(texts_to_embed: List[dict], bedrock_client, conn, table_name: str = "documents"):
+def process_and_store(texts_to_embed: List[dict], bedrock_client, conn, table_name: str = "documents", bulk: bool = False):
     """
     Embeds a list of texts and stores them in the vector database.
     Each item in texts_to_embed should be a dictionary with at least a 'content' key.
     Optional keys include 'source' and 'metadata'.
+    With bulk=True the items go through the concurrent, batched pipeline in ingest.py.
     """
     if not conn:
         logger.error("Database connection is not available.")
         return False
 
+    if bulk:
+        from ingest import bulk_ingest  # ingest imports this module
+        bulk_ingest(iter(texts_to_embed), bedrock_client, conn, table_name=table_name)
+        return True
+
     for item in texts_to_embed:
         content = item.get("content")
         source = item.get("source")
@@ -60,7 +128,7 @@ def process_and_store(texts_to_embed: List[dict], bedrock_client, conn, table_na
 
         if content:
             embedding = embed_text(bedrock_client, content)
-            if embedding:
+            if embedding is not None:
                 insert_embedding(conn, table_name, content, embedding, source, metadata)
         else:
             logger.warning("Skipping item without 'content'.")
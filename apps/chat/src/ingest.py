@@ -0,0 +1,277 @@
+"""
+Bulk document ingestion: streams JSONL documents, embeds them concurrently under an adaptive
+rate limit and writes them in large batches, skipping content that is already stored.
+
+    python ingest.py documents.jsonl [--table documents] [--batch-size 256] [--workers 8]
+
+Each line is a JSON object with a 'content' key and optional 'source' and 'metadata' keys.
+Progress is checkpointed after every committed batch, so a rerun resumes where it stopped.
+Documents whose embedding fails are appended to a rejects file (<input>.rejects.jsonl by
+default) before the checkpoint moves past them; rerun ingest.py on that file to retry them.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set
+
+import numpy as np
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from botocore.exceptions import ClientError
+
+from bedrock_client import THROTTLING_ERROR_CODES
+from embedding_vector_handler import request_embedding, content_hash
+from utils import get_bedrock_client, get_db_connection
+from config import (
+    INGEST_BATCH_SIZE,
+    INGEST_MAX_WORKERS,
+    INGEST_INITIAL_RATE,
+    INGEST_MAX_RATE,
+    INGEST_MAX_RETRIES,
+)
+
+logger = logging.getLogger(__name__)
+
+class AdaptiveRateLimiter:
+    """
+    Spaces requests to a target rate shared by all worker threads. The rate is halved on
+    throttling and grows back by roughly one request per second per second of successes (AIMD).
+    """
+
+    def __init__(self, initial_rate: float, max_rate: float, min_rate: float = 0.5):
+        self.rate = initial_rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.throttles = 0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1.0 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + 1.0 / max(self.rate, 1.0))
+
+    def on_throttle(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.throttles += 1
+
+def embed_with_backoff(bedrock_client, text: str, limiter: AdaptiveRateLimiter, max_retries: int = INGEST_MAX_RETRIES) -> Optional[np.ndarray]:
+    """Embeds text under the rate limiter, retrying throttled calls with full-jitter exponential backoff."""
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            embedding = request_embedding(bedrock_client, text)
+            limiter.on_success()
+            return embedding
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code not in THROTTLING_ERROR_CODES or attempt == max_retries:
+                logger.error(f"Error embedding document '{text[:50]}...': {e}")
+                return None
+            limiter.on_throttle()
+            time.sleep(random.uniform(0, min(20.0, 0.5 * 2 ** attempt)))
+        except Exception as e:
+            logger.error(f"Error embedding document '{text[:50]}...': {e}")
+            return None
+    return None
+
+def read_jsonl(path: str) -> Iterator[dict]:
+    """Yields one document per non-blank line, reading the file lazily ('-' reads stdin)."""
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def load_checkpoint(checkpoint_path: Optional[str]) -> int:
+    """Returns the number of input documents already committed by a previous run."""
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return 0
+    with open(checkpoint_path, encoding="utf-8") as f:
+        return json.load(f).get("offset", 0)
+
+def save_checkpoint(checkpoint_path: Optional[str], offset: int):
+    if not checkpoint_path:
+        return
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"offset": offset}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+def save_rejects(reject_path: Optional[str], items: List[dict]):
+    """Appends documents that could not be ingested to the rejects file, in the input format."""
+    if not reject_path or not items:
+        return
+    with open(reject_path, "a", encoding="utf-8") as f:
+        for item in items:
+            f.write(json.dumps(item) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def _existing_hashes(conn, table_name: str, hashes: List[str]) -> Set[str]:
+    with conn.cursor() as cur:
+        cur.execute(
+            sql.SQL("SELECT content_hash FROM {} WHERE content_hash = ANY(%s)").format(sql.Identifier(table_name)),
+            (hashes,)
+        )
+        return {row[0] for row in cur.fetchall()}
+
+def _write_rows(conn, table_name: str, rows: List[tuple]) -> int:
+    """Writes a batch with one multi-row INSERT and commits it. Returns the number of new rows."""
+    with conn.cursor() as cur:
+        execute_values(
+            cur,
+            sql.SQL("INSERT INTO {} (content, embedding, source, metadata, content_hash) VALUES %s ON CONFLICT (content_hash) DO NOTHING").format(sql.Identifier(table_name)),
+            rows,
+            page_size=len(rows)
+        )
+        inserted = cur.rowcount
+    conn.commit()
+    return inserted
+
+def bulk_ingest(
+    items: Iterator[dict],
+    bedrock_client,
+    conn,
+    table_name: str = "documents",
+    batch_size: int = INGEST_BATCH_SIZE,
+    max_workers: int = INGEST_MAX_WORKERS,
+    limiter: Optional[AdaptiveRateLimiter] = None,
+    checkpoint_path: Optional[str] = None,
+    start_offset: int = 0,
+    reject_path: Optional[str] = None,
+) -> Dict[str, float]:
+    """
+    Embeds and stores documents batch by batch, holding only one batch in memory.
+    items must already be positioned at start_offset; the offset is checkpointed after each commit,
+    once the batch's failed documents have been appended to reject_path.
+    """
+    limiter = limiter or AdaptiveRateLimiter(INGEST_INITIAL_RATE, INGEST_MAX_RATE)
+    stats = {"read": 0, "skipped": 0, "duplicates": 0, "failed": 0, "inserted": 0}
+    offset = start_offset
+    started_at = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest") as executor:
+        while True:
+            batch = list(itertools.islice(items, batch_size))
+            if not batch:
+                break
+            stats["read"] += len(batch)
+
+            documents: Dict[str, dict] = {}
+            for item in batch:
+                content = item.get("content")
+                if not content:
+                    stats["skipped"] += 1
+                    continue
+                document_hash = content_hash(content)
+                if document_hash in documents:
+                    stats["duplicates"] += 1
+                    continue
+                documents[document_hash] = item
+
+            try:
+                existing = _existing_hashes(conn, table_name, list(documents)) if documents else set()
+                stats["duplicates"] += len(existing)
+                pending = [(document_hash, item) for document_hash, item in documents.items() if document_hash not in existing]
+                embeddings = executor.map(lambda entry: embed_with_backoff(bedrock_client, entry[1]["content"], limiter), pending)
+
+                rows, rejected = [], []
+                for (document_hash, item), embedding in zip(pending, embeddings):
+                    if embedding is None:
+                        rejected.append(item)
+                        continue
+                    metadata = item.get("metadata")
+                    rows.append((item["content"], embedding, item.get("source"), json.dumps(metadata) if metadata else None, document_hash))
+                if rows:
+                    stats["inserted"] += _write_rows(conn, table_name, rows)
+            except psycopg2.Error as e:
+                conn.rollback()
+                logger.error(f"Error writing batch at offset {offset}; stopping so the run can be resumed: {e}")
+                break
+
+            if rejected:
+                try:
+                    save_rejects(reject_path, rejected)
+                except OSError as e:
+                    logger.error(f"Error writing {len(rejected)} failed documents to {reject_path}; stopping so the run can be resumed: {e}")
+                    break
+                stats["failed"] += len(rejected)
+                destination = f"written to {reject_path} for retry" if reject_path else "dropped, as no rejects file is set"
+                logger.warning(f"{len(rejected)} documents at offset {offset} failed to embed; {destination}.")
+            offset += len(batch)
+            save_checkpoint(checkpoint_path, offset)
+            elapsed = time.perf_counter() - started_at
+            logger.info(
+                f"Ingested up to offset {offset}: {stats['read'] / elapsed:.1f} docs/s, "
+                f"{stats['inserted'] / elapsed:.1f} rows/s, embedding rate limit {limiter.rate:.1f}/s"
+            )
+
+    elapsed = time.perf_counter() - started_at
+    stats.update(
+        offset=offset,
+        throttles=limiter.throttles,
+        elapsed_s=round(elapsed, 2),
+        docs_per_s=round(stats["read"] / elapsed, 2) if elapsed else 0.0,
+        rows_per_s=round(stats["inserted"] / elapsed, 2) if elapsed else 0.0,
+    )
+    logger.info(f"Bulk ingestion completed: {stats}")
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of documents, or '-' for stdin.")
+    parser.add_argument("--table", default="documents")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=INGEST_MAX_WORKERS)
+    parser.add_argument("--rate", type=float, default=INGEST_INITIAL_RATE, help="Initial embedding requests per second.")
+    parser.add_argument("--checkpoint", help="Checkpoint file (defaults to <input>.checkpoint).")
+    parser.add_argument("--rejects", help="File that documents failing to embed are appended to (defaults to <input>.rejects.jsonl).")
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start from the beginning.")
+    args = parser.parse_args()
+
+    checkpoint_path = args.checkpoint or (None if args.input == "-" else f"{args.input}.checkpoint")
+    reject_path = args.rejects or ("rejects.jsonl" if args.input == "-" else f"{args.input}.rejects.jsonl")
+    start_offset = 0 if args.restart else load_checkpoint(checkpoint_path)
+    if start_offset:
+        logger.info(f"Resuming from offset {start_offset}.")
+
+    bedrock_client = get_bedrock_client()
+    if not bedrock_client:
+        raise SystemExit("Failed to initialize Bedrock client.")
+    with get_db_connection() as conn:
+        if not conn:
+            raise SystemExit("Error connecting to database.")
+        result = bulk_ingest(
+            itertools.islice(read_jsonl(args.input), start_offset, None),
+            bedrock_client,
+            conn,
+            table_name=args.table,
+            batch_size=args.batch_size,
+            max_workers=args.workers,
+            limiter=AdaptiveRateLimiter(args.rate, max(args.rate, INGEST_MAX_RATE)),
+            checkpoint_path=checkpoint_path,
+            start_offset=start_offset,
+            reject_path=reject_path,
+        )
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,164 @@
+import json
+import logging
+import threading
+import time
+import numpy as np
+import psycopg2
+from psycopg2 import sql
+from typing import Dict, List, Optional
+
+from tracing import traced, set_attributes
+from db_handler import CONVERSATIONS_TABLE, MESSAGES_TABLE, DOCUMENTS_TABLE, VECTOR_DISTANCE_OPERATOR, VECTOR_PARAM_SQL, vector_column_sql, vector_search_settings_sql
+from config import (
+    RETRIEVAL_TOP_N,
+    RETRIEVAL_CANDIDATES,
+    RETRIEVAL_RRF_K,
+    RETRIEVAL_TIMEOUT_MS,
+    RETRIEVAL_INCLUDE_DOCUMENTS,
+    RETRIEVAL_TEXT_SEARCH_CONFIG,
+)
+
+logger = logging.getLogger(__name__)
+
+_metrics_lock = threading.Lock()
+_metrics: Dict[str, float] = {"searches": 0, "results": 0, "timeouts": 0, "errors": 0, "search_ms_total": 0.0}
+
+def get_retrieval_metrics() -> Dict[str, float]:
+    """Returns the retrieval counters plus mean search latency."""
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    metrics["mean_search_ms"] = metrics["search_ms_total"] / (metrics["searches"] or 1)
+    return metrics
+
+def _record(**increments):
+    with _metrics_lock:
+        for key, value in increments.items():
+            _metrics[key] += value
+
+# The query embedding is passed once as a named parameter and referenced by every vector arm.
+_QUERY_VECTOR_SQL = VECTOR_PARAM_SQL.replace("%s", "%(embedding)s")
+
+def _ranked_arms(source: str, table: str, alias: str, columns: List[str], scope_sql: str) -> str:
+    """
+    Builds the vector and full-text arms for one source. Each arm keeps its best
+    %(candidates)s rows and numbers them 1..n; the ranks are what the fusion uses.
+    """
+    selected = ", ".join(f"{alias}.{column}" for column in columns)
+    columns = ", ".join(columns)
+    return f"""
+        {source}_vector AS (
+            SELECT {columns}, row_number() OVER (ORDER BY distance) AS rank FROM (
+                SELECT {selected}, {vector_column_sql(f"{alias}.embedding")} {VECTOR_DISTANCE_OPERATOR} {_QUERY_VECTOR_SQL} AS distance
+                FROM {table} {alias}
+                WHERE {alias}.embedding IS NOT NULL {scope_sql}
+                ORDER BY distance
+                LIMIT %(candidates)s
+            ) candidates
+        ),
+        {source}_text AS (
+            SELECT {columns}, row_number() OVER (ORDER BY text_score DESC) AS rank FROM (
+                SELECT {selected}, ts_rank_cd({alias}.content_tsv, query.tsq) AS text_score
+                FROM {table} {alias}, query
+                WHERE {alias}.content_tsv @@ query.tsq {scope_sql}
+                ORDER BY text_score DESC
+                LIMIT %(candidates)s
+            ) candidates
+        )"""
+
+def _fused(source: str, select_columns: str, group_columns: str) -> str:
+    """Reciprocal rank fusion: score = sum over arms of 1 / (rrf_k + rank)."""
+    return f"""
+        SELECT '{source}' AS source, {select_columns},
+               SUM(1.0 / (%(rrf_k)s + rank)) AS score,
+               MIN(rank) FILTER (WHERE arm = 'vector') AS vector_rank,
+               MIN(rank) FILTER (WHERE arm = 'text') AS text_rank
+        FROM (
+            SELECT *, 'vector' AS arm FROM {source}_vector
+            UNION ALL
+            SELECT *, 'text' AS arm FROM {source}_text
+        ) arms
+        GROUP BY {group_columns}"""
+
+def build_hybrid_search_sql(include_documents: bool, metadata_filter: bool) -> str:
+    """
+    Builds the single statement behind hybrid_search. Messages are limited to the user's
+    unarchived conversations; documents to rows whose metadata contains %(metadata)s when
+    metadata_filter is set, which the jsonb_path_ops GIN index serves.
+    """
+    arms = [_ranked_arms(
+        "message", MESSAGES_TABLE, "m", ["id", "role", "content"],
+        f"AND m.conversation_id IN (SELECT id FROM {CONVERSATIONS_TABLE} WHERE user_id = %(user_id)s AND archived_at IS NULL)",
+    )]
+    # Both branches select the same columns; messages pad the document-only ones with NULL.
+    fused = [_fused("message", "id, role, content, NULL AS document_source, NULL::jsonb AS metadata", "id, role, content")]
+    if include_documents:
+        arms.append(_ranked_arms(
+            "document", DOCUMENTS_TABLE, "d", ["id", "content", "source", "metadata"],
+            "AND d.metadata @> %(metadata)s::jsonb" if metadata_filter else "",
+        ))
+        fused.append(_fused("document", "id, 'document' AS role, content, source AS document_source, metadata", "id, content, source, metadata"))
+    union_sql = "\n        UNION ALL".join(fused)
+    return f"""
+        WITH query AS (SELECT websearch_to_tsquery('{RETRIEVAL_TEXT_SEARCH_CONFIG}'::regconfig, %(query_text)s) AS tsq),
+        {",".join(arms)}
+        SELECT source, id, role, content, document_source, metadata, score, vector_rank, text_rank
+        FROM ({union_sql}
+        ) fused
+        ORDER BY score DESC, source, id
+        LIMIT %(top_n)s
+    """
+
+@traced("retrieval.hybrid_search")
+def hybrid_search(conn: psycopg2.extensions.connection, user_id: str, query_text: str, query_embedding: np.ndarray,
+                  top_n: int = RETRIEVAL_TOP_N, metadata_filter: Optional[Dict] = None,
+                  include_documents: bool = RETRIEVAL_INCLUDE_DOCUMENTS, timeout_ms: int = RETRIEVAL_TIMEOUT_MS) -> List[Dict]:
+    """
+    Searches the user's message memory across conversations and the document corpus in one
+    round trip, ranking each by ANN distance and by full-text relevance and fusing the four
+    rankings with reciprocal rank fusion. Results carry the fused score and the rank they
+    had in each arm (None if absent). The statement runs under a SET LOCAL statement_timeout
+    of timeout_ms, which like the ANN settings lasts until the caller's transaction ends; a
+    search that exceeds it returns [] so the turn proceeds without retrieved context.
+    """
+    started = time.perf_counter()
+    params = {
+        "user_id": user_id,
+        "query_text": query_text,
+        "embedding": query_embedding,
+        "candidates": max(RETRIEVAL_CANDIDATES, top_n),
+        "rrf_k": RETRIEVAL_RRF_K,
+        "top_n": top_n,
+        "metadata": json.dumps(metadata_filter) if metadata_filter else None,
+    }
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(
+                    f"{vector_search_settings_sql()} SET LOCAL statement_timeout = {int(timeout_ms)};"
+                    + build_hybrid_search_sql(include_documents, bool(metadata_filter))
+                ),
+                params
+            )
+            results = [
+                {
+                    "source": source, "id": result_id, "role": role, "content": content,
+                    "document_source": document_source, "metadata": metadata, "score": float(score),
+                    "vector_rank": vector_rank, "text_rank": text_rank,
+                }
+                for source, result_id, role, content, document_source, metadata, score, vector_rank, text_rank in cur.fetchall()
+            ]
+    except psycopg2.extensions.QueryCanceledError:
+        conn.rollback()
+        _record(searches=1, timeouts=1, search_ms_total=(time.perf_counter() - started) * 1000)
+        logger.warning(f"Hybrid search for user {user_id} exceeded {timeout_ms} ms; continuing without retrieved context.")
+        set_attributes(timed_out=True)
+        return []
+    except psycopg2.Error as e:
+        conn.rollback()
+        _record(searches=1, errors=1)
+        logger.error(f"Error running hybrid search for user {user_id}: {e}")
+        return []
+    _record(searches=1, results=len(results), search_ms_total=(time.perf_counter() - started) * 1000)
+    set_attributes(rows=len(results))
+    logger.info(f"Hybrid search returned {len(results)} results for user {user_id}.")
+    return results
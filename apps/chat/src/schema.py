@@ -0,0 +1,239 @@
+import logging
+import psycopg2
+from psycopg2 import sql
+from typing import List, Set, Tuple
+
+from db_handler import CONVERSATIONS_TABLE, MESSAGES_TABLE, CONVERSATION_SUMMARIES_TABLE, DOCUMENTS_TABLE, VECTOR_OPERATOR_CLASS, vector_column_sql
+from semantic_cache import SEMANTIC_CACHE_TABLE
+from utils import get_db_connection
+from config import (
+    AWS_RDS_PG_VECTOR_DIMENSION,
+    VECTOR_DISTANCE_METRIC,
+    VECTOR_INDEX_METHOD,
+    VECTOR_STORAGE_TYPE,
+    HNSW_M,
+    HNSW_EF_CONSTRUCTION,
+    IVFFLAT_LISTS,
+    MESSAGES_HASH_PARTITIONS,
+    RETRIEVAL_TEXT_SEARCH_CONFIG,
+)
+
+logger = logging.getLogger(__name__)
+
+def vector_index_sql(table_name: str, column: str = "embedding") -> str:
+    """
+    Builds the ANN index for the configured method, metric and storage type. The index name
+    carries all three; after changing one, run `python schema.py ensure-vector-indexes`.
+    """
+    index_name = f"idx_{table_name}_{column}_{VECTOR_INDEX_METHOD}_{VECTOR_DISTANCE_METRIC}"
+    if VECTOR_STORAGE_TYPE == "halfvec":
+        index_name += "_halfvec"
+    if VECTOR_INDEX_METHOD == "ivfflat":
+        options = f"lists = {IVFFLAT_LISTS}"
+    else:
+        options = f"m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION}"
+    return (
+        f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} "
+        f"USING {VECTOR_INDEX_METHOD} ({vector_column_sql(column)} {VECTOR_OPERATOR_CLASS}) WITH ({options});"
+    )
+
+SCHEMA_MIGRATIONS_TABLE = "schema_migrations"
+
+# Ordered (version, description, statements). Statements are idempotent so that databases
+# created before migrations were tracked can be brought under management safely.
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "create base tables", [
+        "CREATE EXTENSION IF NOT EXISTS vector;",
+        f"""
+        CREATE TABLE IF NOT EXISTS {CONVERSATIONS_TABLE} (
+            id SERIAL PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS {MESSAGES_TABLE} (
+            id SERIAL PRIMARY KEY,
+            conversation_id INTEGER NOT NULL REFERENCES {CONVERSATIONS_TABLE} (id),
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            type TEXT,
+            embedding vector({AWS_RDS_PG_VECTOR_DIMENSION}),
+            timestamp TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS {DOCUMENTS_TABLE} (
+            id SERIAL PRIMARY KEY,
+            content TEXT NOT NULL,
+            embedding vector({AWS_RDS_PG_VECTOR_DIMENSION}),
+            source TEXT,
+            metadata JSONB
+        );
+        """,
+    ]),
+    (2, "index messages by conversation and timestamp for windowed history", [
+        f"CREATE INDEX IF NOT EXISTS idx_{MESSAGES_TABLE}_conversation_timestamp ON {MESSAGES_TABLE} (conversation_id, timestamp DESC, id DESC);",
+    ]),
+    (3, "create rolling conversation summaries", [
+        f"""
+        CREATE TABLE IF NOT EXISTS {CONVERSATION_SUMMARIES_TABLE} (
+            conversation_id INTEGER PRIMARY KEY REFERENCES {CONVERSATIONS_TABLE} (id),
+            summary TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+    ]),
+    (4, "create ANN indexes on message and document embeddings", [
+        vector_index_sql(MESSAGES_TABLE),
+        vector_index_sql(DOCUMENTS_TABLE),
+    ]),
+    (5, "deduplicate documents by content hash", [
+        f"ALTER TABLE {DOCUMENTS_TABLE} ADD COLUMN IF NOT EXISTS content_hash TEXT;",
+        # Existing duplicates keep a NULL hash on all but their oldest copy so the unique index can be built.
+        f"""
+        UPDATE {DOCUMENTS_TABLE} SET content_hash = hashed.content_hash
+        FROM (
+            SELECT DISTINCT ON (content_hash) id, content_hash
+            FROM (SELECT id, encode(sha256(convert_to(content, 'UTF8')), 'hex') AS content_hash FROM {DOCUMENTS_TABLE}) AS all_hashes
+            ORDER BY content_hash, id
+        ) AS hashed
+        WHERE {DOCUMENTS_TABLE}.id = hashed.id AND {DOCUMENTS_TABLE}.content_hash IS NULL;
+        """,
+        f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{DOCUMENTS_TABLE}_content_hash ON {DOCUMENTS_TABLE} (content_hash);",
+    ]),
+    (6, "create semantic response cache", [
+        f"""
+        CREATE TABLE IF NOT EXISTS {SEMANTIC_CACHE_TABLE} (
+            id BIGSERIAL PRIMARY KEY,
+            tenant_id TEXT NOT NULL,
+            context_hash TEXT NOT NULL,
+            query_text TEXT NOT NULL,
+            query_embedding vector({AWS_RDS_PG_VECTOR_DIMENSION}) NOT NULL,
+            response TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            last_hit_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            hit_count INTEGER NOT NULL DEFAULT 0
+        );
+        """,
+        f"CREATE INDEX IF NOT EXISTS idx_{SEMANTIC_CACHE_TABLE}_tenant_context ON {SEMANTIC_CACHE_TABLE} (tenant_id, context_hash, created_at);",
+        f"CREATE INDEX IF NOT EXISTS idx_{SEMANTIC_CACHE_TABLE}_tenant_last_hit ON {SEMANTIC_CACHE_TABLE} (tenant_id, last_hit_at DESC);",
+        vector_index_sql(SEMANTIC_CACHE_TABLE, "query_embedding"),
+    ]),
+    (7, "index conversations by user and creation time for active-conversation lookup", [
+        f"CREATE INDEX IF NOT EXISTS idx_{CONVERSATIONS_TABLE}_user_created ON {CONVERSATIONS_TABLE} (user_id, created_at DESC, id DESC);",
+    ]),
+    # Every message query filters by conversation_id, so each one touches a single partition and
+    # each partition carries its own, smaller ANN index. Rows are copied in the migration
+    # transaction, which locks the table; run it in a maintenance window on large databases.
+    (8, "partition messages by hash of conversation_id", [
+        f"""
+        DO $$
+        BEGIN
+            IF (SELECT relkind FROM pg_class WHERE oid = '{MESSAGES_TABLE}'::regclass) = 'r' THEN
+                ALTER TABLE {MESSAGES_TABLE} RENAME TO {MESSAGES_TABLE}_unpartitioned;
+                ALTER INDEX {MESSAGES_TABLE}_pkey RENAME TO {MESSAGES_TABLE}_unpartitioned_pkey;
+                CREATE TABLE {MESSAGES_TABLE} (
+                    LIKE {MESSAGES_TABLE}_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+                    PRIMARY KEY (id, conversation_id)
+                ) PARTITION BY HASH (conversation_id);
+                FOR remainder IN 0..{MESSAGES_HASH_PARTITIONS - 1} LOOP
+                    EXECUTE format(
+                        'CREATE TABLE {MESSAGES_TABLE}_p%s PARTITION OF {MESSAGES_TABLE} FOR VALUES WITH (MODULUS {MESSAGES_HASH_PARTITIONS}, REMAINDER %s)',
+                        remainder, remainder
+                    );
+                END LOOP;
+                INSERT INTO {MESSAGES_TABLE} SELECT * FROM {MESSAGES_TABLE}_unpartitioned;
+                ALTER SEQUENCE {MESSAGES_TABLE}_id_seq OWNED BY {MESSAGES_TABLE}.id;
+                DROP TABLE {MESSAGES_TABLE}_unpartitioned;
+                ALTER TABLE {MESSAGES_TABLE} ADD FOREIGN KEY (conversation_id) REFERENCES {CONVERSATIONS_TABLE} (id);
+            END IF;
+        END $$;
+        """,
+        f"CREATE INDEX IF NOT EXISTS idx_{MESSAGES_TABLE}_conversation_timestamp ON {MESSAGES_TABLE} (conversation_id, timestamp DESC, id DESC);",
+        vector_index_sql(MESSAGES_TABLE),
+    ]),
+    (9, "track archived conversations", [
+        f"ALTER TABLE {CONVERSATIONS_TABLE} ADD COLUMN IF NOT EXISTS archived_at TIMESTAMPTZ;",
+        f"ALTER TABLE {CONVERSATIONS_TABLE} ADD COLUMN IF NOT EXISTS archive_key TEXT;",
+    ]),
+    # Full-text ranking for hybrid retrieval. Adding a stored generated column rewrites the table.
+    (10, "add full-text search columns and a document metadata index", [
+        f"ALTER TABLE {MESSAGES_TABLE} ADD COLUMN IF NOT EXISTS content_tsv tsvector GENERATED ALWAYS AS (to_tsvector('{RETRIEVAL_TEXT_SEARCH_CONFIG}'::regconfig, content)) STORED;",
+        f"CREATE INDEX IF NOT EXISTS idx_{MESSAGES_TABLE}_content_tsv ON {MESSAGES_TABLE} USING gin (content_tsv);",
+        f"ALTER TABLE {DOCUMENTS_TABLE} ADD COLUMN IF NOT EXISTS content_tsv tsvector GENERATED ALWAYS AS (to_tsvector('{RETRIEVAL_TEXT_SEARCH_CONFIG}'::regconfig, content)) STORED;",
+        f"CREATE INDEX IF NOT EXISTS idx_{DOCUMENTS_TABLE}_content_tsv ON {DOCUMENTS_TABLE} USING gin (content_tsv);",
+        f"CREATE INDEX IF NOT EXISTS idx_{DOCUMENTS_TABLE}_metadata ON {DOCUMENTS_TABLE} USING gin (metadata jsonb_path_ops);",
+    ]),
+    # The partial index holds only messages still waiting for an embedding, so the backfill
+    # never scans embedded rows.
+    (11, "track embedding backfill attempts", [
+        f"ALTER TABLE {MESSAGES_TABLE} ADD COLUMN IF NOT EXISTS embedding_attempts SMALLINT NOT NULL DEFAULT 0;",
+        f"ALTER TABLE {MESSAGES_TABLE} ADD COLUMN IF NOT EXISTS embedding_claimed_at TIMESTAMPTZ;",
+        f"CREATE INDEX IF NOT EXISTS idx_{MESSAGES_TABLE}_pending_embedding ON {MESSAGES_TABLE} (embedding_attempts, id) WHERE embedding IS NULL;",
+    ]),
+]
+
+def get_applied_versions(conn: psycopg2.extensions.connection) -> Set[int]:
+    """Returns the migration versions already applied, creating the tracking table if needed."""
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL(f"""
+            CREATE TABLE IF NOT EXISTS {SCHEMA_MIGRATIONS_TABLE} (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+            );
+        """))
+        cur.execute(sql.SQL(f"SELECT version FROM {SCHEMA_MIGRATIONS_TABLE};"))
+        versions = {row[0] for row in cur.fetchall()}
+    conn.commit()
+    return versions
+
+def migrate(conn: psycopg2.extensions.connection) -> int:
+    """Applies pending migrations in order, each in its own transaction. Returns how many were applied."""
+    applied = get_applied_versions(conn)
+    count = 0
+    for version, description, statements in MIGRATIONS:
+        if version in applied:
+            continue
+        try:
+            with conn.cursor() as cur:
+                for statement in statements:
+                    cur.execute(statement)
+                cur.execute(
+                    sql.SQL(f"INSERT INTO {SCHEMA_MIGRATIONS_TABLE} (version, description) VALUES (%s, %s);"),
+                    (version, description)
+                )
+            conn.commit()
+            count += 1
+            logger.info(f"Applied migration {version}: {description}")
+        except psycopg2.Error as e:
+            conn.rollback()
+            logger.error(f"Error applying migration {version} ({description}): {e}")
+            raise
+    return count
+
+def ensure_vector_indexes(conn: psycopg2.extensions.connection):
+    """Creates the ANN indexes for the current vector configuration if they do not exist yet."""
+    with conn.cursor() as cur:
+        for table_name in (MESSAGES_TABLE, DOCUMENTS_TABLE):
+            cur.execute(vector_index_sql(table_name))
+        cur.execute(vector_index_sql(SEMANTIC_CACHE_TABLE, "query_embedding"))
+    conn.commit()
+
+if __name__ == "__main__":
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    with get_db_connection() as conn:
+        if not conn:
+            raise SystemExit("Error connecting to database.")
+        if command == "migrate":
+            applied_count = migrate(conn)
+            print(f"Applied {applied_count} migration(s).")
+        elif command == "ensure-vector-indexes":
+            ensure_vector_indexes(conn)
+            print("Vector indexes are in place.")
+        else:
+            raise SystemExit(f"Unknown command '{command}'. Use 'migrate' or 'ensure-vector-indexes'.")
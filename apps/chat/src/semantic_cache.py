@@ -0,0 +1,154 @@
+import hashlib
+import logging
+import threading
+import time
+import numpy as np
+import psycopg2
+from psycopg2 import sql
+from typing import Dict, List, Optional
+
+from tracing import traced
+from db_handler import VECTOR_DISTANCE_OPERATOR, VECTOR_PARAM_SQL, VECTOR_DISTANCE_METRIC, vector_column_sql, vector_search_settings_sql
+from config import (
+    SEMANTIC_CACHE_SIMILARITY_THRESHOLD,
+    SEMANTIC_CACHE_TTL_SECONDS,
+    SEMANTIC_CACHE_MAX_ENTRIES_PER_TENANT,
+)
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_TABLE = "semantic_cache"
+
+_metrics_lock = threading.Lock()
+_metrics: Dict[str, float] = {"lookups": 0, "hits": 0, "misses": 0, "stores": 0, "evictions": 0, "lookup_ms_total": 0.0}
+
+def get_semantic_cache_metrics() -> Dict[str, float]:
+    """Returns the cache counters plus hit rate and mean lookup latency."""
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    lookups = metrics["lookups"] or 1
+    metrics["hit_rate"] = metrics["hits"] / lookups
+    metrics["mean_lookup_ms"] = metrics["lookup_ms_total"] / lookups
+    return metrics
+
+def _record(**increments):
+    with _metrics_lock:
+        for key, value in increments.items():
+            _metrics[key] += value
+
+def distance_to_similarity(distance: float) -> float:
+    """Converts a pgvector distance for VECTOR_DISTANCE_METRIC into cosine similarity of normalized vectors."""
+    if VECTOR_DISTANCE_METRIC == "inner_product":
+        return -distance  # <#> returns the negative inner product
+    if VECTOR_DISTANCE_METRIC == "cosine":
+        return 1.0 - distance
+    return 1.0 - distance * distance / 2.0
+
+def context_hash(history: List[str], summary: Optional[str], relevant_history: Optional[str], scope: Optional[List[str]] = None) -> str:
+    """
+    Hashes everything besides the query that goes into the prompt: the summary, the relevant
+    history and the whole history window, whitespace- and case-normalized, so an answer is only
+    reused for the same prompt context. First turns without retrieved context share a hash,
+    which is what makes cross-user hits possible. scope adds keys that are hashed verbatim,
+    such as the user ID (user IDs that differ only in case are different users).
+    """
+    parts = [summary or "", relevant_history or ""] + history
+    normalized = "\x1f".join(" ".join(part.lower().split()) for part in parts)
+    if scope is not None:
+        normalized += "\x1e" + "\x1f".join(scope)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+@traced("db.semantic_cache_lookup")
+def lookup_cached_response(conn: psycopg2.extensions.connection, tenant_id: str, context_key: str, query_embedding: np.ndarray) -> Optional[Dict]:
+    """Returns the nearest live cache entry for the tenant and context if it is similar enough, else None."""
+    started_at = time.perf_counter()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(f"""
+                    {vector_search_settings_sql()}
+                    SELECT id, response, {vector_column_sql("query_embedding")} {VECTOR_DISTANCE_OPERATOR} {VECTOR_PARAM_SQL} AS distance
+                    FROM {SEMANTIC_CACHE_TABLE}
+                    WHERE tenant_id = %s
+                      AND context_hash = %s
+                      AND created_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+                    ORDER BY {vector_column_sql("query_embedding")} {VECTOR_DISTANCE_OPERATOR} {VECTOR_PARAM_SQL}
+                    LIMIT 1
+                """),
+                (query_embedding, tenant_id, context_key, SEMANTIC_CACHE_TTL_SECONDS, query_embedding)
+            )
+            row = cur.fetchone()
+    except psycopg2.Error as e:
+        conn.rollback()
+        logger.error(f"Error looking up semantic cache: {e}")
+        return None
+    finally:
+        _record(lookups=1, lookup_ms_total=(time.perf_counter() - started_at) * 1000)
+
+    if row is None or distance_to_similarity(row[2]) < SEMANTIC_CACHE_SIMILARITY_THRESHOLD:
+        _record(misses=1)
+        return None
+    _record(hits=1)
+    return {"id": row[0], "response": row[1], "similarity": distance_to_similarity(row[2])}
+
+def record_cache_hit(conn: psycopg2.extensions.connection, entry_id: int):
+    """Bumps the hit statistics used for size-based eviction."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(f"UPDATE {SEMANTIC_CACHE_TABLE} SET hit_count = hit_count + 1, last_hit_at = CURRENT_TIMESTAMP WHERE id = %s;"),
+                (entry_id,)
+            )
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        logger.error(f"Error recording semantic cache hit: {e}")
+
+def store_cached_response(conn: psycopg2.extensions.connection, tenant_id: str, context_key: str, query_text: str, query_embedding: np.ndarray, response: str) -> bool:
+    """Stores a generated response and evicts expired and surplus entries of the tenant."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(f"""
+                    INSERT INTO {SEMANTIC_CACHE_TABLE} (tenant_id, context_hash, query_text, query_embedding, response)
+                    VALUES (%s, %s, %s, %s, %s);
+                """),
+                (tenant_id, context_key, query_text, query_embedding, response)
+            )
+        conn.commit()
+        _record(stores=1)
+    except psycopg2.Error as e:
+        conn.rollback()
+        logger.error(f"Error storing semantic cache entry: {e}")
+        return False
+    evict_cache_entries(conn, tenant_id)
+    return True
+
+def evict_cache_entries(conn: psycopg2.extensions.connection, tenant_id: str) -> int:
+    """Deletes the tenant's expired entries and the least recently hit ones beyond the size limit."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(f"""
+                    DELETE FROM {SEMANTIC_CACHE_TABLE}
+                    WHERE tenant_id = %s
+                      AND (
+                          created_at <= CURRENT_TIMESTAMP - make_interval(secs => %s)
+                          OR id IN (
+                              SELECT id FROM {SEMANTIC_CACHE_TABLE}
+                              WHERE tenant_id = %s
+                              ORDER BY last_hit_at DESC
+                              OFFSET %s
+                          )
+                      );
+                """),
+                (tenant_id, SEMANTIC_CACHE_TTL_SECONDS, tenant_id, SEMANTIC_CACHE_MAX_ENTRIES_PER_TENANT)
+            )
+            evicted = cur.rowcount
+        conn.commit()
+        _record(evictions=evicted)
+        return evicted
+    except psycopg2.Error as e:
+        conn.rollback()
+        logger.error(f"Error evicting semantic cache entries for tenant {tenant_id}: {e}")
+        return 0
@@ -0,0 +1,183 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from config import TRACING_ENABLED, TRACE_SAMPLE_RATE, TRACE_PERCENTILE_WINDOW, DEBUG_STATE_SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+class Span:
+    """One timed operation in a request's span tree."""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_span_id", "start_ns", "end_ns", "attributes", "children")
+
+    def __init__(self, name: str, trace_id: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent.span_id if parent else None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.children: List["Span"] = []
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        """OpenTelemetry-style span fields, with children nested to keep the tree in one log line."""
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+# Recent durations per span name, for in-process percentiles
+_durations_lock = threading.Lock()
+_durations: Dict[str, Deque[float]] = {}
+
+class _NoopSpan:
+    """Returned when tracing is off or the request is not sampled; every operation is free."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class _ActiveSpan:
+    __slots__ = ("span", "token")
+
+    def __init__(self, span: Span):
+        self.span = span
+        self.token = None
+
+    def __enter__(self):
+        self.token = _current_span.set(self.span)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.end_ns = time.time_ns()
+        if exc_type is not None:
+            self.span.attributes["error"] = repr(exc)
+        _current_span.reset(self.token)
+        _record_duration(self.span.name, self.span.duration_ms)
+        if self.span.parent_span_id is None:
+            logger.info(json.dumps({"trace": self.span.to_dict()}, default=str))
+        return False
+
+    def set(self, **attributes):
+        self.span.attributes.update(attributes)
+
+def _record_duration(name: str, duration_ms: float):
+    with _durations_lock:
+        window = _durations.get(name)
+        if window is None:
+            window = _durations[name] = deque(maxlen=TRACE_PERCENTILE_WINDOW)
+        window.append(duration_ms)
+
+def start_trace(name: str, **attributes):
+    """Opens the root span of a request. The span tree is logged as one JSON line when it closes."""
+    if not TRACING_ENABLED or random.random() >= TRACE_SAMPLE_RATE:
+        return _NOOP_SPAN
+    return _ActiveSpan(Span(name, os.urandom(16).hex(), None, attributes))
+
+def span(name: str, **attributes):
+    """Opens a child span of the current one; a no-op outside a sampled trace."""
+    parent = _current_span.get()
+    if parent is None:
+        return _NOOP_SPAN
+    child = Span(name, parent.trace_id, parent, attributes)
+    parent.children.append(child)
+    return _ActiveSpan(child)
+
+def set_attributes(**attributes):
+    """Adds attributes such as row counts or payload sizes to the current span."""
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+def traced(name: str) -> Callable:
+    """Decorator that records each call of an external dependency as a span."""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def summarize_state(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Cheap, bounded description of graph state for debug logs (no history or connection dumps)."""
+    summary = {}
+    for key, value in state.items():
+        if key == "db_connection":
+            continue
+        if isinstance(value, (list, tuple)):
+            summary[key] = f"<{len(value)} items>"
+        elif isinstance(value, str):
+            summary[key] = value if len(value) <= 80 else f"{value[:77]}..."
+        elif isinstance(value, dict):
+            summary[key] = summarize_state(value)
+        elif hasattr(value, "shape"):
+            summary[key] = f"<vector {getattr(value, 'shape')}>"
+        elif value is None or isinstance(value, (bool, int, float)):
+            summary[key] = value
+        else:
+            summary[key] = f"<{type(value).__name__}>"
+    return summary
+
+def trace_node(name: str, fn: Callable) -> Callable:
+    """Wraps a graph node with a span and sampled debug logging of its input state."""
+    @functools.wraps(fn)
+    def wrapper(state):
+        if logger.isEnabledFor(logging.DEBUG) and random.random() < DEBUG_STATE_SAMPLE_RATE:
+            logger.debug("node %s state: %s", name, summarize_state(state))
+        if _current_span.get() is None:
+            return fn(state)
+        with span(f"node.{name}") as node_span:
+            update = fn(state)
+            if isinstance(update, dict):
+                node_span.set(updated_keys=sorted(update))
+            return update
+    return wrapper
+
+def _percentile(ordered: List[float], pct: float) -> float:
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def get_latency_percentiles() -> Dict[str, Dict[str, float]]:
+    """Returns count and p50/p95/p99 (ms) of recent durations per span name."""
+    with _durations_lock:
+        snapshot = {name: sorted(window) for name, window in _durations.items() if window}
+    return {
+        name: {
+            "count": len(values),
+            "p50": round(_percentile(values, 50), 3),
+            "p95": round(_percentile(values, 95), 3),
+            "p99": round(_percentile(values, 99), 3),
+        }
+        for name, values in snapshot.items()
+    }
@@ -1,21 +1,69 @@
+from __future__ import annotations
+
 import os
+import asyncio
 import contextlib
-import boto3
+import contextvars
+import functools
+import importlib.util
+import sys
+import threading
+import types
+from concurrent.futures import Future, ThreadPoolExecutor
+import time
 import json
-import psycopg2
 import logging
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 
+from tracing import traced, set_attributes
 from config import (
     AWS_PROFILE,
     AWS_CURRENT_REGION,
     AWS_BEDROCK_REGION,
     AWS_RDS_CREDENTIALS_AND_CONFIG_ARN,
+    AWS_RDS_SECRET_TTL_SECONDS,
+    HISTORY_CHARS_PER_TOKEN,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MAX_CONNECTION_AGE_SECONDS,
+    DB_POOL_PING_INTERVAL_SECONDS,
+    DB_POOL_ACQUIRE_TIMEOUT_SECONDS,
+    ASYNC_IO_MAX_WORKERS,
+    HNSW_ITERATIVE_SCAN,
 )
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s')
 logger = logging.getLogger(__name__)
 
+class _LazyModule(types.ModuleType):
+    """
+    Stands in for a module until its first attribute access, which imports it through the
+    regular import system. Unlike importlib.util.LazyLoader (before Python 3.12), this is safe
+    when several threads touch the module first at the same time: the import lock makes
+    them wait for the one import in progress. Attributes are always read from the real
+    module, so later changes to it (e.g. patching in tests) are seen.
+    """
+
+    def __getattr__(self, attr):
+        module = self.__dict__.get("_lazy_module")
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__["_lazy_module"] = module
+        return getattr(module, attr)
+
+def lazy_import(name: str):
+    """
+    Returns a top-level module that is only executed on first attribute access, keeping
+    heavy dependencies out of the Lambda cold-start import path.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    if importlib.util.find_spec(name) is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    return _LazyModule(name)
+
+boto3 = lazy_import("boto3")
+psycopg2 = lazy_import("psycopg2")
+
 def get_aws_session(region_name: str = None, profile_name: str = None):
     """Creates an AWS session."""
     if profile_name:
@@ -23,18 +71,28 @@ def get_aws_session(region_name: str = None, profile_name: str = None):
     return boto3.Session(region_name=region_name)
 
 def get_bedrock_client():
-    """Initializes and returns the Bedrock client."""
+    """
+    Initializes and returns the Bedrock client: tuned connection pool and adaptive retries,
+    wrapped so invocations share the per-model rate limiters and circuit breakers.
+    """
+    from bedrock_client import ManagedBedrockClient, build_bedrock_config
+
     try:
         session = get_aws_session(region_name=AWS_BEDROCK_REGION)
         # session = get_aws_session(region_name=AWS_BEDROCK_REGION, profile_name=AWS_PROFILE)
-        client = session.client(service_name="bedrock-runtime")
+        client = ManagedBedrockClient(session.client(service_name="bedrock-runtime", config=build_bedrock_config()))
         logger.info("Successfully initialized Bedrock client.")
         return client
     except Exception as e:
         logger.error(f"Error initializing Bedrock client: {e}")
         return None
 
-def get_rds_config() -> Dict[str, str]:
+# Cached RDS secret, shared by every connection opened by this process.
+_rds_config_cache: Dict[str, object] = {"value": None, "fetched_at": 0.0}
+_rds_config_lock = threading.Lock()
+
+@traced("secretsmanager.get_secret_value")
+def _fetch_rds_config() -> Dict[str, str]:
     """Retrieves RDS configuration from AWS Secrets Manager."""
     try:
         session = get_aws_session(region_name=AWS_CURRENT_REGION)
@@ -48,25 +106,98 @@ def get_rds_config() -> Dict[str, str]:
         logger.error(f"Error retrieving secret '{AWS_RDS_CREDENTIALS_AND_CONFIG_ARN}': {e}")
         return {}
 
+def get_rds_config(force_refresh: bool = False) -> Dict[str, str]:
+    """
+    Returns the RDS configuration, served from an in-process cache for
+    AWS_RDS_SECRET_TTL_SECONDS. A stale value is kept if a refresh fails.
+    """
+    with _rds_config_lock:
+        cached = _rds_config_cache["value"]
+        age = time.monotonic() - _rds_config_cache["fetched_at"]
+        if cached and not force_refresh and age < AWS_RDS_SECRET_TTL_SECONDS:
+            return cached
+        rds_config = _fetch_rds_config()
+        if rds_config:
+            _rds_config_cache.update(value=rds_config, fetched_at=time.monotonic())
+            _pool_metrics["secret_fetches"] += 1
+            return rds_config
+        return cached or {}
+
+def _is_auth_failure(error: psycopg2.Error) -> bool:
+    """Checks whether a connection error was caused by rejected (e.g. rotated) credentials."""
+    return error.pgcode == "28P01" or "password authentication failed" in str(error)
+
+def _open_connection(rds_config: Dict[str, str]) -> psycopg2.extensions.connection:
+    conn = psycopg2.connect(
+        host=rds_config.get('rds_host'),
+        port=rds_config.get('rds_port'),
+        database=rds_config.get('rds_vectordb'),
+        user=rds_config.get('rds_username'),
+        password=rds_config.get('rds_password')
+    )
+    _register_vector_types(conn)
+    return conn
+
+# Installed pgvector version, read from the first connection that has the extension
+_pgvector_version: Optional[Tuple[int, ...]] = None
+
+def pgvector_supports_iterative_scan() -> bool:
+    """Whether the database's pgvector (0.8 or later) has the hnsw.iterative_scan setting."""
+    return _pgvector_version is not None and _pgvector_version >= (0, 8)
+
+def _detect_pgvector_version(conn: psycopg2.extensions.connection):
+    global _pgvector_version
+    with conn.cursor() as cur:
+        cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector';")
+        row = cur.fetchone()
+    conn.commit()
+    if row:
+        _pgvector_version = tuple(int(part) for part in row[0].split(".") if part.isdigit())
+        if HNSW_ITERATIVE_SCAN != "off" and not pgvector_supports_iterative_scan():
+            logger.warning(f"pgvector {row[0]} has no hnsw.iterative_scan; HNSW_ITERATIVE_SCAN={HNSW_ITERATIVE_SCAN} is ignored.")
+
+def _register_vector_types(conn: psycopg2.extensions.connection):
+    """
+    Registers pgvector's psycopg2 adapters so float32 NumPy arrays are sent as vector literals
+    and vector/halfvec columns are read back as NumPy arrays instead of lists of Python floats.
+    The first connection also records the pgvector version.
+    """
+    from pgvector.psycopg2 import register_vector
+
+    try:
+        register_vector(conn)
+        conn.commit()
+        if _pgvector_version is None:
+            _detect_pgvector_version(conn)
+    except psycopg2.ProgrammingError as e:
+        # The extension is created by the first migration; schema.py connects before it exists.
+        conn.rollback()
+        logger.warning(f"pgvector types not registered on this connection: {e}")
+
+@traced("db.connect")
 def connect_db() -> Optional[psycopg2.extensions.connection]:
-    """Connects to AWS RDS PostgreSQL."""
+    """Connects to AWS RDS PostgreSQL, refreshing the cached secret once on authentication failure."""
     rds_config = get_rds_config()
     if not rds_config:
         logger.error("RDS configuration not available.")
         return None
     try:
-        conn = psycopg2.connect(
-            host=rds_config.get('rds_host'),
-            port=rds_config.get('rds_port'),
-            database=rds_config.get('rds_vectordb'),
-            user=rds_config.get('rds_username'),
-            password=rds_config.get('rds_password')
-        )
-        logger.info("Successfully connected to RDS PostgreSQL.")
-        return conn
+        conn = _open_connection(rds_config)
+    except psycopg2.OperationalError as e:
+        if not _is_auth_failure(e):
+            logger.error(f"Error connecting to RDS PostgreSQL: {e}")
+            return None
+        logger.warning("RDS authentication failed. Refreshing credentials from Secrets Manager and retrying.")
+        try:
+            conn = _open_connection(get_rds_config(force_refresh=True))
+        except psycopg2.Error as retry_error:
+            logger.error(f"Error connecting to RDS PostgreSQL after credential refresh: {retry_error}")
+            return None
     except psycopg2.Error as e:
         logger.error(f"Error connecting to RDS PostgreSQL: {e}")
         return None
+    logger.info("Successfully connected to RDS PostgreSQL.")
+    return conn
 
 def close_db(conn: Optional[psycopg2.extensions.connection]):
     """Closes the database connection."""
@@ -74,11 +205,221 @@ def close_db(conn: Optional[psycopg2.extensions.connection]):
         conn.close()
         logger.info("Database connection closed.")
 
+# --- Process-level connection pool, reused across warm Lambda invocations ---
+_pool_metrics: Dict[str, int] = {
+    "hits": 0,
+    "misses": 0,
+    "reconnects": 0,
+    "recycled": 0,
+    "discarded": 0,
+    "timeouts": 0,
+    "secret_fetches": 0,
+}
+
+class ConnectionPool:
+    """
+    A small, thread-safe pool of RDS connections.
+    Idle connections are pinged before reuse once they have been idle longer than
+    ping_interval, recycled after max_age, and replaced if found broken.
+    """
+
+    def __init__(self, max_size: int, max_age: float, ping_interval: float, acquire_timeout: float):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.ping_interval = ping_interval
+        self.acquire_timeout = acquire_timeout
+        self._idle: List[Tuple[psycopg2.extensions.connection, float]] = []
+        self._created_at: Dict[int, float] = {}
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+    def _is_usable(self, conn: psycopg2.extensions.connection, last_used_at: float) -> bool:
+        """Checks age and liveness of an idle connection; runs outside the pool lock."""
+        if conn.closed:
+            return False
+        if time.monotonic() - self._created_at.get(id(conn), 0.0) > self.max_age:
+            with self._cond:
+                _pool_metrics["recycled"] += 1
+            return False
+        if time.monotonic() - last_used_at < self.ping_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            logger.warning(f"Pooled connection failed liveness check, reconnecting: {e}")
+            with self._cond:
+                _pool_metrics["reconnects"] += 1
+            return False
+
+    def _discard(self, conn: psycopg2.extensions.connection):
+        self._created_at.pop(id(conn), None)
+        try:
+            close_db(conn)
+        except psycopg2.Error as e:
+            logger.warning(f"Error closing discarded connection: {e}")
+
+    @traced("db.pool.acquire")
+    def acquire(self) -> Optional[psycopg2.extensions.connection]:
+        """Borrows a healthy connection, opening a new one if none is idle. Returns None on failure."""
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            with self._cond:
+                while not self._idle and self._in_use >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        _pool_metrics["timeouts"] += 1
+                        logger.error("Timed out waiting for a pooled database connection.")
+                        return None
+                    self._cond.wait(remaining)
+                self._in_use += 1
+                candidate = self._idle.pop() if self._idle else None
+
+            if candidate is None:
+                conn = connect_db()
+                with self._cond:
+                    _pool_metrics["misses"] += 1
+                    if conn is None:
+                        self._in_use -= 1
+                        self._cond.notify()
+                        return None
+                    self._created_at[id(conn)] = time.monotonic()
+                return conn
+
+            conn, last_used_at = candidate
+            if self._is_usable(conn, last_used_at):
+                with self._cond:
+                    _pool_metrics["hits"] += 1
+                set_attributes(pool_hit=True)
+                return conn
+            self._discard(conn)
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+
+    def release(self, conn: Optional[psycopg2.extensions.connection]):
+        """Returns a borrowed connection, rolling back any open transaction first."""
+        if conn is None:
+            return
+        keep = not conn.closed
+        if keep:
+            status = conn.get_transaction_status()
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                keep = False
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error as e:
+                    logger.warning(f"Error resetting pooled connection: {e}")
+                    keep = False
+        with self._cond:
+            self._in_use -= 1
+            if keep:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                _pool_metrics["discarded"] += 1
+            self._cond.notify()
+        if not keep:
+            self._discard(conn)
+
+    def close(self):
+        """Closes every idle connection."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+_connection_pool: Optional[ConnectionPool] = None
+_connection_pool_lock = threading.Lock()
+
+def get_connection_pool() -> ConnectionPool:
+    """Returns the process-wide connection pool, creating it on first use."""
+    global _connection_pool
+    with _connection_pool_lock:
+        if _connection_pool is None:
+            _connection_pool = ConnectionPool(
+                max_size=DB_POOL_MAX_SIZE,
+                max_age=DB_POOL_MAX_CONNECTION_AGE_SECONDS,
+                ping_interval=DB_POOL_PING_INTERVAL_SECONDS,
+                acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT_SECONDS,
+            )
+        return _connection_pool
+
+def get_pool_metrics() -> Dict[str, int]:
+    """Returns a snapshot of the connection pool and secret cache counters."""
+    with get_connection_pool()._cond:
+        return dict(_pool_metrics)
+
 @contextlib.contextmanager
 def get_db_connection():
-    """Context manager for database connections."""
-    conn = connect_db()
+    """Context manager that borrows a connection from the process-level pool."""
+    pool = get_connection_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+# --- Background work that must not delay the response ---
+_background_executor: Optional[ThreadPoolExecutor] = None
+_background_executor_lock = threading.Lock()
+
+def run_in_background(fn, *args, **kwargs) -> Future:
+    """
+    Runs fn on a single process-level worker thread.
+    On Lambda the worker is frozen between invocations and resumes on the next one,
+    so background jobs must be safe to interrupt and re-run.
+    """
+    global _background_executor
+    with _background_executor_lock:
+        if _background_executor is None:
+            _background_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="background")
+    return _background_executor.submit(fn, *args, **kwargs)
+
+# --- Blocking I/O offloaded from the asyncio path ---
+_io_executor: Optional[ThreadPoolExecutor] = None
+_io_executor_lock = threading.Lock()
+
+def get_io_executor() -> ThreadPoolExecutor:
+    """Returns the process-level executor that runs psycopg2 and boto3 calls for async callers."""
+    global _io_executor
+    with _io_executor_lock:
+        if _io_executor is None:
+            _io_executor = ThreadPoolExecutor(max_workers=ASYNC_IO_MAX_WORKERS, thread_name_prefix="io")
+    return _io_executor
+
+async def run_blocking(fn, *args, **kwargs):
+    """
+    Awaits a blocking call on the I/O executor without blocking the event loop.
+    The caller's context is copied so tracing spans nest under the awaiting coroutine.
+    """
+    call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(get_io_executor(), call)
+
+@contextlib.asynccontextmanager
+async def get_async_db_connection():
+    """Async context manager that borrows a connection from the process-level pool."""
+    pool = get_connection_pool()
+    conn = await run_blocking(pool.acquire)
     try:
         yield conn
     finally:
-        close_db(conn)
\ No newline at end of file
+        await run_blocking(pool.release, conn)
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate used for prompt budgeting; avoids loading a tokenizer."""
+    return len(text) // HISTORY_CHARS_PER_TOKEN + 1
+
+def trim_to_token_budget(messages: List[Dict[str, str]], max_tokens: int) -> List[Dict[str, str]]:
+    """Keeps the newest messages whose estimated token count fits into max_tokens (0 keeps all)."""
+    if max_tokens <= 0:
+        return messages
+    kept, used = [], 0
+    for message in reversed(messages):
+        used += estimate_tokens(message["content"])
+        if used > max_tokens:
+            break
+        kept.append(message)
+    return kept[::-1]
\ No newline at end of file
@@ -0,0 +1,57 @@
+import argparse
+import asyncio
+import json
+import logging
+
+from websockets.asyncio.server import serve
+
+from chat import stream_chat_turn
+
+logger = logging.getLogger(__name__)
+
+async def handle_connection(websocket):
+    """
+    Local development counterpart of chat.websocket_handler.
+    Each message is JSON with 'input', 'user_id' and optionally 'document_filter'; the
+    conversation is kept per connection until a message sets 'new_conversation'.
+    """
+    loop = asyncio.get_running_loop()
+    conversation_id = None
+    async for raw_message in websocket:
+        try:
+            request = json.loads(raw_message)
+        except json.JSONDecodeError:
+            await websocket.send(json.dumps({"type": "error", "error": "Message must be JSON."}))
+            continue
+
+        new_conversation = bool(request.get("new_conversation", False))
+        if new_conversation:
+            conversation_id = None
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def produce():
+            # The graph is synchronous, so it runs on a worker thread and hands events to the loop.
+            try:
+                for event in stream_chat_turn(request.get("input"), request.get("user_id", "default_user"), conversation_id, request.get("tenant_id", "default"), new_conversation, request.get("document_filter")):
+                    loop.call_soon_threadsafe(queue.put_nowait, event)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, None)
+
+        producer = loop.run_in_executor(None, produce)
+        while (event := await queue.get()) is not None:
+            if event["type"] == "end" and event.get("conversation_id") is not None:
+                conversation_id = event["conversation_id"]
+            await websocket.send(json.dumps(event))
+        await producer
+
+async def main(host: str, port: int):
+    async with serve(handle_connection, host, port) as server:
+        logger.info(f"Streaming chat server listening on ws://{host}:{port}")
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local WebSocket server that streams chat responses.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    asyncio.run(main(args.host, args.port))
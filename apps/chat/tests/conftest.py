@@ -0,0 +1,56 @@
+"""
+Shared fixtures. Tests run without AWS or Postgres: Bedrock is the deterministic fake from
+scripts/fake_bedrock.py and the database is the in-memory store from scripts/memory_store.py.
+"""
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(TESTS_DIR, "..", "src")
+SCRIPTS_DIR = os.path.join(TESTS_DIR, "..", "scripts")
+sys.path[:0] = [SRC_DIR, SCRIPTS_DIR]
+
+# Model IDs only select the request format; nothing is sent to AWS.
+os.environ.setdefault("AWS_BEDROCK_LLM_ID", "anthropic.claude-3-haiku-20240307-v1:0")
+os.environ.setdefault("AWS_BEDROCK_EMBEDDING_MODEL_ID", "amazon.titan-embed-text-v2:0")
+os.environ.setdefault("AWS_CURRENT_REGION", "us-east-1")
+os.environ.setdefault("AWS_BEDROCK_REGION", "us-east-1")
+
+@pytest.fixture
+def drain_background_work():
+    """Returns a function that waits until the background worker has run everything queued so far."""
+    import utils
+
+    def drain():
+        # The background executor has a single worker, so this runs after everything queued before it.
+        utils.run_in_background(lambda: None).result(timeout=30)
+    return drain
+
+@pytest.fixture
+def chat_module():
+    import chat
+    return chat
+
+@pytest.fixture
+def fake_bedrock(monkeypatch, chat_module):
+    """A zero-latency fake Bedrock client behind the managed client layer, used by the chat module."""
+    from bedrock_client import ManagedBedrockClient
+    from fake_bedrock import FakeBedrockRuntimeClient
+
+    bedrock = FakeBedrockRuntimeClient(embedding_latency_ms=0, llm_latency_ms=0, llm_first_token_ms=0)
+    managed = ManagedBedrockClient(bedrock)
+    monkeypatch.setattr(chat_module, "get_bedrock_client", lambda: managed)
+    monkeypatch.setattr(chat_module, "_bedrock_client", None)
+    monkeypatch.setattr(chat_module, "_llm", None)
+    return bedrock
+
+@pytest.fixture
+def memory_store(monkeypatch, chat_module, fake_bedrock):
+    """The in-memory store, installed for the duration of the test."""
+    from memory_store import InMemoryStore
+
+    store = InMemoryStore()
+    store.install(chat_module, patch=monkeypatch.setattr)
+    return store
@@ -0,0 +1,83 @@
+import datetime
+import gzip
+import json
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+import archive
+
+class ScriptedConnection:
+    """Stands in for a psycopg2 connection: answers each SELECT from a script and records the rest."""
+
+    def __init__(self, results):
+        self.results = list(results)
+        self.statements = []
+        self.commits = self.rollbacks = 0
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, query, params=None):
+        self.statements.append(" ".join(getattr(query, "string", query).split()))
+
+    def fetchone(self):
+        return self.results.pop(0)
+
+    def fetchall(self):
+        return self.results.pop(0)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+class FailingStore:
+    def put(self, key, data):
+        raise ClientError({"Error": {"Code": "SlowDown", "Message": "Please reduce your request rate."}}, "PutObject")
+
+    def get(self, key):
+        raise EndpointConnectionError(endpoint_url="https://s3.example.invalid")
+
+MESSAGES = [
+    (11, "user", "Hello", "human", "[0.5,0.25]", datetime.datetime(2026, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)),
+    (12, "assistant", "Hi!", "ai", None, datetime.datetime(2026, 1, 2, 3, 4, 6, tzinfo=datetime.timezone.utc)),
+]
+
+def test_archive_round_trip(monkeypatch, tmp_path):
+    store = archive.LocalArchiveStore(str(tmp_path))
+    conn = ScriptedConnection([(None,), MESSAGES])
+    assert archive.archive_conversation(conn, 7, store)
+    assert conn.commits == 1 and any(statement.startswith("DELETE FROM") for statement in conn.statements)
+    lines = gzip.decompress(store.get(archive.archive_key(7))).decode("utf-8").splitlines()
+    assert [json.loads(line)["id"] for line in lines] == [11, 12]
+
+    inserted = []
+    monkeypatch.setattr(archive, "execute_values", lambda cur, query, rows, template=None: inserted.extend(rows))
+    conn = ScriptedConnection([(archive.archive_key(7),)])
+    assert archive.rehydrate_conversation(conn, 7, store)
+    assert [(row[0], row[2], row[3]) for row in inserted] == [(11, "user", "Hello"), (12, "assistant", "Hi!")]
+    assert inserted[0][5].tolist() == [0.5, 0.25] and inserted[1][5] is None
+    assert inserted[0][6] == MESSAGES[0][5].isoformat()
+
+def test_store_failures_keep_the_conversation_in_the_database():
+    conn = ScriptedConnection([(None,), MESSAGES])
+    assert not archive.archive_conversation(conn, 7, FailingStore())
+    assert conn.rollbacks == 1 and conn.commits == 0
+    assert not any(statement.startswith("DELETE FROM") for statement in conn.statements)
+
+    conn = ScriptedConnection([(archive.archive_key(7),)])
+    assert not archive.rehydrate_conversation(conn, 7, FailingStore())
+    assert conn.rollbacks == 1 and conn.commits == 0
+
+def test_retention_stops_cleanly_when_the_store_fails(monkeypatch):
+    monkeypatch.setattr(archive, "find_cold_conversations", lambda conn, older_than_days, limit: [1, 2])
+    conn = ScriptedConnection([(None,), MESSAGES, (None,), MESSAGES])
+    assert archive.run_retention(conn, older_than_days=90, batch_size=2, store=FailingStore()) == 0
+    assert conn.rollbacks == 2
@@ -0,0 +1,84 @@
+import asyncio
+import contextlib
+import threading
+
+from memory_store import InMemoryStore
+from utils import run_blocking
+
+class BoundedConnections:
+    """Lends the store as a connection at most max_size times at once, timing out like utils.ConnectionPool."""
+
+    def __init__(self, store, max_size, acquire_timeout):
+        self.store = store
+        self.acquire_timeout = acquire_timeout
+        self.timeouts = 0
+        self.in_use = 0
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def acquire(self):
+        if self._slots.acquire(timeout=self.acquire_timeout):
+            self.in_use += 1
+            return self.store
+        self.timeouts += 1
+        return None
+
+    def release(self, conn):
+        if conn is not None:
+            self.in_use -= 1
+            self._slots.release()
+
+    @contextlib.contextmanager
+    def get_db_connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextlib.asynccontextmanager
+    async def get_async_db_connection(self):
+        conn = await run_blocking(self.acquire)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+def install_bounded_pool(monkeypatch, chat_module, max_size):
+    store = InMemoryStore(round_trip_latency_ms=20)
+    store.install(chat_module, patch=monkeypatch.setattr)
+    pool = BoundedConnections(store, max_size=max_size, acquire_timeout=1.0)
+    monkeypatch.setattr(chat_module, "get_db_connection", pool.get_db_connection)
+    monkeypatch.setattr(chat_module, "get_async_db_connection", pool.get_async_db_connection)
+    monkeypatch.setattr(chat_module, "DB_POOL_MAX_SIZE", max_size)
+    return store, pool
+
+def test_concurrent_async_turns_leave_room_for_the_background_worker(monkeypatch, chat_module, fake_bedrock, drain_background_work):
+    _, pool = install_bounded_pool(monkeypatch, chat_module, max_size=4)
+    monkeypatch.setattr(chat_module, "WRITE_BEHIND_ENABLED", True)
+
+    async def run_turns():
+        return await asyncio.gather(*(
+            chat_module.async_handler({"input": f"Question from user {index}", "user_id": f"async-user-{index}"})
+            for index in range(8)
+        ))
+
+    results = asyncio.run(run_turns())
+    drain_background_work()
+    assert all(isinstance(result["response"], str) for result in results), results
+    assert pool.timeouts == 0
+
+def test_backfill_does_not_hold_a_connection_while_embedding(monkeypatch, chat_module, fake_bedrock):
+    store, pool = install_bounded_pool(monkeypatch, chat_module, max_size=5)
+    conversation_id = store.create_conversation(None, "backfill-user")
+    store.save_messages(None, conversation_id, [("assistant", f"Answer {index}", None) for index in range(3)])
+    connections_while_embedding = []
+    invoke_model = fake_bedrock.invoke_model
+
+    def recording_invoke(**kwargs):
+        connections_while_embedding.append(pool.in_use)
+        return invoke_model(**kwargs)
+    monkeypatch.setattr(fake_bedrock, "invoke_model", recording_invoke)
+
+    chat_module.backfill_pending_embeddings()
+    assert connections_while_embedding == [0, 0, 0]
+    assert all(message["embedding"] is not None for message in store._conversation_messages(conversation_id))
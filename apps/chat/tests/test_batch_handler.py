@@ -0,0 +1,87 @@
+import json
+import uuid
+
+import pytest
+from botocore.exceptions import ClientError
+
+@pytest.fixture
+def failing_llm(fake_bedrock):
+    """Throttles every completion whose prompt contains 'please fail'; embeddings still work."""
+    invoke_model = fake_bedrock.invoke_model
+
+    def invoke(body, modelId, **kwargs):
+        if "inputText" not in json.loads(body) and "please fail" in body:
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, "InvokeModel")
+        return invoke_model(body=body, modelId=modelId, **kwargs)
+    fake_bedrock.invoke_model = invoke
+    return fake_bedrock
+
+def users(count):
+    return [f"batch-{uuid.uuid4().hex[:8]}-{index}" for index in range(count)]
+
+def saved_turns(memory_store, user_id):
+    return [
+        (message["role"], message["content"])
+        for conversation_id, conversation in memory_store.conversations.items() if conversation["user_id"] == user_id
+        for message in memory_store._conversation_messages(conversation_id)
+    ]
+
+def test_turns_of_one_user_run_in_order_on_one_conversation(chat_module, memory_store):
+    user_id, = users(1)
+    questions = [f"Question {turn}" for turn in range(4)]
+    result = chat_module.batch_handler({"events": [{"id": f"q{turn}", "input": question, "user_id": user_id} for turn, question in enumerate(questions)]}, None)
+
+    assert result["batchItemFailures"] == []
+    conversation_ids = {result["responses"][f"q{turn}"]["conversation_id"] for turn in range(4)}
+    assert len(conversation_ids) == 1
+    assert [content for role, content in saved_turns(memory_store, user_id) if role == "user"] == questions
+
+def test_failed_llm_call_reports_the_item_and_saves_nothing(chat_module, memory_store, failing_llm):
+    alice, bob = users(2)
+    records = [
+        {"messageId": "a1", "body": json.dumps({"input": "Hello there", "user_id": alice})},
+        {"messageId": "a2", "body": json.dumps({"input": "please fail", "user_id": alice})},
+        {"messageId": "a3", "body": json.dumps({"input": "And after that?", "user_id": alice})},
+        {"messageId": "b1", "body": json.dumps({"input": "Hello there", "user_id": bob})},
+    ]
+    result = chat_module.batch_handler({"Records": records}, None)
+
+    assert sorted(failure["itemIdentifier"] for failure in result["batchItemFailures"]) == ["a2", "a3"]
+    assert [content for role, content in saved_turns(memory_store, alice) if role == "user"] == ["Hello there"]
+    assert all("error" not in content.lower() for _, content in saved_turns(memory_store, alice))
+    assert len(saved_turns(memory_store, bob)) == 2
+
+def test_malformed_items_fail_alone(chat_module, memory_store):
+    good, = users(1)
+    events = [
+        {"id": "good", "input": "Hello there", "user_id": good},
+        {"id": "no-input", "user_id": good},
+        {"id": "list-user", "input": "Hello", "user_id": ["not", "hashable"]},
+        {"id": "number-input", "input": 42, "user_id": good},
+        {"id": "dict-conversation", "input": "Hello", "user_id": good, "conversation_id": {"id": 1}},
+        {"id": "list-filter", "input": "Hello", "user_id": good, "document_filter": ["x"]},
+    ]
+    result = chat_module.batch_handler({"events": events}, None)
+
+    assert sorted(failure["itemIdentifier"] for failure in result["batchItemFailures"]) == sorted(event["id"] for event in events[1:])
+    assert isinstance(result["responses"]["good"]["response"], str)
+
+def test_an_exception_in_one_group_fails_only_that_group(monkeypatch, chat_module, memory_store):
+    healthy, broken = users(2)
+    run_chat_turn = chat_module._run_chat_turn
+
+    def run_or_raise(conn, request):
+        if request["user_id"] == broken:
+            raise RuntimeError("boom")
+        return run_chat_turn(conn, request)
+    monkeypatch.setattr(chat_module, "_run_chat_turn", run_or_raise)
+
+    events = [
+        {"id": "h1", "input": "Hello there", "user_id": healthy},
+        {"id": "x1", "input": "Hello there", "user_id": broken},
+        {"id": "x2", "input": "Again", "user_id": broken},
+    ]
+    result = chat_module.batch_handler({"events": events}, None)
+
+    assert sorted(failure["itemIdentifier"] for failure in result["batchItemFailures"]) == ["x1", "x2"]
+    assert isinstance(result["responses"]["h1"]["response"], str)
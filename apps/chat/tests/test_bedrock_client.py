@@ -0,0 +1,49 @@
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+import bedrock_client
+from bedrock_client import CircuitBreaker, ManagedBedrockClient, TokenBucket
+
+class FlakyRuntime:
+    """Throttles the first failures calls, then answers."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def invoke_model(self, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "slow down"}}, "InvokeModel")
+        return {"body": "ok"}
+
+def error_code(call):
+    with pytest.raises(ClientError) as raised:
+        call()
+    return raised.value.response["Error"]["Code"]
+
+def test_rate_limited_probe_does_not_leave_the_circuit_open(monkeypatch):
+    bucket = TokenBucket(rate=1000.0, capacity=1.0)
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.01)
+    metrics = {key: 0 for key in ("calls", "errors", "throttles", "retries", "rate_limited", "circuit_rejections", "circuit_opened", "limiter_wait_ms_total")}
+    monkeypatch.setattr(bedrock_client, "_model_state", lambda model_id: (bucket, breaker, metrics))
+    monkeypatch.setattr(bedrock_client, "BEDROCK_LIMITER_MAX_WAIT_SECONDS", 0.0)
+    runtime = FlakyRuntime(failures=1)
+    client = ManagedBedrockClient(runtime)
+    invoke = lambda: client.invoke_model(modelId="test-model", body="{}")
+
+    assert error_code(invoke) == "ThrottlingException"
+    assert metrics["circuit_opened"] == 1
+    time.sleep(0.02)
+
+    # The half-open probe is admitted by the breaker but then rejected by the empty bucket.
+    bucket.rate, bucket._tokens = 0.001, 0.0
+    assert error_code(invoke) == "ThrottlingException"
+    assert metrics["rate_limited"] == 1 and runtime.calls == 1
+
+    bucket.rate, bucket._tokens = 1000.0, 1.0
+    assert invoke() == {"body": "ok"}
+    assert metrics["circuit_rejections"] == 0
+    assert breaker.allow()
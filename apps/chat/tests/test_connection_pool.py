@@ -0,0 +1,124 @@
+import psycopg2
+import pytest
+
+import utils
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.pings = self.rollbacks = 0
+        self.broken = False
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, query, params=None):
+        if self.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.pings += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def get_transaction_status(self):
+        return self.status
+
+    def close(self):
+        self.closed = 1
+
+@pytest.fixture
+def opened(monkeypatch):
+    """Makes connect_db hand out fake connections and returns the list of those opened."""
+    connections = []
+
+    def connect():
+        connections.append(FakeConnection())
+        return connections[-1]
+    monkeypatch.setattr(utils, "connect_db", connect)
+    return connections
+
+def new_pool(max_size=2, max_age=60.0, ping_interval=60.0, acquire_timeout=0.05):
+    return utils.ConnectionPool(max_size=max_size, max_age=max_age, ping_interval=ping_interval, acquire_timeout=acquire_timeout)
+
+def test_released_connections_are_reused_after_a_rollback(opened):
+    pool = new_pool()
+    conn = pool.acquire()
+    conn.status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    pool.release(conn)
+    assert conn.rollbacks == 1
+    assert pool.acquire() is conn and len(opened) == 1
+
+def test_acquire_times_out_when_every_connection_is_borrowed(opened):
+    pool = new_pool(max_size=2)
+    first, second = pool.acquire(), pool.acquire()
+    timeouts = utils._pool_metrics["timeouts"]
+    assert pool.acquire() is None
+    assert utils._pool_metrics["timeouts"] == timeouts + 1
+    pool.release(first)
+    assert pool.acquire() is first
+
+def test_old_and_broken_connections_are_replaced(opened):
+    pool = new_pool(max_age=0.0)
+    old = pool.acquire()
+    pool.release(old)
+    assert pool.acquire() is not old and old.closed
+
+    pool = new_pool(ping_interval=0.0)
+    broken = pool.acquire()
+    pool.release(broken)
+    broken.broken = True
+    replacement = pool.acquire()
+    assert replacement is not broken and broken.closed
+    pool.release(replacement)
+    assert pool.acquire() is replacement and replacement.pings == 1
+
+@pytest.fixture
+def secrets(monkeypatch):
+    """Scripts the values returned by Secrets Manager and counts the fetches."""
+    monkeypatch.setattr(utils, "_rds_config_cache", {"value": None, "fetched_at": 0.0})
+    values, fetches = [], []
+
+    def fetch():
+        fetches.append(values[0] if values else None)
+        return values.pop(0) if values else {}
+    monkeypatch.setattr(utils, "_fetch_rds_config", fetch)
+    return values, fetches
+
+def test_secret_is_cached_until_its_ttl_expires(monkeypatch, secrets):
+    values, fetches = secrets
+    monkeypatch.setattr(utils, "AWS_RDS_SECRET_TTL_SECONDS", 60)
+    values.extend([{"rds_password": "first"}, {"rds_password": "second"}])
+    assert utils.get_rds_config() == utils.get_rds_config() == {"rds_password": "first"}
+    assert len(fetches) == 1
+
+    monkeypatch.setattr(utils, "AWS_RDS_SECRET_TTL_SECONDS", 0)
+    assert utils.get_rds_config() == {"rds_password": "second"}
+    # A failed refresh keeps serving the stale secret.
+    assert utils.get_rds_config() == {"rds_password": "second"}
+    assert len(fetches) == 3
+
+def test_rotated_password_is_refetched_once(monkeypatch, secrets):
+    values, fetches = secrets
+    monkeypatch.setattr(utils, "AWS_RDS_SECRET_TTL_SECONDS", 60)
+    values.extend([{"rds_password": "old"}, {"rds_password": "new"}])
+    attempts = []
+
+    def open_connection(rds_config):
+        attempts.append(rds_config["rds_password"])
+        if rds_config["rds_password"] == "old":
+            raise psycopg2.OperationalError('FATAL:  password authentication failed for user "chat"')
+        return FakeConnection()
+    monkeypatch.setattr(utils, "_open_connection", open_connection)
+
+    assert utils.connect_db() is not None
+    assert attempts == ["old", "new"] and len(fetches) == 2
+    assert utils.connect_db() is not None
+    assert attempts == ["old", "new", "new"] and len(fetches) == 2
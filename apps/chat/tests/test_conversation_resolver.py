@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+import conversation_resolver
+
+@pytest.fixture
+def resolver(monkeypatch):
+    """Points the resolver at scripted conversation rows and records rehydrations."""
+    conversation_resolver._conversation_cache.clear()
+    rows, rehydrated = {}, []
+    monkeypatch.setattr(conversation_resolver.db_handler, "get_conversation", lambda conn, conversation_id: rows.get(conversation_id))
+    monkeypatch.setattr(
+        conversation_resolver.db_handler, "get_latest_conversation",
+        lambda conn, user_id: max((row for row in rows.values() if row["user_id"] == user_id), key=lambda row: row["conversation_id"], default=None)
+    )
+
+    def rehydrate(conn, conversation_id):
+        rehydrated.append(conversation_id)
+        return rows[conversation_id]["rehydrates"]
+    monkeypatch.setattr(conversation_resolver.archive, "rehydrate_conversation", rehydrate)
+
+    def add(conversation_id, user_id, idle_seconds=0, archived=False, rehydrates=True):
+        rows[conversation_id] = {
+            "conversation_id": conversation_id, "user_id": user_id, "last_active_at": time.time() - idle_seconds,
+            "archived": archived, "rehydrates": rehydrates,
+        }
+    yield add, rehydrated
+    conversation_resolver._conversation_cache.clear()
+
+def resolve(user_id, conversation_id=None):
+    return conversation_resolver.resolve_conversation(None, user_id, conversation_id)
+
+def test_latest_conversation_is_cached_until_it_expires(monkeypatch, resolver):
+    add, _ = resolver
+    monkeypatch.setattr(conversation_resolver, "CONVERSATION_INACTIVITY_TIMEOUT_SECONDS", 60)
+    assert resolve("alice") == {"conversation_id": None, "source": "none"}
+    add(1, "alice")
+    assert resolve("alice") == {"conversation_id": 1, "source": "lookup"}
+    assert resolve("alice") == {"conversation_id": 1, "source": "cache"}
+    conversation_resolver._conversation_cache["alice"]["last_active_at"] -= 120
+    assert resolve("alice") == {"conversation_id": None, "source": "expired"}
+
+    conversation_resolver._conversation_cache.clear()
+    add(2, "bob", idle_seconds=120)
+    assert resolve("bob") == {"conversation_id": None, "source": "expired"}
+
+def test_archived_latest_conversation_starts_a_new_one(monkeypatch, resolver):
+    add, rehydrated = resolver
+    monkeypatch.setattr(conversation_resolver, "CONVERSATION_INACTIVITY_TIMEOUT_SECONDS", 0)
+    add(1, "alice", idle_seconds=90 * 86400, archived=True)
+    assert resolve("alice") == {"conversation_id": None, "source": "expired"}
+    assert rehydrated == []
+
+def test_archived_conversation_continued_by_id_is_rehydrated(resolver):
+    add, rehydrated = resolver
+    add(1, "alice", archived=True)
+    add(2, "alice", archived=True, rehydrates=False)
+    add(3, "bob")
+    assert resolve("alice", 1) == {"conversation_id": 1, "source": "explicit"}
+    assert resolve("alice", 2) == {"conversation_id": None, "source": "forbidden"}
+    assert resolve("alice", 3) == {"conversation_id": None, "source": "forbidden"}
+    assert rehydrated == [1, 2]
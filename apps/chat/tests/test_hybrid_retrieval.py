@@ -0,0 +1,52 @@
+import uuid
+
+def enable_hybrid_cache(monkeypatch, chat_module):
+    monkeypatch.setattr(chat_module, "RETRIEVAL_MODE", "hybrid")
+    monkeypatch.setattr(chat_module, "SEMANTIC_CACHE_ENABLED", True)
+
+def test_cached_answers_are_not_shared_across_users_or_filters(monkeypatch, chat_module, fake_bedrock, memory_store, drain_background_work):
+    enable_hybrid_cache(monkeypatch, chat_module)
+    # Retrieval returns the same shared document to everyone, so only the user and filter differ.
+    document = {"source": "document", "id": 1, "role": "document", "content": "Lockers are on floor 2."}
+    monkeypatch.setattr(chat_module.retrieval, "hybrid_search", lambda *args, **kwargs: [document])
+    owner, other = (f"hybrid-{uuid.uuid4().hex[:8]}-{index}" for index in range(2))
+    question = "Where are the lockers?"
+
+    def llm_calls(user_id, **event):
+        fake_bedrock.reset_counters()
+        chat_module.lambda_handler({"input": question, "user_id": user_id, "new_conversation": True, **event}, None)
+        drain_background_work()
+        return fake_bedrock.calls["llm"]
+
+    assert llm_calls(owner) == 1
+    assert llm_calls(owner) == 0
+    assert llm_calls(other) == 1
+    assert llm_calls(owner, document_filter={"team": "blue"}) == 1
+    assert llm_calls(owner, document_filter={"team": "blue"}) == 0
+
+def test_cache_key_covers_every_prompt_input_and_the_user_in_hybrid_mode(monkeypatch, chat_module):
+    state = {"user_id": "u1", "history": [], "summary": None, "relevant_history": "user: my locker code is 4821"}
+    conversation_key = chat_module._semantic_cache_context(state)
+    assert conversation_key != chat_module._semantic_cache_context({**state, "relevant_history": ""})
+    assert conversation_key == chat_module._semantic_cache_context({**state, "user_id": "u2"})
+    monkeypatch.setattr(chat_module, "RETRIEVAL_MODE", "hybrid")
+    hybrid_key = chat_module._semantic_cache_context(state)
+    assert hybrid_key != chat_module._semantic_cache_context({**state, "relevant_history": ""})
+    assert hybrid_key != chat_module._semantic_cache_context({**state, "user_id": "U1"})
+    assert hybrid_key != chat_module._semantic_cache_context({**state, "document_filter": {"team": "blue"}})
+
+def test_streamed_turns_pass_the_document_filter_to_retrieval(monkeypatch, chat_module, memory_store):
+    monkeypatch.setattr(chat_module, "RETRIEVAL_MODE", "hybrid")
+    filters = []
+    search = chat_module.retrieval.hybrid_search
+    def recording_search(*args, metadata_filter=None, **kwargs):
+        filters.append(metadata_filter)
+        return search(*args, metadata_filter=metadata_filter, **kwargs)
+    monkeypatch.setattr(chat_module.retrieval, "hybrid_search", recording_search)
+
+    events = list(chat_module.stream_chat_turn("Which runbook covers failover?", "stream-user", document_filter={"team": "sre"}))
+    assert events[-1]["type"] == "end"
+    assert filters == [{"team": "sre"}]
+
+    events = list(chat_module.stream_chat_turn("Which runbook covers failover?", "stream-user", document_filter=["sre"]))
+    assert [event["type"] for event in events] == ["error"]
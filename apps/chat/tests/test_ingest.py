@@ -0,0 +1,82 @@
+import itertools
+import json
+
+import psycopg2
+
+import ingest
+
+class RecordingConnection:
+    """Stands in for a psycopg2 connection: no content is stored yet, and inserted rows are recorded."""
+
+    def __init__(self, fail_writes=False):
+        self.fail_writes = fail_writes
+        self.rows = []
+        self.rowcount = 0
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchall(self):
+        return []
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+def record_rows(cur, query, rows, page_size=None):
+    if cur.fail_writes:
+        raise psycopg2.OperationalError("server closed the connection unexpectedly")
+    cur.rows.extend(rows)
+    cur.rowcount = len(rows)
+
+def embed_unless_broken(bedrock_client, text):
+    if "broken" in text:
+        raise ValueError("input is too long")
+    return [0.0, 1.0]
+
+def run(monkeypatch, tmp_path, items, conn, start_offset=0):
+    monkeypatch.setattr(ingest, "execute_values", record_rows)
+    monkeypatch.setattr(ingest, "request_embedding", embed_unless_broken)
+    return ingest.bulk_ingest(
+        itertools.islice(iter(items), start_offset, None), None, conn, batch_size=2, max_workers=2,
+        limiter=ingest.AdaptiveRateLimiter(1000.0, 1000.0), checkpoint_path=str(tmp_path / "checkpoint"),
+        start_offset=start_offset, reject_path=str(tmp_path / "rejects.jsonl"),
+    )
+
+def documents(*contents):
+    return [{"content": content, "source": "test"} for content in contents]
+
+def test_failed_documents_are_kept_for_retry(monkeypatch, tmp_path):
+    conn = RecordingConnection()
+    stats = run(monkeypatch, tmp_path, documents("alpha", "broken beta", "gamma", "broken delta", "epsilon"), conn)
+
+    assert (stats["inserted"], stats["failed"], stats["offset"]) == (3, 2, 5)
+    assert [row[0] for row in conn.rows] == ["alpha", "gamma", "epsilon"]
+    rejects = [json.loads(line) for line in (tmp_path / "rejects.jsonl").read_text().splitlines()]
+    assert rejects == documents("broken beta", "broken delta")
+    assert ingest.load_checkpoint(str(tmp_path / "checkpoint")) == 5
+
+def test_a_failed_write_stops_before_the_checkpoint_and_resumes(monkeypatch, tmp_path):
+    items = documents("alpha", "beta", "broken gamma", "delta")
+    run(monkeypatch, tmp_path, items[:2], RecordingConnection())
+    stats = run(monkeypatch, tmp_path, items, RecordingConnection(fail_writes=True), start_offset=2)
+    assert stats["offset"] == 2
+    assert not (tmp_path / "rejects.jsonl").exists()
+
+    offset = ingest.load_checkpoint(str(tmp_path / "checkpoint"))
+    conn = RecordingConnection()
+    stats = run(monkeypatch, tmp_path, items, conn, start_offset=offset)
+    assert [row[0] for row in conn.rows] == ["delta"]
+    assert stats["offset"] == 4
+    assert (tmp_path / "rejects.jsonl").read_text().splitlines() == [json.dumps(items[2])]
@@ -0,0 +1,44 @@
+import uuid
+
+import pytest
+
+@pytest.fixture
+def llm_calls(monkeypatch, chat_module, fake_bedrock, memory_store, drain_background_work):
+    """Runs one turn with the semantic cache enabled and returns how many LLM calls it made."""
+    monkeypatch.setattr(chat_module, "SEMANTIC_CACHE_ENABLED", True)
+
+    def run(question, user_id, **event):
+        fake_bedrock.reset_counters()
+        result = chat_module.lambda_handler({"input": question, "user_id": user_id, **event}, None)
+        assert isinstance(result["response"], str), result
+        drain_background_work()
+        return fake_bedrock.calls["llm"]
+    return run
+
+def new_user():
+    return f"cache-{uuid.uuid4().hex[:8]}"
+
+def test_first_turns_of_the_same_question_share_an_answer(llm_calls):
+    question = "How do I reset my password?"
+    assert llm_calls(question, new_user(), new_conversation=True) == 1
+    assert llm_calls(question, new_user(), new_conversation=True) == 0
+
+def test_different_questions_and_tenants_miss(llm_calls):
+    question = "How do I reset my password?"
+    assert llm_calls(question, new_user(), new_conversation=True, tenant_id="acme") == 1
+    assert llm_calls("Which plans include single sign-on?", new_user(), new_conversation=True, tenant_id="acme") == 1
+    assert llm_calls(question, new_user(), new_conversation=True, tenant_id="globex") == 1
+
+def test_answers_are_not_reused_across_different_earlier_turns(llm_calls, memory_store):
+    # Both conversations end with the same two messages but differ before that.
+    conversations = {}
+    for user_id, topic in ((new_user(), "My dog is called Rex."), (new_user(), "My cat is called Tom.")):
+        conversations[user_id] = memory_store.create_conversation(None, user_id)
+        memory_store.save_messages(None, conversations[user_id], [
+            ("user", topic, None), ("assistant", "Nice to meet your pet!", None),
+            ("user", "Thanks.", None), ("assistant", "You're welcome.", None),
+        ])
+    (first, first_conversation), (second, second_conversation) = conversations.items()
+
+    assert llm_calls("What is my pet called?", first, conversation_id=first_conversation) == 1
+    assert llm_calls("What is my pet called?", second, conversation_id=second_conversation) == 1
@@ -0,0 +1,55 @@
+import subprocess
+import sys
+
+import import_profile
+from config import IMPORT_TIME_BUDGET_MS, IMPORT_RSS_BUDGET_MB
+
+def run_in_fresh_interpreter(code: str) -> str:
+    result = subprocess.run([sys.executable, "-c", code], cwd=import_profile.SRC_DIR, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr[-2000:]
+    return result.stdout.strip()
+
+def test_cold_import_is_within_startup_budget():
+    entries = import_profile.profile_import("chat")
+    total_ms = max(cumulative for cumulative, _, name in entries if name == "chat") / 1000
+    assert total_ms <= IMPORT_TIME_BUDGET_MS
+    assert import_profile.measure_rss_mb("chat") <= IMPORT_RSS_BUDGET_MB
+
+def test_cold_import_leaves_heavy_dependencies_unloaded():
+    loaded = run_in_fresh_interpreter(
+        "import sys, chat; "
+        "print(','.join(m for m in ('psycopg2', 'boto3', 'numpy', 'langgraph', 'langchain_core') if m in sys.modules))"
+    )
+    assert loaded == ""
+
+def test_lazy_modules_are_safe_to_load_from_concurrent_threads():
+    errors = run_in_fresh_interpreter("""
+import threading
+import chat, utils
+
+barrier = threading.Barrier(8)
+errors = []
+
+def first_use():
+    barrier.wait()
+    try:
+        utils.psycopg2.extensions.connection
+        utils.psycopg2.OperationalError
+        utils.boto3.Session
+        chat.db_handler.MESSAGES_TABLE
+        chat.semantic_cache.context_hash
+    except Exception as e:
+        errors.append(repr(e))
+
+threads = [threading.Thread(target=first_use) for _ in range(8)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+print(errors)
+""")
+    assert errors == "[]"
+
+def test_request_path_does_not_import_the_migration_runner():
+    loaded = run_in_fresh_interpreter("import sys, retrieval, archive, conversation_resolver; print('schema' in sys.modules)")
+    assert loaded == "False"
@@ -0,0 +1,34 @@
+import uuid
+
+def seed(memory_store, count):
+    conversation_id = memory_store.create_conversation(None, f"summary-{uuid.uuid4().hex[:8]}")
+    memory_store.save_messages(None, conversation_id, [
+        ("user" if index % 2 == 0 else "assistant", f"message-{index:03d} " + "filler " * (5 + index % 7), None)
+        for index in range(count)
+    ])
+    return conversation_id
+
+def assert_every_message_reaches_the_prompt(chat_module, memory_store, conversation_id):
+    state = chat_module.get_history_from_db({"db_connection": memory_store, "conversation_id": conversation_id})
+    stored = memory_store.get_conversation_summary(None, conversation_id)
+    summarized_up_to = stored["last_message_id"] if stored else 0
+    in_prompt = state["summary"] + "\n".join(message.content for message in state["history"])
+    for message in memory_store._conversation_messages(conversation_id):
+        if message["id"] > summarized_up_to:
+            assert message["content"] in in_prompt, f"message {message['id']} is neither summarized nor in the prompt"
+
+def test_messages_trimmed_from_the_window_stay_in_the_prompt_until_summarized(monkeypatch, chat_module, memory_store):
+    monkeypatch.setattr(chat_module, "CONVERSATION_SUMMARY_ENABLED", True)
+    monkeypatch.setattr(chat_module, "HISTORY_MAX_MESSAGES", 10)
+    monkeypatch.setattr(chat_module, "HISTORY_MAX_TOKENS", 40)  # trims the window well below 10 messages
+    monkeypatch.setattr(chat_module, "SUMMARY_TRIGGER_MESSAGES", 10)
+    conversation_id = seed(memory_store, 14)
+
+    # Too few messages have left the window to summarize, so they are sent verbatim.
+    chat_module.refresh_conversation_summary(conversation_id)
+    assert_every_message_reaches_the_prompt(chat_module, memory_store, conversation_id)
+
+    memory_store.save_messages(None, conversation_id, [("user", f"late-{index} filler filler", None) for index in range(12)])
+    chat_module.refresh_conversation_summary(conversation_id)
+    assert memory_store.get_conversation_summary(None, conversation_id) is not None
+    assert_every_message_reaches_the_prompt(chat_module, memory_store, conversation_id)
@@ -0,0 +1,33 @@
+import logging
+
+import numpy as np
+
+import tracing
+
+def test_summarize_state_does_not_dump_nested_values():
+    summary = tracing.summarize_state({
+        "user_id": {"user_id": "u1", "user_input": "x" * 500, "db_connection": object(), "history": [1, 2, 3]},
+        "query_embedding": np.zeros(4, dtype=np.float32),
+        "db_connection": object(),
+        "response": object(),
+        "cache_hit": False,
+    })
+    assert "db_connection" not in summary and "db_connection" not in summary["user_id"]
+    assert summary["user_id"]["user_input"].endswith("...") and len(summary["user_id"]["user_input"]) == 80
+    assert summary["user_id"]["history"] == "<3 items>"
+    assert summary["query_embedding"] == "<vector (4,)>"
+    assert summary["response"] == "<object>"
+    assert summary["cache_hit"] is False
+
+def test_turn_debug_logs_carry_the_user_id_not_the_input_state(monkeypatch, caplog, chat_module, fake_bedrock, memory_store):
+    monkeypatch.setattr(tracing, "DEBUG_STATE_SAMPLE_RATE", 1.0)
+    with caplog.at_level(logging.DEBUG, logger="tracing"):
+        result = chat_module.lambda_handler({"input": "secret question", "user_id": "u-debug"}, None)
+    assert result["response"].startswith("Answer")
+    state_logs = [record.getMessage() for record in caplog.records if "node" in record.getMessage() and "state:" in record.getMessage()]
+    assert state_logs
+    assert all("<InMemoryStore>" not in message and "db_connection" not in message for message in state_logs)
+    assert any("'user_id': 'u-debug'" in message for message in state_logs[1:])
+
+def test_assign_user_id_sets_a_string(chat_module):
+    assert chat_module.assign_user_id({"user_id": "u1", "user_input": "hi"}) == {"user_id": "u1"}
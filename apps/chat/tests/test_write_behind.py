@@ -0,0 +1,52 @@
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import memory_store as memory_store_module
+
+def test_write_behind_keeps_every_message(monkeypatch, chat_module, memory_store, drain_background_work):
+    monkeypatch.setattr(chat_module, "WRITE_BEHIND_ENABLED", True)
+    users = [f"write-behind-{uuid.uuid4().hex[:8]}-{index}" for index in range(6)]
+    turns = 4
+
+    def run_user(user_id):
+        responses = []
+        for turn in range(turns):
+            result = chat_module.lambda_handler({"input": f"Question {turn} from {user_id}", "user_id": user_id}, None)
+            assert not isinstance(result["response"], dict), result
+            responses.append((result["conversation_id"], result["response"]))
+        return responses
+
+    with ThreadPoolExecutor(max_workers=len(users)) as executor:
+        results = dict(zip(users, executor.map(run_user, users)))
+    drain_background_work()
+
+    for user_id, responses in results.items():
+        conversation_ids = {conversation_id for conversation_id, _ in responses}
+        assert len(conversation_ids) == 1
+        saved = memory_store._conversation_messages(conversation_ids.pop())
+        expected = []
+        for turn, (_, response) in enumerate(responses):
+            expected += [("user", f"Question {turn} from {user_id}"), ("assistant", response)]
+        assert [(message["role"], message["content"]) for message in saved] == expected
+        assert all(message["embedding"] is not None for message in saved)
+
+def test_backfill_skips_messages_that_cannot_be_embedded(monkeypatch, chat_module, fake_bedrock, memory_store):
+    fake_bedrock.max_input_chars = 100
+    monkeypatch.setattr(chat_module, "EMBEDDING_BACKFILL_BATCH_SIZE", 4)
+    monkeypatch.setattr(memory_store_module, "EMBEDDING_BACKFILL_RETRY_SECONDS", 0)
+    conversation_id = memory_store.create_conversation(None, f"backfill-{uuid.uuid4().hex[:8]}")
+    too_long = [("assistant", f"{index} " + "word " * 50, None) for index in range(6)]
+    memory_store.save_messages(None, conversation_id, too_long + [("assistant", "a short answer", None)])
+
+    chat_module.backfill_pending_embeddings()
+    chat_module.backfill_pending_embeddings()
+    messages = memory_store._conversation_messages(conversation_id)
+    assert messages[-1]["embedding"] is not None, "a full batch of failing rows must not starve newer rows"
+
+    for _ in range(memory_store_module.EMBEDDING_BACKFILL_MAX_ATTEMPTS * 2):
+        chat_module.backfill_pending_embeddings()
+    assert all(message["embedding_attempts"] == memory_store_module.EMBEDDING_BACKFILL_MAX_ATTEMPTS for message in messages[:-1])
+    calls = fake_bedrock.calls["embedding"]
+    chat_module.backfill_pending_embeddings()
+    assert fake_bedrock.calls["embedding"] == calls
+    assert len(messages) == 7